@@ -1,75 +1,286 @@
 # app.py - 专用于 Docker 生产环境
 
-from flask import Flask, render_template, jsonify, request
+import time
+
+# 启动耗时的起点，应用加载完成时记录到 puzzle_import_duration_seconds{module="app"}
+_LOAD_START = time.perf_counter()
+
+from flask import Flask, Request, Response, g, render_template, jsonify, request
+from collections import namedtuple
+import gzip
+import hashlib
+import io
 import os
-import uuid
 import json
-import sqlite3
+import random
+import secrets
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：未安装时只使用 gzip
+    brotli = None
 
 # Import game logic modules
+import challenge_verifier
+import grid_codec
+import image_header
+import job_executor
+import lazy_import
+import leaderboard_store
+import metrics
 import puzzle_generator
-import solver
-import vision
-from game_logic import Board, Tile
+import puzzle_pool
+import swap_planner
+from game_logic import CompactBoard
+
+
+class InMemoryUploadRequest(Request):
+    """上传的文件始终保存在内存中（总大小受 MAX_CONTENT_LENGTH 限制），不写入临时文件。"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
 
 
 app = Flask(__name__)
-UPLOAD_FOLDER = 'uploads'
-DATABASE_FILE = 'leaderboard.db'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
-# --- 数据库初始化 ---
-def init_db():
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS scores (
-                difficulty TEXT NOT NULL,
-                username TEXT NOT NULL,
-                best_single_time REAL,
-                best_average_time REAL,
-                PRIMARY KEY (difficulty, username)
-            )
-        ''')
-        conn.commit()
+app.request_class = InMemoryUploadRequest
+DATABASE_FILE = leaderboard_store.DATABASE_FILE
+# 上传图片的大小与像素数上限，可通过环境变量调整
+MAX_UPLOAD_BYTES = int(os.environ.get('PUZZLE_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+MAX_UPLOAD_PIXELS = int(os.environ.get('PUZZLE_MAX_UPLOAD_PIXELS', 40_000_000))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+app.config['MAX_UPLOAD_PIXELS'] = MAX_UPLOAD_PIXELS
+# image_header 不认识的格式（例如 TIFF）交给 OpenCV 解码，由 OpenCV 自己的像素上限保护。
+# 任务进程以 spawn 方式启动并继承环境变量，OpenCV 在导入时读取该设置
+os.environ.setdefault('OPENCV_IO_MAX_IMAGE_PIXELS', str(MAX_UPLOAD_PIXELS))
 
 # 在应用加载时就调用数据库初始化，确保 Gunicorn 能正确执行
-init_db()
+leaderboard = leaderboard_store.LeaderboardStore(DATABASE_FILE)
+leaderboard.init_schema()
+# 挑战令牌的签名密钥：默认保存在数据库中由所有 worker 共享，也可以通过环境变量指定
+CHALLENGE_KEY = os.environ.get('PUZZLE_CHALLENGE_KEY', '').encode('utf-8') or leaderboard.secret('challenge_token')
+
+# CPU 密集型任务（生成、求解、图像识别）在有界进程池中执行
+jobs = job_executor.JobExecutor()
+# 服务端生成或求解的棋盘边长上限，与谜题池一致；更大的棋盘生成与求解都会超过任务时限。
+# puzzle_generator.MAX_ID_SIDE 只是谜题 ID 能编码的上限
+MAX_BOARD_SIDE = puzzle_pool.MAX_POOL_SIDE
+# 小于该字节数的响应不压缩，压缩收益抵不上开销
+COMPRESS_MIN_BYTES = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+_COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain')
+
+
+def _generate_in_pool(width, height):
+    return jobs.run(puzzle_generator.generate_rated_puzzle_compact, width, height)
+
+
+# 预生成谜题池，后台线程在第一次请求时启动
+puzzles = puzzle_pool.PuzzlePool(generate=_generate_in_pool)
+# 按谜题 ID 缓存序列化后的谜题与解，分享的谜题和每日挑战只生成一次，/api/solve 也从这里取解
+puzzle_cache = puzzle_pool.PuzzleCache()
+# 分享的谜题内容由 ID 唯一确定，浏览器可以长期缓存
+PUZZLE_MAX_AGE = 24 * 3600
+# 练习模式的批量谜题单独缓存：一次请求最多 100 道，放进 puzzle_cache 会很快挤掉其他玩家的自定义谜题和挑战谜题。
+# 被淘汰的批量谜题在 /api/solve 中退回服务端求解
+BATCH_CACHE_SIZE = 1024
+batch_cache = puzzle_pool.PuzzleCache(BATCH_CACHE_SIZE)
+# 每道谜题最近一次提示补全出的解：玩家继续推进后，与它一致的格子都可以固定，只需重新求解剩下的格子
+hint_cache = puzzle_pool.PuzzleCache()
+
+
+REQUEST_SECONDS = metrics.Histogram(
+    'puzzle_http_request_duration_seconds', "Request latency by route, method and status.",
+    ['endpoint', 'method', 'status'])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # 用路由模板而不是实际路径作为标签，避免标签数量随请求参数增长
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint,
+                                method=request.method, status=response.status_code)
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """按 Accept-Encoding 用 brotli（已安装时）或 gzip 压缩较大的 JSON / 文本响应。"""
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype not in _COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        body, encoding = brotli.compress(data, quality=BROTLI_QUALITY), 'br'
+    elif accepted['gzip']:
+        body, encoding = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0), 'gzip'
+    else:
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # 压缩后的字节与原响应不同，强 ETag 改为弱 ETag
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+@app.errorhandler(job_executor.JobRejected)
+def handle_job_rejected(error):
+    response = jsonify({"error": str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
 
 # (The rest of your application code remains exactly the same)
 # ... all your routes ...
-def calculate_swaps(initial_grid, final_grid):
-    rows, cols = len(initial_grid), len(initial_grid[0])
-    current_grid_state = [row[:] for row in initial_grid]
-    swaps = []
-    for r_target in range(rows):
-        for c_target in range(cols):
-            correct_tile = final_grid[r_target][c_target]
-            current_tile = current_grid_state[r_target][c_target]
-            if current_tile != correct_tile:
-                found_at = None
-                for r_search in range(r_target, rows):
-                    c_start = c_target + 1 if r_search == r_target else 0
-                    for c_search in range(c_start, cols):
-                        if current_grid_state[r_search][c_search] == correct_tile:
-                            found_at = (r_search, c_search)
-                            break
-                    if found_at:
-                        break
-                if found_at:
-                    r_source, c_source = found_at
-                    swaps.append([(r_target, c_target), (r_source, c_source)])
-                    current_grid_state[r_target][c_target], current_grid_state[r_source][c_source] = \
-                        current_grid_state[r_source][c_source], current_grid_state[r_target][c_target]
-    return swaps
+def calculate_swaps(initial_grid, final_grid, order='default'):
+    return swap_planner.plan_swaps(initial_grid, final_grid, order)
 
 
 def serialize_grid(grid):
     if not grid:
         return None
+    if isinstance(grid, CompactBoard):
+        return grid.to_lists()
     return [[tile.connections if tile else None for tile in row] for row in grid]
 
+
+def _compact_json(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+# 缓存项：两种传输格式下已序列化的棋盘，/api/solve 直接使用的解（连接列表），
+# 以及 puzzle_generator.PuzzleRating（自定义和上传的谜题没有评分，为 None）
+PuzzleEntry = namedtuple('PuzzleEntry', ['shuffled_json', 'solution_json', 'shuffled_packed', 'solution_packed',
+                                         'solution', 'rating'])
+
+
+def _puzzle_entry(shuffled_grid, solution_grid, rating=None):
+    if not isinstance(shuffled_grid, CompactBoard):
+        shuffled_grid = CompactBoard.from_grid(shuffled_grid)
+    if not isinstance(solution_grid, CompactBoard):
+        solution_grid = CompactBoard.from_grid(solution_grid)
+    solution = solution_grid.to_lists()
+    return PuzzleEntry(
+        _compact_json(shuffled_grid.to_lists()), _compact_json(solution),
+        _compact_json(grid_codec.pack_board(shuffled_grid)), _compact_json(grid_codec.pack_board(solution_grid)),
+        solution, rating)
+
+
+def _puzzle_json(puzzle_id, entry, include_solution=True, packed=False):
+    """packed 为真时棋盘使用 grid_codec 的紧凑字符串，并带上 "format": "packed"。"""
+    parts = ['{"puzzle_id":', _compact_json(puzzle_id)]
+    if packed:
+        parts += [',"format":"', grid_codec.PACKED_FORMAT, '","shuffled_grid":', entry.shuffled_packed]
+        if include_solution:
+            parts += [',"solution_grid":', entry.solution_packed]
+    else:
+        parts += [',"shuffled_grid":', entry.shuffled_json]
+        if include_solution:
+            parts += [',"solution_grid":', entry.solution_json]
+    if entry.rating is not None:
+        parts += [',"difficulty":', str(entry.rating.difficulty), ',"unique":', _compact_json(entry.rating.unique)]
+    parts.append('}')
+    return ''.join(parts)
+
+
+def _packed_requested(value):
+    """format=packed 参数或 Accept 中优先的紧凑格式 MIME 类型表示客户端需要紧凑格式。"""
+    if value is not None:
+        return value == grid_codec.PACKED_FORMAT
+    best = request.accept_mimetypes.best_match(['application/json', grid_codec.PACKED_MIMETYPE])
+    return best == grid_codec.PACKED_MIMETYPE
+
+
+def _include_solution(value):
+    """include_solution=0/false 时响应只带打乱的棋盘和谜题 ID，解保留在服务端，由 /api/solve 按 ID 查找。"""
+    return value is None or str(value).lower() not in ('0', 'false', 'no')
+
+
+def _register_puzzle(puzzle_id, shuffled_grid, solution_grid, rating=None, cache=puzzle_cache):
+    entry = _puzzle_entry(shuffled_grid, solution_grid, rating)
+    cache.put(puzzle_id, entry)
+    return entry
+
+
+def _local_puzzle_id(prefix='c-'):
+    # 自定义形状、上传图片和批量生成（前缀 b-）的谜题无法由种子复现，只使用随机 ID 保存在本进程的缓存中；
+    # 长度与种子谜题 ID 不同，parse_puzzle_id 会拒绝它
+    return prefix + secrets.token_urlsafe(12)
+
+
+def _cached_puzzle(puzzle_id):
+    """按 ID 返回缓存项（PuzzleEntry），生成失败时返回 None；ID 无效或尺寸超过上限时抛出 ValueError。"""
+    width, height, _ = puzzle_generator.parse_puzzle_id(puzzle_id)
+    if not _valid_board_size(width, height):
+        raise ValueError("puzzle id exceeds the board size limit")
+
+    def create():
+        shuffled, solution, rating = jobs.run(puzzle_generator.generate_rated_puzzle_by_id, puzzle_id)
+        return _puzzle_entry(shuffled, solution, rating) if solution is not None else None
+
+    return puzzle_cache.get_or_create(puzzle_id, create)
+
+
+def _lookup_solution(puzzle_id, current_grid):
+    """
+    返回谜题的解（连接列表）。缓存中没有时，种子谜题按 ID 重新生成；
+    自定义、上传或批量生成的谜题已被淘汰（或由其他 worker 生成）时，直接求解当前棋盘。
+    """
+    entry = (batch_cache if puzzle_id.startswith('b-') else puzzle_cache).get(puzzle_id)
+    if entry is None:
+        try:
+            entry = _cached_puzzle(puzzle_id)
+        except ValueError:
+            entry = None
+    if entry is not None:
+        return entry.solution
+    return jobs.run(job_executor.solve_grid, current_grid)
+
+
+def _grid_within_limit(grid):
+    """客户端提交的棋盘边长不超过 MAX_BOARD_SIDE；其余格式问题由 _valid_grid 检查。"""
+    return not isinstance(grid, list) or (
+        len(grid) <= MAX_BOARD_SIDE and all(not isinstance(row, list) or len(row) <= MAX_BOARD_SIDE for row in grid))
+
+
+def _valid_grid(grid):
+    if not isinstance(grid, list) or not grid or not all(isinstance(row, list) for row in grid):
+        return False
+    width = len(grid[0])
+    return width > 0 and all(
+        len(row) == width and all(
+            cell is None or (isinstance(cell, (list, tuple)) and len(cell) == 4 and all(v in (0, 1) for v in cell))
+            for cell in row)
+        for row in grid)
+
+
+def _json_response(payload):
+    response = app.response_class(payload, mimetype='application/json')
+    # 谜题的传输格式可以通过 Accept 协商
+    response.vary.add('Accept')
+    return response
+
+
+def _valid_board_size(width, height):
+    return (isinstance(width, int) and isinstance(height, int)
+            and 0 < width <= MAX_BOARD_SIDE and 0 < height <= MAX_BOARD_SIDE)
+
+def _challenge_refused():
+    # 挑战谜题只能通过提交成绩校验，不能按 ID 取解、求解或提示
+    return jsonify({"error": "Challenge puzzles cannot be looked up or solved"}), 403
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -81,13 +292,43 @@ def get_new_puzzle():
         height = int(request.args.get('height', 5))
     except ValueError:
         width, height = 5, 5
-    shuffled_grid, solution_grid = puzzle_generator.generate_random_puzzle(width, height)
-    if shuffled_grid is None:
+    if not _valid_board_size(width, height):
+        return jsonify({"error": "Invalid board size"}), 400
+    seed = request.args.get('seed')
+    if seed is not None:
+        # 指定种子时生成确定的谜题，经由 ID 缓存
+        try:
+            puzzle_id = puzzle_generator.make_puzzle_id(width, height, int(seed))
+        except ValueError:
+            return jsonify({"error": "Invalid seed"}), 400
+        entry = _cached_puzzle(puzzle_id)
+        if entry is None:
+            return jsonify({"error": "Failed to generate puzzle"}), 500
+    else:
+        puzzle_id, shuffled_grid, solution_grid, rating = puzzles.get(width, height)
+        if solution_grid is None:
+            return jsonify({"error": "Failed to generate puzzle"}), 500
+        # 放入缓存，之后通过 ID 分享或求解这道题时无需重新生成
+        entry = _register_puzzle(puzzle_id, shuffled_grid, solution_grid, rating)
+    return _json_response(_puzzle_json(puzzle_id, entry, _include_solution(request.args.get('include_solution')),
+                                       _packed_requested(request.args.get('format'))))
+
+@app.route('/api/puzzle/<puzzle_id>', methods=['GET'])
+def get_puzzle_by_id(puzzle_id):
+    if challenge_verifier.is_challenge_id(puzzle_id):
+        return _challenge_refused()
+    try:
+        entry = _cached_puzzle(puzzle_id)
+    except ValueError:
+        return jsonify({"error": "Unknown puzzle id"}), 404
+    if entry is None:
         return jsonify({"error": "Failed to generate puzzle"}), 500
-    return jsonify({
-        "shuffled_grid": serialize_grid(shuffled_grid),
-        "solution_grid": serialize_grid(solution_grid)
-    })
+    response = _json_response(_puzzle_json(puzzle_id, entry, _include_solution(request.args.get('include_solution')),
+                                           _packed_requested(request.args.get('format'))))
+    response.cache_control.public = True
+    response.cache_control.max_age = PUZZLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/api/new_custom_puzzle', methods=['POST'])
 def get_new_custom_puzzle():
@@ -97,23 +338,103 @@ def get_new_custom_puzzle():
         return jsonify({"error": "无效的形状数据"}), 400
     if not any('x' in row for row in shape):
         return jsonify({"error": "自定义形状必须至少包含一个石板"}), 400
-    shuffled_grid, solution_grid = puzzle_generator.generate_puzzle_from_shape(shape)
+    if not _valid_board_size(max(map(len, shape)), len(shape)):
+        return jsonify({"error": "自定义形状过大"}), 400
+    shuffled_grid, solution_grid = jobs.run(puzzle_generator.generate_puzzle_from_shape_compact, shape)
     if shuffled_grid is None:
         return jsonify({"error": "无法为给定形状生成可解的谜题。请尝试其他形状。"}), 500
-    return jsonify({
-        "shuffled_grid": serialize_grid(shuffled_grid),
-        "solution_grid": serialize_grid(solution_grid)
-    })
+    puzzle_id = _local_puzzle_id()
+    entry = _register_puzzle(puzzle_id, shuffled_grid, solution_grid)
+    return _json_response(_puzzle_json(puzzle_id, entry, _include_solution(data.get('include_solution')),
+                                       _packed_requested(data.get('format'))))
+
+@app.route('/api/puzzles/batch', methods=['GET'])
+def get_puzzle_batch():
+    # 练习模式一次取多道谜题：整批在一次任务中向量化生成，只保存在本进程单独的批量谜题缓存中
+    try:
+        width = int(request.args.get('width', 5))
+        height = int(request.args.get('height', 5))
+        count = int(request.args.get('count', 10))
+    except ValueError:
+        return jsonify({"error": "Invalid batch parameters"}), 400
+    if not (0 < width <= puzzle_generator.MAX_BATCH_SIDE and 0 < height <= puzzle_generator.MAX_BATCH_SIDE
+            and width * height >= 2):
+        return jsonify({"error": "Invalid board size"}), 400
+    if not 0 < count <= puzzle_generator.MAX_BATCH_SIZE:
+        return jsonify({"error": f"count must be between 1 and {puzzle_generator.MAX_BATCH_SIZE}"}), 400
+    include_solution = _include_solution(request.args.get('include_solution'))
+    packed = _packed_requested(request.args.get('format'))
+    batch = jobs.run(puzzle_generator.generate_puzzle_batch_compact, width, height, count)
+    payloads = []
+    for shuffled, solution in batch:
+        puzzle_id = _local_puzzle_id('b-')
+        entry = _register_puzzle(puzzle_id, shuffled, solution, cache=batch_cache)
+        payloads.append(_puzzle_json(puzzle_id, entry, include_solution, packed))
+    return _json_response('{"puzzles":[' + ','.join(payloads) + ']}')
 
 @app.route('/api/solve', methods=['POST'])
 def solve_current_puzzle():
     data = request.json
-    current_grid_data, solution_grid_data = data.get('current_grid'), data.get('solution_grid')
-    if not current_grid_data or not solution_grid_data:
+    # 棋盘可以是 JSON 连接列表，也可以是 grid_codec 的紧凑字符串
+    try:
+        current_grid_data = grid_codec.decode_grid(data.get('current_grid'))
+        solution_grid_data = grid_codec.decode_grid(data.get('solution_grid'))
+    except ValueError:
+        return jsonify({"error": "Invalid grid encoding"}), 400
+    puzzle_id = data.get('puzzle_id')
+    if not current_grid_data or not (solution_grid_data or isinstance(puzzle_id, str)):
+        return jsonify({"error": "Invalid data provided"}), 400
+    if challenge_verifier.is_challenge_id(puzzle_id):
+        return _challenge_refused()
+    if not _grid_within_limit(current_grid_data) or not _grid_within_limit(solution_grid_data):
+        return jsonify({"error": "Board is too large"}), 400
+    order = data.get('order', 'default')
+    if order not in swap_planner.SWAP_ORDERS:
+        return jsonify({"error": "Invalid swap order"}), 400
+    if not _valid_grid(current_grid_data):
         return jsonify({"error": "Invalid data provided"}), 400
-    swaps = calculate_swaps(current_grid_data, solution_grid_data)
+    if not solution_grid_data:
+        # 客户端没有解：按谜题 ID 在服务端查找
+        solution_grid_data = _lookup_solution(puzzle_id, current_grid_data)
+        if solution_grid_data is None:
+            return jsonify({"error": "Puzzle is not solvable"}), 400
+    elif not _valid_grid(solution_grid_data):
+        return jsonify({"error": "Invalid data provided"}), 400
+    if (len(solution_grid_data) != len(current_grid_data)
+            or len(solution_grid_data[0]) != len(current_grid_data[0])):
+        return jsonify({"error": "Grid does not match the puzzle"}), 400
+    swaps = calculate_swaps(current_grid_data, solution_grid_data, order)
     return jsonify({"swaps": swaps})
 
+@app.route('/api/hint', methods=['POST'])
+def get_hint():
+    data = request.json
+    puzzle_id = data.get('puzzle_id')
+    try:
+        current_grid_data = grid_codec.decode_grid(data.get('current_grid'))
+    except ValueError:
+        return jsonify({"error": "Invalid grid encoding"}), 400
+    if not isinstance(puzzle_id, str) or not _valid_grid(current_grid_data):
+        return jsonify({"error": "Invalid data provided"}), 400
+    if challenge_verifier.is_challenge_id(puzzle_id):
+        return _challenge_refused()
+    if not _grid_within_limit(current_grid_data):
+        return jsonify({"error": "Board is too large"}), 400
+    reference = hint_cache.get(puzzle_id) or _lookup_solution(puzzle_id, current_grid_data)
+    if reference is None:
+        return jsonify({"error": "Puzzle is not solvable"}), 400
+    completed = jobs.run(job_executor.complete_grid, current_grid_data, reference)
+    if completed is None:
+        return jsonify({"error": "Grid does not match the puzzle"}), 400
+    hint_cache.put(puzzle_id, completed)
+    swap = swap_planner.next_swap(current_grid_data, completed)
+    # remaining 为执行这一步之后仍不在位置上的石板数
+    after = [list(row) for row in current_grid_data]
+    if swap is not None:
+        (r1, c1), (r2, c2) = swap
+        after[r1][c1], after[r2][c2] = after[r2][c2], after[r1][c1]
+    return jsonify({"swap": swap, "remaining": swap_planner.count_misplaced(after, completed)})
+
 @app.route('/api/upload_image', methods=['POST'])
 def upload_image():
     if 'puzzle_image' not in request.files:
@@ -122,39 +443,71 @@ def upload_image():
     if file.filename == '':
         return jsonify({"error": "No image file selected"}), 400
     if file:
-        filename = str(uuid.uuid4()) + os.path.splitext(file.filename)[1]
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(temp_path)
-        recognized_grid_obj = vision.analyze_image(temp_path)
-        os.remove(temp_path)
+        stream = file.stream
+        image_data = stream.getbuffer() if isinstance(stream, io.BytesIO) else memoryview(stream.read())
+        # 文件头能解析出尺寸时在解码之前拒绝过大的图片；其他格式由 OpenCV 按 OPENCV_IO_MAX_IMAGE_PIXELS 拒绝
+        image_size = image_header.read_image_size(image_data)
+        if image_size is not None and image_size[0] * image_size[1] > app.config['MAX_UPLOAD_PIXELS']:
+            return jsonify({"error": "Image resolution is too large."}), 413
+        # 交给任务进程时需要 pickle，这里复制成 bytes
+        recognized_grid_obj, solution_grid = jobs.run(job_executor.recognize_and_solve, bytes(image_data))
         if recognized_grid_obj is None:
             return jsonify({"error": "Could not recognize a valid puzzle in the image."}), 400
-        shape = [['x' if tile else ' ' for tile in row] for row in recognized_grid_obj]
-        tiles = [tile for row in recognized_grid_obj for tile in row if isinstance(tile, Tile)]
-        solver_board = Board(shape)
-        is_solvable = solver.solve_puzzle(solver_board, tiles)
-        if not is_solvable:
+        if solution_grid is None:
             return jsonify({"error": "Recognized puzzle is not solvable."}), 400
-        return jsonify({
-            "shuffled_grid": serialize_grid(recognized_grid_obj),
-            "solution_grid": serialize_grid(solver_board.grid)
-        })
+        puzzle_id = _local_puzzle_id()
+        entry = _register_puzzle(puzzle_id, recognized_grid_obj, solution_grid)
+        return _json_response(_puzzle_json(puzzle_id, entry, _include_solution(request.form.get('include_solution')),
+                                           _packed_requested(request.form.get('format'))))
     return jsonify({"error": "An unknown error occurred"}), 500
 
 @app.route('/api/challenge/start', methods=['POST'])
 def start_challenge():
     data = request.json
     width, height = data.get('width'), data.get('height')
-    puzzles = []
-    for _ in range(3):
-        shuffled, solution = puzzle_generator.generate_random_puzzle(width, height)
-        if shuffled is None:
-            return jsonify({"error": "Failed to generate a full challenge set"}), 500
-        puzzles.append({
-            "shuffled_grid": serialize_grid(shuffled),
-            "solution_grid": serialize_grid(solution)
-        })
-    return jsonify({"puzzles": puzzles})
+    # 成绩校验的操作记录每个格子下标占一个字节
+    if not _valid_board_size(width, height) or width * height > challenge_verifier.MAX_CELLS:
+        return jsonify({"error": "Invalid board size"}), 400
+    seed = data.get('seed')
+    # 挑战的成绩由服务端重放校验，响应中从不包含解；谜题 ID 也换成加密的挑战 ID，
+    # 客户端无法再用它通过 /api/puzzle、/api/solve、/api/hint 取得解
+    include_solution = False
+    packed = _packed_requested(data.get('format'))
+    payloads, puzzle_ids = [], []
+    if seed is not None:
+        # 指定种子（例如每日挑战使用日期）时，所有玩家得到同一组谜题，从 ID 缓存中取用。
+        # 种子经过密钥派生，客户端无法由种子推算出谜题 ID
+        if not isinstance(seed, (int, str)):
+            return jsonify({"error": "Invalid seed"}), 400
+        rng = random.Random(challenge_verifier.challenge_seed(CHALLENGE_KEY, seed))
+        for _ in range(3):
+            puzzle_id = puzzle_generator.make_puzzle_id(width, height, rng.getrandbits(63))
+            entry = _cached_puzzle(puzzle_id)
+            if entry is None:
+                return jsonify({"error": "Failed to generate a full challenge set"}), 500
+            challenge_id = challenge_verifier.challenge_puzzle_id(CHALLENGE_KEY, puzzle_id)
+            puzzle_ids.append(challenge_id)
+            payloads.append(_puzzle_json(challenge_id, entry, include_solution, packed))
+    else:
+        for _ in range(3):
+            puzzle_id, shuffled, solution, rating = puzzles.get(width, height)
+            if solution is None:
+                return jsonify({"error": "Failed to generate a full challenge set"}), 500
+            entry = _register_puzzle(puzzle_id, shuffled, solution, rating)
+            challenge_id = challenge_verifier.challenge_puzzle_id(CHALLENGE_KEY, puzzle_id)
+            puzzle_ids.append(challenge_id)
+            payloads.append(_puzzle_json(challenge_id, entry, include_solution, packed))
+    # 令牌记录这组谜题与开始时间，提交成绩时据此重放校验
+    token = challenge_verifier.issue_token(CHALLENGE_KEY, puzzle_ids, f'{width}x{height}')
+    return _json_response('{"puzzles":[' + ','.join(payloads) + '],"token":' + json.dumps(token) + '}')
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/pool/stats', methods=['GET'])
+def get_pool_stats():
+    return jsonify(puzzles.stats())
 
 @app.route('/api/leaderboard', methods=['GET'])
 def get_leaderboard_route():
@@ -163,77 +516,61 @@ def get_leaderboard_route():
     username = request.args.get('username')
     if not difficulty or not score_type:
         return jsonify({"error": "Missing parameters"}), 400
-    time_column = "best_single_time" if score_type == 'single' else "best_average_time"
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        query_top_100 = f"""
-            SELECT username, {time_column} as time FROM scores
-            WHERE difficulty = ? AND {time_column} IS NOT NULL
-            ORDER BY {time_column} ASC
-            LIMIT 100
-        """
-        cursor.execute(query_top_100, (difficulty,))
-        top_scores = [dict(row) for row in cursor.fetchall()]
-        user_rank_info = None
-        if username:
-            query_user_rank = f"""
-                SELECT rank, time FROM (
-                    SELECT username, {time_column} as time, RANK() OVER (ORDER BY {time_column} ASC) as rank
-                    FROM scores
-                    WHERE difficulty = ? AND {time_column} IS NOT NULL
-                )
-                WHERE username = ?
-            """
-            cursor.execute(query_user_rank, (difficulty, username))
-            rank_row = cursor.fetchone()
-            if rank_row:
-                user_rank_info = dict(rank_row)
-    return jsonify({
-        "top_scores": top_scores,
-        "user_rank_info": user_rank_info
-    })
+    version, top_scores = leaderboard.top_scores_versioned(difficulty, score_type)
+    user_rank_info = leaderboard.user_rank(difficulty, score_type, username) if username else None
+    # 榜单版本号加上用户自己的排名就能唯一确定响应内容，未变化时直接返回 304，不再序列化
+    etag_source = repr((difficulty, leaderboard_store.time_column(score_type), version, user_rank_info))
+    etag = hashlib.sha1(etag_source.encode('utf-8')).hexdigest()
+    # 压缩过的响应带的是弱 ETag，按弱比较匹配
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify({
+            "top_scores": top_scores,
+            "user_rank_info": user_rank_info
+        })
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/api/leaderboard/submit', methods=['POST'])
 def submit_score():
     data = request.json
-    difficulty = data.get('difficulty')
     username = data.get('username', '匿名玩家').strip()
+    token = data.get('token')
     times = data.get('times')
-    avg_time = data.get('avgTime')
+    moves = data.get('moves')
     if not username: username = '匿名玩家'
-    if not all([difficulty, times, avg_time]):
+    if not all([token, times, moves]):
         return jsonify({"error": "Missing data"}), 400
-    new_single_time = min(times)
-    new_avg_time = avg_time
-    rank = -1
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT best_single_time, best_average_time FROM scores WHERE difficulty = ? AND username = ?", (difficulty, username))
-        existing_record = cursor.fetchone()
-        if existing_record:
-            old_single, old_avg = existing_record
-            if old_single is None or new_single_time < old_single:
-                cursor.execute("UPDATE scores SET best_single_time = ? WHERE difficulty = ? AND username = ?", (new_single_time, difficulty, username))
-            if old_avg is None or new_avg_time < old_avg:
-                cursor.execute("UPDATE scores SET best_average_time = ? WHERE difficulty = ? AND username = ?", (new_avg_time, difficulty, username))
-        else:
-            cursor.execute("INSERT INTO scores (difficulty, username, best_single_time, best_average_time) VALUES (?, ?, ?, ?)",
-                           (difficulty, username, new_single_time, new_avg_time))
-        conn.commit()
-        query_rank = f"""
-            SELECT rank FROM (
-                SELECT username, RANK() OVER (ORDER BY best_average_time ASC) as rank
-                FROM scores
-                WHERE difficulty = ? AND best_average_time IS NOT NULL
-            )
-            WHERE username = ?
-        """
-        cursor.execute(query_rank, (difficulty, username))
-        rank_row = cursor.fetchone()
-        if rank_row:
-            rank = rank_row[0]
-    return jsonify({"success": True, "rank": rank})
+    # 难度取自令牌；每道题的操作记录都在服务端的初始棋盘上重放，解不开或用时不合理的成绩不入榜。
+    # 通过校验后，令牌登记到这个用户名下与写入成绩在同一个事务中完成，之后不能再次提交
+    try:
+        challenge = challenge_verifier.read_token(CHALLENGE_KEY, token)
+        boards = []
+        for challenge_id in challenge['ids']:
+            entry = _cached_puzzle(challenge_verifier.seeded_puzzle_id(CHALLENGE_KEY, challenge_id))
+            if entry is None:
+                return jsonify({"error": "Puzzle not found"}), 404
+            boards.append(grid_codec.unpack_board(json.loads(entry.shuffled_packed)))
+        expires_at = challenge_verifier.token_expiry(challenge)
+        result = {}
+
+        def consume_and_submit(nonce):
+            result['rank'] = leaderboard.submit(challenge['difficulty'], username, min(times),
+                                                sum(times) / len(times), token=(nonce, expires_at))
+            return result['rank'] is not None
+
+        challenge_verifier.verify_submission(challenge, boards, times, moves, consume=consume_and_submit)
+    except challenge_verifier.ScoreRejected as e:
+        return jsonify({"error": str(e), "reason": e.reason}), 400
+    except ValueError:
+        return jsonify({"error": "Invalid puzzle id in challenge token"}), 400
+    return jsonify({"success": True, "rank": result['rank']})
+
+# vision（OpenCV / NumPy）默认在第一次识别图片时才在任务进程中导入，设置 PUZZLE_PRELOAD_VISION=1 时在这里预先导入
+lazy_import.IMPORT_SECONDS.observe(time.perf_counter() - _LOAD_START, module='app')
+lazy_import.preload()
 
 if __name__ == '__main__':
     app.run(debug=True,host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,9 @@
+# benchmarks/__init__.py
+# 生成器、求解器、交换规划、图像识别和冷启动导入的性能基准测试
+#
+# 用法（在项目根目录下）：
+#   python -m benchmarks                                   # 全部基准，结果打印到终端
+#   python -m benchmarks --suites solver --sizes 10,15 --repeat 50
+#   python -m benchmarks --output bench.json               # 保存结果
+#   python -m benchmarks --baseline bench.json --threshold 0.2
+#                                                          # 与基线比较，变慢超过 20% 时以状态码 1 退出
@@ -0,0 +1,63 @@
+# benchmarks/__main__.py
+# 命令行入口：python -m benchmarks --help
+
+import argparse
+import sys
+
+from . import report, suites
+
+
+def _csv(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="谜题生成、求解、交换规划与图像识别的基准测试。")
+    parser.add_argument('--suites', type=_csv, default=list(suites.SUITES),
+                        help=f"逗号分隔的基准组（默认全部：{','.join(suites.SUITES)}）")
+    parser.add_argument('--sizes', type=_csv, default=[str(s) for s in suites.DEFAULT_SIZES],
+                        help="逗号分隔的棋盘边长（默认 %(default)s）")
+    parser.add_argument('--repeat', type=int, default=20, help="每个用例运行的次数（默认 %(default)s）")
+    parser.add_argument('--seed', type=int, default=0, help="第 i 次运行使用种子 seed + i（默认 %(default)s）")
+    parser.add_argument('--filter', default='', help="只运行名称包含该字符串的用例")
+    parser.add_argument('--output', metavar='PATH', help="把结果保存为 JSON")
+    parser.add_argument('--baseline', metavar='PATH', help="与这个 JSON 结果比较")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="指标超过基线的比例上限，超过则视为性能回退（默认 %(default)s）")
+    parser.add_argument('--metric', default=report.DEFAULT_METRIC, help="用于比较的指标（默认 %(default)s）")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.suites if name not in suites.SUITES]
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(unknown)}")
+    try:
+        sizes = [int(size) for size in args.sizes]
+    except ValueError:
+        parser.error("--sizes must be integers")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    results = {}
+    for case in suites.build_cases(args.suites, sizes):
+        if args.filter not in case.name:
+            continue
+        print(f"running {case.name} ...", file=sys.stderr, flush=True)
+        results[case.name] = report.measure(case, args.repeat, args.seed)
+
+    print(report.format_table(results))
+    if args.output:
+        options = {'suites': args.suites, 'sizes': sizes, 'repeat': args.repeat, 'seed': args.seed}
+        report.save_report(report.build_report(results, options), args.output)
+
+    if args.baseline:
+        regressions = report.compare(results, report.load_report(args.baseline), args.threshold, args.metric)
+        for name, base, current, ratio in regressions:
+            print(f"REGRESSION {name}: {args.metric} {base:.2f} -> {current:.2f} ({ratio:.2f}x)")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} on {args.metric}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
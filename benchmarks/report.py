@@ -0,0 +1,96 @@
+# benchmarks/report.py
+# 计时、统计分位数，以及结果的保存与基线比较
+
+import json
+import math
+import platform
+import sys
+import time
+
+PERCENTILES = (50, 90, 99)
+# 与基线比较时默认使用的指标
+DEFAULT_METRIC = 'p50_ms'
+
+
+def percentile(sorted_values, pct):
+    """最近秩法分位数，sorted_values 必须已排序且非空。"""
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def measure(case, repeat, seed):
+    """
+    运行一个基准用例 repeat 次：case.setup(i) 不计时，只对 case.run(*args) 计时。
+    run 返回假值时计为一次失败（例如识别结果与原谜题不一致）。
+    """
+    durations = []
+    failures = 0
+    for i in range(repeat):
+        args = case.setup(seed + i)
+        start = time.perf_counter()
+        ok = case.run(*args)
+        durations.append(time.perf_counter() - start)
+        if not ok:
+            failures += 1
+    durations.sort()
+    total = sum(durations)
+    stats = {
+        'count': repeat,
+        'failures': failures,
+        'mean_ms': total / repeat * 1000,
+        'max_ms': durations[-1] * 1000,
+        'throughput_per_s': repeat / total if total > 0 else None,
+    }
+    for pct in PERCENTILES:
+        stats[f'p{pct}_ms'] = percentile(durations, pct) * 1000
+    return stats
+
+
+def build_report(results, options):
+    return {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'options': options,
+        },
+        'results': results,
+    }
+
+
+def save_report(report, path):
+    with open(path, 'w', encoding='utf-8') as fp:
+        json.dump(report, fp, indent=2, ensure_ascii=False)
+
+
+def load_report(path):
+    with open(path, encoding='utf-8') as fp:
+        return json.load(fp)
+
+
+def compare(results, baseline, threshold, metric=DEFAULT_METRIC):
+    """
+    与基线结果逐项比较，返回 [(name, baseline_value, current_value, ratio)]，
+    只包含 current / baseline 超过 1 + threshold 的用例。两边都有的用例才参与比较。
+    """
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base.get(metric) or stats.get(metric) is None:
+            continue
+        ratio = stats[metric] / base[metric]
+        if ratio > 1 + threshold:
+            regressions.append((name, base[metric], stats[metric], ratio))
+    return regressions
+
+
+def format_table(results):
+    header = f"{'case':<28}{'n':>5}{'fail':>6}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'ops/s':>10}"
+    lines = [header, '-' * len(header)]
+    for name, s in results.items():
+        throughput = f"{s['throughput_per_s']:.1f}" if s['throughput_per_s'] else '-'
+        lines.append(
+            f"{name:<28}{s['count']:>5}{s['failures']:>6}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}"
+            f"{s['p90_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['max_ms']:>10.2f}{throughput:>10}"
+        )
+    return '\n'.join(lines)
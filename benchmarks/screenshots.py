@@ -0,0 +1,54 @@
+# benchmarks/screenshots.py
+# 按游戏的配色合成谜题截图，供图像识别基准使用
+
+import random
+
+import cv2
+import numpy as np
+
+import vision
+
+# 石板底色（BGR），只要与背景色相差足够大即可
+TILE_COLOR = (30, 30, 160)
+CELL_SIZE = 80
+CELL_GAP = 8
+MARGIN = 30
+
+# 各方向的连接位：N、E、S、W
+_SIDE_BITS = (8, 4, 2, 1)
+
+
+def render_board(board, cell=CELL_SIZE, gap=CELL_GAP, margin=MARGIN, rng=random):
+    """把 CompactBoard 画成一张 BGR 图像，每块石板随机使用一种路径颜色。"""
+    background = tuple(int(v) for v in vision.BG_COLOR[0])
+    path_colors = [tuple(int(v) for v in color) for color, _ in vision.PATH_COLORS]
+    img = np.empty((2 * margin + board.height * cell, 2 * margin + board.width * cell, 3), np.uint8)
+    img[:] = background
+    size = cell - gap
+    thickness = max(3, size // 6)
+    for r, c in board.positions():
+        mask = board.masks[r * board.width + c]
+        x0 = margin + c * cell + gap // 2
+        y0 = margin + r * cell + gap // 2
+        cv2.rectangle(img, (x0, y0), (x0 + size - 1, y0 + size - 1), TILE_COLOR, -1)
+        color = rng.choice(path_colors)
+        cx, cy = x0 + size // 2, y0 + size // 2
+        # 路径在石板边缘之前结束，避免相邻石板在二值化后连成一块
+        ends = (
+            (cx, y0 + thickness),
+            (x0 + size - 1 - thickness, cy),
+            (cx, y0 + size - 1 - thickness),
+            (x0 + thickness, cy),
+        )
+        for bit, end in zip(_SIDE_BITS, ends):
+            if mask & bit:
+                cv2.line(img, (cx, cy), end, color, thickness)
+        cv2.circle(img, (cx, cy), thickness, color, -1)
+    return img
+
+
+def encode_png(img):
+    ok, buffer = cv2.imencode('.png', img)
+    if not ok:
+        raise ValueError("could not encode screenshot")
+    return buffer.tobytes()
@@ -0,0 +1,213 @@
+# benchmarks/suites.py
+# 各基准用例：每个用例由不计时的 setup(seed) 和计时的 run(*args) 组成
+
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from collections import Counter, namedtuple
+
+import puzzle_generator
+import solver
+import swap_planner
+import vision
+from game_logic import Board, connections_to_mask
+
+from . import screenshots
+
+Case = namedtuple('Case', ['name', 'setup', 'run'])
+
+SUITES = ('generator', 'solver', 'swaps', 'vision', 'startup')
+DEFAULT_SIZES = (3, 4, 5, 7, 10, 15)
+# 冷启动用例：在新的解释器中执行的语句与额外的环境变量；python 为解释器本身的启动开销，供对照
+STARTUP_CASES = (
+    ('python', 'pass', {}),
+    ('app', 'import app', {'PUZZLE_PRELOAD_VISION': '0'}),
+    ('app+vision', 'import app', {'PUZZLE_PRELOAD_VISION': '1'}),
+    ('vision', 'import vision', {}),
+)
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 图像识别只对不超过该边长的棋盘做基准：vision 会丢弃面积小于整图 1% 的轮廓，
+# 更大的棋盘在合成截图中石板太小，会全部被当作噪声（游戏中最大的难度是 7x7）
+MAX_VISION_SIZE = 7
+
+
+def _ring(size):
+    thickness = max(1, size // 4)
+    return [['x' if min(r, c, size - 1 - r, size - 1 - c) < thickness else ' '
+             for c in range(size)] for r in range(size)]
+
+
+def _cross(size):
+    band = range(size // 3, size - size // 3)
+    return [['x' if r in band or c in band else ' ' for c in range(size)] for r in range(size)]
+
+
+def _diamond(size):
+    mid = size // 2
+    return [['x' if abs(r - mid) + abs(c - mid) <= mid else ' ' for c in range(size)] for r in range(size)]
+
+
+# 自定义形状，尺寸小于 5 时形状退化，不参与基准
+CUSTOM_SHAPES = {'ring': _ring, 'cross': _cross, 'diamond': _diamond}
+
+
+def _random_puzzle(size, seed):
+    # 固定种子保证每次运行的用例相同
+    return puzzle_generator.generate_random_puzzle_compact(size, size, seed=seed)
+
+
+def generator_cases(sizes):
+    cases = []
+    for size in sizes:
+        def setup(seed, size=size):
+            return size, seed
+
+        def run(size, seed):
+            return puzzle_generator.generate_random_puzzle_compact(size, size, seed=seed)[0] is not None
+
+        cases.append(Case(f'generator/{size}x{size}', setup, run))
+    for name, make_shape in CUSTOM_SHAPES.items():
+        for size in sizes:
+            if size < 5:
+                continue
+
+            def setup(seed, shape=make_shape(size)):
+                return shape, seed
+
+            def run(shape, seed):
+                return puzzle_generator.generate_puzzle_from_shape_compact(shape, seed=seed)[0] is not None
+
+            cases.append(Case(f'generator/{name}-{size}', setup, run))
+    # 一次向量化生成一整批，与上面逐个生成的用例对照
+    for size in sizes:
+        def setup(seed, size=size):
+            return size, seed
+
+        def run(size, seed):
+            return len(puzzle_generator.generate_puzzle_batch_compact(
+                size, size, puzzle_generator.MAX_BATCH_SIZE, seed=seed)) == puzzle_generator.MAX_BATCH_SIZE
+
+        cases.append(Case(f'generator/batch-{puzzle_generator.MAX_BATCH_SIZE}/{size}x{size}', setup, run))
+    return cases
+
+
+def solver_cases(sizes):
+    cases = []
+    for size in sizes:
+        def setup(seed, size=size):
+            shuffled, _ = _random_puzzle(size, seed)
+            grid = shuffled.to_grid()
+            shape = shuffled.shape_rows()
+            tiles = [tile for row in grid for tile in row if tile is not None]
+            return Board(shape), tiles
+
+        def run(board, tiles):
+            return solver.solve_puzzle(board, tiles) and board.is_fully_solved()
+
+        cases.append(Case(f'solver/{size}x{size}', setup, run))
+    for name, make_shape in CUSTOM_SHAPES.items():
+        for size in sizes:
+            if size < 5:
+                continue
+
+            def setup(seed, shape=make_shape(size)):
+                shuffled, _ = puzzle_generator.generate_puzzle_from_shape_compact(shape, seed=seed)
+                return (shuffled,)
+
+            def run(shuffled):
+                return solver.solve_compact(shuffled) is not None
+
+            cases.append(Case(f'solver/{name}-{size}', setup, run))
+    for size in sizes:
+        # 生成器评分与唯一性检查使用的计数模式（数到 2 个解为止）
+        def setup(seed, size=size):
+            shuffled, _ = _random_puzzle(size, seed)
+            return (shuffled,)
+
+        def run(shuffled):
+            return solver.count_solutions(shuffled).complete
+
+        cases.append(Case(f'solver/count/{size}x{size}', setup, run))
+    return cases
+
+
+def swap_cases(sizes):
+    cases = []
+    for size in sizes:
+        for order in swap_planner.SWAP_ORDERS:
+            def setup(seed, size=size, order=order):
+                shuffled, solution = _random_puzzle(size, seed)
+                return shuffled.to_lists(), solution.to_lists(), order
+
+            def run(initial, final, order):
+                return swap_planner.plan_swaps(initial, final, order) is not None
+
+            cases.append(Case(f'swaps/{size}x{size}/{order}', setup, run))
+    return cases
+
+
+def vision_cases(sizes):
+    cases = []
+    for size in sizes:
+        if size > MAX_VISION_SIZE:
+            continue
+
+        def setup(seed, size=size):
+            shuffled, _ = _random_puzzle(size, seed)
+            image = screenshots.render_board(shuffled, rng=random.Random(seed))
+            return screenshots.encode_png(image), Counter(shuffled.tile_masks())
+
+        def run(data, expected):
+            grid = vision.analyze_image(data)
+            if grid is None:
+                return False
+            # 只比较识别出的石板类型，不比较位置
+            found = Counter(connections_to_mask(tile.connections) for row in grid for tile in row if tile)
+            return found == expected
+
+        cases.append(Case(f'vision/{size}x{size}', setup, run))
+    return cases
+
+
+_scratch = {}
+
+
+def _scratch_dir():
+    # 冷启动用例在临时目录中运行，导入 app 时创建的数据库和指标文件不会落到仓库里
+    if 'dir' not in _scratch:
+        _scratch['dir'] = tempfile.TemporaryDirectory(prefix='web_puzzle_bench_')
+    return _scratch['dir'].name
+
+
+def startup_cases(sizes):
+    """每次在新的解释器中导入模块，测量 Web worker 冷启动的导入开销（与棋盘尺寸无关）。"""
+    cases = []
+    for name, statement, extra_env in STARTUP_CASES:
+        def setup(seed, statement=statement, extra_env=extra_env):
+            workdir = _scratch_dir()
+            env = dict(os.environ, PYTHONPATH=_REPO_ROOT, PUZZLE_METRICS_DIR=workdir, **extra_env)
+            return [sys.executable, '-c', statement], workdir, env
+
+        def run(command, workdir, env):
+            return subprocess.run(command, cwd=workdir, env=env, capture_output=True).returncode == 0
+
+        cases.append(Case(f'startup/{name}', setup, run))
+    return cases
+
+
+_SUITE_BUILDERS = {
+    'generator': generator_cases,
+    'solver': solver_cases,
+    'swaps': swap_cases,
+    'vision': vision_cases,
+    'startup': startup_cases,
+}
+
+
+def build_cases(suites, sizes):
+    cases = []
+    for suite in suites:
+        cases.extend(_SUITE_BUILDERS[suite](sizes))
+    return cases
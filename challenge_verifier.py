@@ -0,0 +1,206 @@
+# challenge_verifier.py
+# 限时挑战的成绩校验：服务端签名的挑战令牌，以及提交时对操作记录的重放
+#
+# /api/challenge/start 下发一个令牌，签名覆盖 (谜题 ID, 难度, 开始时间, 随机 nonce)；
+# 提交成绩时客户端带上令牌和每道题的操作记录，服务端在谜题的初始棋盘上重放全部交换，
+# 最终棋盘必须是一个解，用时也必须与操作数和服务端记录的开始时间相符。
+# 每个令牌只能成功提交一次：通过校验的 nonce 与提交它的用户名一起记录下来，之后再用同一令牌提交都会被拒绝。
+# 挑战谜题使用单独的 ID（CHALLENGE_ID_PREFIX 开头），其中的种子谜题 ID 用签名密钥加密，
+# 挑战进行中客户端无法通过 /api/puzzle、/api/solve、/api/hint 按 ID 查到解。
+
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import time
+
+import metrics
+from game_logic import CompactBoard
+
+# 令牌的有效期（秒），超过后提交被拒绝
+TOKEN_MAX_AGE = 2 * 3600
+# 签名截取的字节数
+SIGNATURE_BYTES = 16
+# 每次拖放交换至少需要的毫秒数；用时少于 交换次数 x 该值 的成绩视为不可能
+MIN_MOVE_MS = 100
+# 用时之和与服务端实际经过时间比较时的容差（毫秒）。客户端在收到谜题后才开始计时，
+# 正常情况下用时之和总是小于经过时间，这里只容纳计时精度的误差
+CLOCK_TOLERANCE_MS = 1000
+# 令牌中随机 nonce 的字节数，用于识别已经使用过的令牌
+NONCE_BYTES = 12
+# 每道题的操作数上限为格子数乘以该系数，防止超长的记录
+MAX_MOVES_FACTOR = 20
+# 操作记录中每个格子下标占一个字节，255 保留给“重试”（恢复初始棋盘），因此挑战棋盘最多 254 个格子
+MOVE_RESET = 0xFF
+MAX_CELLS = MOVE_RESET - 1
+# 挑战谜题 ID 的前缀，以及其中随机 nonce 的字节数
+CHALLENGE_ID_PREFIX = 'ch-'
+CHALLENGE_ID_NONCE_BYTES = 8
+
+_VERIFICATIONS = metrics.Counter(
+    'puzzle_score_verifications_total', "Challenge score submissions by verification result.", ['result'])
+
+
+class ScoreRejected(ValueError):
+    """提交的成绩未通过校验，reason 为简短的原因代码。"""
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(key, payload):
+    return hmac.new(key, payload, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+
+def issue_token(key, puzzle_ids, difficulty, started=None):
+    """签发挑战令牌；started 为开始时间（Unix 毫秒），默认为当前时间。"""
+    if started is None:
+        started = int(time.time() * 1000)
+    payload = json.dumps({'ids': list(puzzle_ids), 'difficulty': difficulty, 'started': started,
+                          'nonce': secrets.token_urlsafe(NONCE_BYTES)},
+                         separators=(',', ':')).encode('utf-8')
+    return f'{_b64encode(payload)}.{_b64encode(_sign(key, payload))}'
+
+
+def read_token(key, token, max_age=TOKEN_MAX_AGE, now=None):
+    """校验签名与有效期，返回令牌内容 {'ids', 'difficulty', 'started', 'nonce'}；无效时抛出 ScoreRejected。"""
+    try:
+        encoded_payload, encoded_signature = token.split('.')
+        payload = _b64decode(encoded_payload)
+        signature = _b64decode(encoded_signature)
+    except (AttributeError, ValueError):
+        raise ScoreRejected('bad_token', "Malformed challenge token") from None
+    if not hmac.compare_digest(signature, _sign(key, payload)):
+        raise ScoreRejected('bad_token', "Invalid challenge token signature")
+    content = json.loads(payload)
+    now = time.time() * 1000 if now is None else now
+    if now - content['started'] > max_age * 1000:
+        raise ScoreRejected('expired', "Challenge token has expired")
+    return content
+
+
+def _id_keystream(key, nonce):
+    return hmac.new(key, b'challenge-id:' + nonce, hashlib.sha256).digest()
+
+
+def challenge_puzzle_id(key, puzzle_id):
+    """把种子谜题 ID 加密为挑战谜题 ID；每次调用使用新的 nonce，同一道题的挑战 ID 也各不相同。"""
+    packed = _b64decode(puzzle_id)
+    nonce = secrets.token_bytes(CHALLENGE_ID_NONCE_BYTES)
+    hidden = bytes(a ^ b for a, b in zip(packed, _id_keystream(key, nonce)))
+    return CHALLENGE_ID_PREFIX + _b64encode(nonce + hidden)
+
+
+def is_challenge_id(puzzle_id):
+    return isinstance(puzzle_id, str) and puzzle_id.startswith(CHALLENGE_ID_PREFIX)
+
+
+def seeded_puzzle_id(key, challenge_id):
+    """还原挑战谜题 ID 中的种子谜题 ID；格式错误时抛出 ValueError（解出的 ID 仍需由 parse_puzzle_id 校验）。"""
+    if not is_challenge_id(challenge_id):
+        raise ValueError("not a challenge puzzle id")
+    try:
+        data = _b64decode(challenge_id[len(CHALLENGE_ID_PREFIX):])
+    except (TypeError, ValueError):
+        raise ValueError("malformed challenge puzzle id") from None
+    nonce, hidden = data[:CHALLENGE_ID_NONCE_BYTES], data[CHALLENGE_ID_NONCE_BYTES:]
+    if len(nonce) != CHALLENGE_ID_NONCE_BYTES or not hidden:
+        raise ValueError("malformed challenge puzzle id")
+    return _b64encode(bytes(a ^ b for a, b in zip(hidden, _id_keystream(key, nonce))))
+
+
+def challenge_seed(key, seed):
+    """
+    指定种子的挑战（例如每日挑战）所用的随机数种子。经过密钥派生，
+    客户端知道种子也算不出这组谜题的种子谜题 ID。
+    """
+    return hmac.new(key, b'challenge-seed:' + json.dumps(seed).encode('utf-8'), hashlib.sha256).digest()
+
+
+def encode_moves(moves):
+    """把 [(i, j), ...]（格子下标对，None 表示重试）编码为操作记录字符串。"""
+    data = bytearray()
+    for move in moves:
+        data.extend((MOVE_RESET, MOVE_RESET) if move is None else move)
+    return _b64encode(bytes(data))
+
+
+def decode_moves(text):
+    """把操作记录字符串解码为字节串，每两个字节是一次交换的两个格子下标；格式错误时抛出 ScoreRejected。"""
+    try:
+        data = _b64decode(text)
+    except (TypeError, ValueError):
+        raise ScoreRejected('bad_moves', "Malformed move log") from None
+    if len(data) % 2:
+        raise ScoreRejected('bad_moves', "Malformed move log")
+    return data
+
+
+def replay_moves(board, moves):
+    """在初始棋盘上依次执行操作记录（decode_moves 的结果），返回最终的 CompactBoard。"""
+    masks = bytearray(board.masks)
+    cells = board.cells
+    count = len(masks)
+    for k in range(0, len(moves), 2):
+        a, b = moves[k], moves[k + 1]
+        if a == MOVE_RESET and b == MOVE_RESET:
+            masks[:] = board.masks
+            continue
+        if a >= count or b >= count or a == b or not cells[a] or not cells[b]:
+            raise ScoreRejected('bad_moves', "Move log contains an invalid swap")
+        masks[a], masks[b] = masks[b], masks[a]
+    return CompactBoard(board.width, board.height, masks, cells)
+
+
+def verify_run(board, moves_text, time_ms):
+    """校验一道题的操作记录与用时：重放后必须是解，用时不能少于操作数允许的下限。返回交换次数。"""
+    if not isinstance(time_ms, (int, float)) or not 0 < time_ms < TOKEN_MAX_AGE * 1000:
+        raise ScoreRejected('bad_time', "Invalid puzzle time")
+    moves = decode_moves(moves_text)
+    swaps = len(moves) // 2
+    if swaps > MAX_MOVES_FACTOR * len(board.masks):
+        raise ScoreRejected('bad_moves', "Move log is too long")
+    if not replay_moves(board, moves).is_fully_solved():
+        raise ScoreRejected('not_solved', "Move log does not solve the puzzle")
+    if time_ms < swaps * MIN_MOVE_MS:
+        raise ScoreRejected('too_fast', "Puzzle time is shorter than the moves allow")
+    return swaps
+
+
+def token_expiry(content):
+    """令牌的过期时间（Unix 秒），过期后已使用的 nonce 不必再保留。"""
+    return content['started'] / 1000 + TOKEN_MAX_AGE
+
+
+def verify_submission(content, boards, times, move_logs, now=None, consume=None):
+    """
+    校验一次挑战提交。content 为 read_token 的结果，boards 为各谜题的初始棋盘（与 content['ids'] 顺序一致），
+    times / move_logs 为客户端提交的每道题用时（毫秒）和操作记录。所有用时之和不能超过服务端记录的实际经过时间。
+    consume(nonce) 在其余检查都通过后调用，用于登记令牌已被使用（app 在同一个事务中写入成绩）；
+    返回 False 表示令牌已经提交过。
+    通过时返回 None，否则抛出 ScoreRejected；结果都会记录到指标中。
+    """
+    try:
+        if (not isinstance(times, list) or not isinstance(move_logs, list)
+                or not len(times) == len(move_logs) == len(boards)):
+            raise ScoreRejected('bad_request', "Expected one time and one move log per puzzle")
+        for board, moves_text, time_ms in zip(boards, move_logs, times):
+            verify_run(board, moves_text, time_ms)
+        now = time.time() * 1000 if now is None else now
+        if sum(times) > now - content['started'] + CLOCK_TOLERANCE_MS:
+            raise ScoreRejected('too_fast', "Total time exceeds the time since the challenge started")
+        if consume is not None and not consume(content['nonce']):
+            raise ScoreRejected('replayed', "Challenge token has already been used")
+    except ScoreRejected as error:
+        _VERIFICATIONS.inc(result=error.reason)
+        raise
+    _VERIFICATIONS.inc(result='accepted')
@@ -1,8 +1,36 @@
 # game_logic.py
 # 定义游戏的核心对象 Tile 和 Board
 
+from collections import deque
+
+# 四个方向的顺序与 Tile.connections 一致：北、东、南、西
+DIRECTIONS = ((-1, 0), (0, 1), (1, 0), (0, -1))
+# 每个方向在 4 位连接掩码中对应的位，与 format(mask, '04b') 的顺序一致
+SIDE_BITS = (8, 4, 2, 1)
+
+
+def connections_to_mask(connections):
+    """将 (N, E, S, W) 连接元组编码为 4 位掩码。"""
+    mask = 0
+    for bit, connected in zip(SIDE_BITS, connections):
+        if connected:
+            mask |= bit
+    return mask
+
+
+def mask_to_connections(mask):
+    """将 4 位掩码解码为 (N, E, S, W) 连接元组。"""
+    return tuple(1 if mask & bit else 0 for bit in SIDE_BITS)
+
+
+# 每个掩码对应的连接元组，避免反复解码
+MASK_CONNECTIONS = tuple(mask_to_connections(mask) for mask in range(16))
+
+
 class Tile:
     """表示一个状态固定的石板。"""
+    __slots__ = ('connections', 'id')
+
     def __init__(self, connections, tile_id=None):
         self.connections = tuple(connections)
         self.id = tile_id if tile_id is not None else id(self)
@@ -17,14 +45,127 @@ class Tile:
         return f"T{self.connections}"
 
 
+class CompactBoard:
+    """
+    紧凑的棋盘表示：按行优先存放在 bytearray 中的 4 位连接掩码，以及同样布局的形状掩码（1 表示形状内）。
+    不为每个格子分配对象，生成器、求解器和序列化都可以直接在上面操作；
+    to_grid / from_grid 负责与 Tile 网格互相转换。
+    """
+    __slots__ = ('width', 'height', 'masks', 'cells')
+
+    def __init__(self, width, height, masks=None, cells=None):
+        self.width = width
+        self.height = height
+        self.masks = bytearray(width * height) if masks is None else bytearray(masks)
+        self.cells = bytearray(width * height) if cells is None else bytearray(cells)
+
+    @classmethod
+    def from_shape(cls, shape):
+        """由 'x' / ' ' 组成的形状创建一个没有连接的棋盘。"""
+        height, width = len(shape), len(shape[0])
+        cells = bytearray(1 if shape[r][c] == 'x' else 0 for r in range(height) for c in range(width))
+        return cls(width, height, cells=cells)
+
+    @classmethod
+    def from_grid(cls, grid):
+        """由 Tile 网格或 JSON 形式的连接列表网格创建，None 表示形状外的格子。"""
+        height, width = len(grid), len(grid[0])
+        board = cls(width, height)
+        for r in range(height):
+            for c in range(width):
+                item = grid[r][c]
+                if item is None:
+                    continue
+                connections = item.connections if isinstance(item, Tile) else item
+                board.masks[r * width + c] = connections_to_mask(connections)
+                board.cells[r * width + c] = 1
+        return board
+
+    def copy(self):
+        return CompactBoard(self.width, self.height, self.masks, self.cells)
+
+    def positions(self):
+        """形状内所有格子的 (r, c)，按行优先排列。"""
+        width = self.width
+        return [divmod(i, width) for i, cell in enumerate(self.cells) if cell]
+
+    def tile_masks(self):
+        """形状内所有格子上的掩码，与 positions() 顺序一致。"""
+        return [self.masks[i] for i, cell in enumerate(self.cells) if cell]
+
+    def shape_rows(self):
+        """转换为 Board 使用的形状列表。"""
+        width = self.width
+        return [['x' if self.cells[r * width + c] else ' ' for c in range(width)]
+                for r in range(self.height)]
+
+    def to_grid(self):
+        """转换为 Tile 网格。"""
+        width = self.width
+        return [[Tile(MASK_CONNECTIONS[self.masks[r * width + c]]) if self.cells[r * width + c] else None
+                 for c in range(width)]
+                for r in range(self.height)]
+
+    def to_lists(self):
+        """转换为 JSON 形式的连接列表网格，与 serialize_grid 的输出一致。"""
+        width = self.width
+        return [[MASK_CONNECTIONS[self.masks[r * width + c]] if self.cells[r * width + c] else None
+                 for c in range(width)]
+                for r in range(self.height)]
+
+    def is_fully_solved(self):
+        """直接在掩码上检查：所有连接都被对面接住且整个形状连通。"""
+        width, height = self.width, self.height
+        masks, cells = self.masks, self.cells
+        start = -1
+        total = 0
+        for i, cell in enumerate(cells):
+            if not cell:
+                continue
+            total += 1
+            start = i
+            r, c = divmod(i, width)
+            mask = masks[i]
+            for d, (dr, dc) in enumerate(DIRECTIONS):
+                if not mask & SIDE_BITS[d]:
+                    continue
+                nr, nc = r + dr, c + dc
+                if not (0 <= nr < height and 0 <= nc < width):
+                    return False
+                j = nr * width + nc
+                if not cells[j] or not masks[j] & SIDE_BITS[(d + 2) % 4]:
+                    return False
+        if total == 0:
+            return True
+
+        offsets = (-width, 1, width, -1)
+        visited = {start}
+        q = deque([start])
+        while q:
+            i = q.popleft()
+            mask = masks[i]
+            for d in range(4):
+                if mask & SIDE_BITS[d]:
+                    j = i + offsets[d]
+                    if j not in visited:
+                        visited.add(j)
+                        q.append(j)
+        return len(visited) == total
+
+
 class Board:
-    """表示游戏棋盘。"""
+    """
+    表示游戏棋盘。
+    place_tile / remove_tile 会增量维护已填充的形状格数、不匹配或悬空的连接数，
+    以及一个可回滚的并查集，因此 is_fully_solved() 是 O(1) 查询。
+    """
     def __init__(self, shape):
         self.shape = [list(row) for row in shape]
         self.height = len(self.shape)
         self.width = len(self.shape[0])
         self.grid = [[None for _ in range(self.width)] for _ in range(self.height)]
         self.empty_slots = self._get_empty_slots()
+        self._reset_state()
 
     def _get_empty_slots(self):
         slots = []
@@ -34,6 +175,32 @@ class Board:
                     slots.append((r, c))
         return slots
 
+    def _reset_state(self):
+        self.filled_count = 0        # 形状内已放置石板的格数
+        self.outside_count = 0       # 形状外被放置了石板的格数
+        self.open_edge_count = 0     # 没有被对面石板接住的连接数（悬空或不匹配）
+        self.component_count = 0     # 已放置石板按连接划分的连通块数
+        self._parent = list(range(self.height * self.width))
+        self._size = [1] * (self.height * self.width)
+        # 每次放置一帧：(格子下标, 该次放置产生的合并记录)，用于回溯时撤销
+        self._history = []
+
+    @classmethod
+    def from_compact(cls, compact):
+        """由 CompactBoard 创建一个放好石板的 Board。"""
+        board = cls(compact.shape_rows())
+        board.set_grid(compact.to_grid())
+        return board
+
+    def set_grid(self, grid):
+        """用给定的网格替换当前棋盘内容，并重建增量状态。"""
+        self.grid = [[None for _ in range(self.width)] for _ in range(self.height)]
+        self._reset_state()
+        for r in range(self.height):
+            for c in range(self.width):
+                if grid[r][c] is not None:
+                    self.place_tile(grid[r][c], r, c)
+
     def is_valid_placement(self, tile, r, c):
         directions = [(-1, 0, 0, 2), (0, 1, 1, 3), (1, 0, 2, 0), (0, -1, 3, 1)]
         for dr, dc, my_side, neighbor_side in directions:
@@ -44,7 +211,19 @@ class Board:
                     return False
         return True
 
-    def is_fully_solved(self):
+    def is_fully_solved(self, full_check=False):
+        """
+        判断棋盘是否已经完整、连接正确且全部连通。
+        默认直接读取增量状态；full_check=True 时重新扫描整个棋盘，供测试校验增量状态使用。
+        """
+        if full_check:
+            return self._scan_fully_solved()
+        return (self.filled_count == len(self.empty_slots)
+                and self.outside_count == 0
+                and self.open_edge_count == 0
+                and self.component_count <= 1)
+
+    def _scan_fully_solved(self):
         all_tile_coords = []
 
         for r in range(self.height):
@@ -84,10 +263,10 @@ class Board:
                 if not has_west_neighbor or not self.grid[r][c - 1] or self.grid[r][c - 1].connections[1] != 1:
                     return False
 
-        q = [all_tile_coords[0]]
+        q = deque([all_tile_coords[0]])
         visited = {all_tile_coords[0]}
         while q:
-            r, c = q.pop(0)
+            r, c = q.popleft()
             tile = self.grid[r][c]
             if tile.connections[0] == 1 and (r - 1, c) not in visited:
                 visited.add((r - 1, c))
@@ -104,8 +283,108 @@ class Board:
 
         return len(visited) == len(all_tile_coords)
 
+    def _find(self, i):
+        # 不做路径压缩，以便按栈顺序撤销合并
+        while self._parent[i] != i:
+            i = self._parent[i]
+        return i
+
+    def _union(self, a, b, merges):
+        ra, rb = self._find(a), self._find(b)
+        if ra == rb:
+            return
+        if self._size[ra] < self._size[rb]:
+            ra, rb = rb, ra
+        self._parent[rb] = ra
+        self._size[ra] += self._size[rb]
+        self.component_count -= 1
+        merges.append((ra, rb))
+
+    def _link(self, r, c):
+        """统计 (r, c) 上石板对周围连接的影响，并与相连的邻居合并，返回合并记录。"""
+        connections = self.grid[r][c].connections
+        i = r * self.width + c
+        merges = []
+        for d, (dr, dc) in enumerate(DIRECTIONS):
+            nr, nc = r + dr, c + dc
+            neighbor = None
+            if 0 <= nr < self.height and 0 <= nc < self.width:
+                neighbor = self.grid[nr][nc]
+            neighbor_open = neighbor is not None and neighbor.connections[(d + 2) % 4] == 1
+            if connections[d] == 1:
+                if neighbor_open:
+                    # 邻居原本悬空的连接被接住
+                    self.open_edge_count -= 1
+                    self._union(i, nr * self.width + nc, merges)
+                else:
+                    self.open_edge_count += 1
+        return merges
+
+    def _unlink(self, r, c):
+        """_link 的逆操作，只更新连接计数，并查集由调用方负责。"""
+        connections = self.grid[r][c].connections
+        for d, (dr, dc) in enumerate(DIRECTIONS):
+            if connections[d] != 1:
+                continue
+            nr, nc = r + dr, c + dc
+            neighbor = None
+            if 0 <= nr < self.height and 0 <= nc < self.width:
+                neighbor = self.grid[nr][nc]
+            if neighbor is not None and neighbor.connections[(d + 2) % 4] == 1:
+                self.open_edge_count += 1
+            else:
+                self.open_edge_count -= 1
+
+    def _rebuild_components(self):
+        """按原放置顺序重建并查集，用于非栈序的移除。"""
+        order = [i for i, _ in self._history]
+        self._parent = list(range(self.height * self.width))
+        self._size = [1] * (self.height * self.width)
+        self._history = []
+        self.component_count = len(order)
+        for i in order:
+            r, c = divmod(i, self.width)
+            merges = []
+            for d, (dr, dc) in enumerate(DIRECTIONS):
+                nr, nc = r + dr, c + dc
+                if not (0 <= nr < self.height and 0 <= nc < self.width):
+                    continue
+                neighbor = self.grid[nr][nc]
+                if (self.grid[r][c].connections[d] == 1 and neighbor is not None
+                        and neighbor.connections[(d + 2) % 4] == 1):
+                    self._union(i, nr * self.width + nc, merges)
+            self._history.append((i, merges))
+
     def place_tile(self, tile, r, c):
+        if self.grid[r][c] is not None:
+            self.remove_tile(r, c)
         self.grid[r][c] = tile
+        if self.shape[r][c] == 'x':
+            self.filled_count += 1
+        else:
+            self.outside_count += 1
+        self.component_count += 1
+        self._history.append((r * self.width + c, self._link(r, c)))
 
     def remove_tile(self, r, c):
-        self.grid[r][c] = None
+        if self.grid[r][c] is None:
+            return
+        self._unlink(r, c)
+        if self.shape[r][c] == 'x':
+            self.filled_count -= 1
+        else:
+            self.outside_count -= 1
+
+        i = r * self.width + c
+        if self._history and self._history[-1][0] == i:
+            # 回溯时的常见情形：撤销最近一次放置产生的合并
+            _, merges = self._history.pop()
+            for ra, rb in reversed(merges):
+                self._parent[rb] = rb
+                self._size[ra] -= self._size[rb]
+            self.component_count += len(merges) - 1
+            self.grid[r][c] = None
+        else:
+            self.grid[r][c] = None
+            self._history = [frame for frame in self._history if frame[0] != i]
+            self._rebuild_components()
@@ -0,0 +1,89 @@
+# grid_codec.py
+# 棋盘的紧凑传输格式：每块石板一个十六进制半字节（连接掩码），外加一张形状位图
+#
+# 编码结果是一个字符串 "<宽>x<高>:<形状>:<石板>"：
+#   形状 —— 按行优先排列的形状位图（1 表示形状内），每 4 个格子一个十六进制字符，
+#          末尾不足 4 位时补 0；整个矩形都在形状内时为空字符串
+#   石板 —— 形状内每个格子一个十六进制字符，按行优先排列，数值即 N=8、E=4、S=2、W=1 的连接掩码
+# 例如 2x2 的环形解为 "2x2::63c9"。10x10 的棋盘只需约 107 个字符，而 JSON 连接列表需要 1 KB 以上。
+
+from game_logic import CompactBoard
+
+# 通过 Accept 头或 format 参数协商使用的格式名称
+PACKED_FORMAT = 'packed'
+PACKED_MIMETYPE = 'application/vnd.web-puzzle.packed+json'
+# 单边长度上限，防止解码时按请求中的尺寸分配过大的内存
+MAX_SIDE = 255
+
+_HEX_DIGITS = '0123456789abcdef'
+
+
+def pack_board(board):
+    """把 CompactBoard 编码为紧凑字符串。"""
+    width, height = board.width, board.height
+    cells, masks = board.cells, board.masks
+    shape = ''
+    if not all(cells):
+        bits = ''.join('1' if cell else '0' for cell in cells)
+        bits += '0' * (-len(bits) % 4)
+        shape = ''.join(_HEX_DIGITS[int(bits[i:i + 4], 2)] for i in range(0, len(bits), 4))
+    tiles = ''.join(_HEX_DIGITS[masks[i]] for i, cell in enumerate(cells) if cell)
+    return f'{width}x{height}:{shape}:{tiles}'
+
+
+def pack_grid(grid):
+    """把 CompactBoard、Tile 网格或 JSON 连接列表网格编码为紧凑字符串，空网格返回 None。"""
+    if not grid:
+        return None
+    if not isinstance(grid, CompactBoard):
+        grid = CompactBoard.from_grid(grid)
+    return pack_board(grid)
+
+
+def unpack_board(packed):
+    """把紧凑字符串解码为 CompactBoard，格式不正确时抛出 ValueError。"""
+    if not isinstance(packed, str):
+        raise ValueError("packed grid must be a string")
+    try:
+        size, shape, tiles = packed.split(':')
+        width, height = (int(side) for side in size.split('x'))
+    except ValueError:
+        raise ValueError(f"malformed packed grid: {packed[:32]!r}") from None
+    if not (0 < width <= MAX_SIDE and 0 < height <= MAX_SIDE):
+        raise ValueError("packed grid has an invalid size")
+    count = width * height
+    try:
+        if shape:
+            if len(shape) != (count + 3) // 4:
+                raise ValueError("packed shape does not match the grid size")
+            bits = ''.join(format(int(digit, 16), '04b') for digit in shape)
+            cells = bytearray(1 if bit == '1' else 0 for bit in bits[:count])
+        else:
+            cells = bytearray(b'\x01' * count)
+        tile_masks = [int(digit, 16) for digit in tiles]
+    except ValueError:
+        raise ValueError("packed grid contains invalid hex digits") from None
+    if len(tile_masks) != sum(cells):
+        raise ValueError("packed tiles do not match the shape")
+    board = CompactBoard(width, height, cells=cells)
+    masks = iter(tile_masks)
+    for i, cell in enumerate(cells):
+        if cell:
+            board.masks[i] = next(masks)
+    return board
+
+
+def unpack_grid(packed):
+    """把紧凑字符串解码为 JSON 连接列表网格（与 serialize_grid 的输出一致），格式不正确时抛出 ValueError。"""
+    return unpack_board(packed).to_lists()
+
+
+def decode_grid(value):
+    """
+    解析请求中的棋盘：紧凑字符串会被解码，JSON 连接列表网格原样返回，
+    /api/solve 因此可以同时接受两种格式。格式不正确时抛出 ValueError。
+    """
+    if isinstance(value, str):
+        return unpack_grid(value)
+    return value
+
@@ -0,0 +1,14 @@
+# gunicorn.conf.py
+# Gunicorn 默认读取当前目录下的这个文件；命令行参数（例如 Dockerfile 中的 --workers）优先于这里的设置
+
+import metrics
+
+
+def on_starting(server):
+    # 新的一次运行从零开始计数（Prometheus 把它视为一次重启），清空上一次运行留下的指标与归档
+    metrics.clear()
+
+
+def child_exit(server, worker):
+    # worker 退出（重启、超时被杀）后把它的指标并入归档，汇总的计数器不会因此减小
+    metrics.remove_process(worker.pid)
@@ -0,0 +1,57 @@
+# image_header.py
+# 只解析图片文件头来获取尺寸，不依赖 OpenCV，Web 进程在把图片交给识别任务之前用它限制像素数
+
+import struct
+
+
+def read_image_size(data):
+    """
+    只读取文件头，返回编码图像的 (width, height)，无法识别的格式返回 None。
+    支持 PNG、JPEG、BMP 和 WebP，用于在解码之前限制像素数量。
+    """
+    view = memoryview(data)
+    head = bytes(view[:32])
+    try:
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head.startswith(b'BM'):
+            width, height = struct.unpack('<ii', head[18:26])
+            return width, abs(height)
+        if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+            chunk = head[12:16]
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', head[26:30])
+                return width & 0x3fff, height & 0x3fff
+            if chunk == b'VP8L':
+                bits = struct.unpack('<I', head[21:25])[0]
+                return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+            if chunk == b'VP8X':
+                return (int.from_bytes(head[24:27], 'little') + 1,
+                        int.from_bytes(head[27:30], 'little') + 1)
+            return None
+        if head.startswith(b'\xff\xd8'):
+            return _read_jpeg_size(view)
+    except struct.error:
+        return None
+    return None
+
+
+def _read_jpeg_size(view):
+    # 逐个跳过 JPEG 段，直到遇到记录尺寸的 SOF 段
+    i = 2
+    while i + 4 <= len(view):
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = struct.unpack('>H', bytes(view[i + 2:i + 4]))[0]
+        if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+            height, width = struct.unpack('>HH', bytes(view[i + 5:i + 9]))
+            return width, height
+        i += 2 + length
+    return None
@@ -0,0 +1,210 @@
+# job_executor.py
+# 把生成、求解、图像识别等 CPU 密集型任务放到有界进程池中执行
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import lazy_import
+import metrics
+import solver
+from game_logic import Board, CompactBoard, Tile
+
+# 进程数为 0 时任务直接在请求线程中执行（便于本地调试）
+JOB_WORKERS = int(os.environ.get('PUZZLE_JOB_WORKERS', min(4, os.cpu_count() or 1)))
+# 除正在执行的任务外，最多允许排队的任务数；超过后立即拒绝
+JOB_QUEUE_SIZE = int(os.environ.get('PUZZLE_JOB_QUEUE_SIZE', 2 * max(JOB_WORKERS, 1)))
+# 单个任务的默认超时（秒）
+JOB_TIMEOUT = float(os.environ.get('PUZZLE_JOB_TIMEOUT', 10))
+# 拒绝任务时建议客户端等待的秒数（Retry-After）
+RETRY_AFTER_SECONDS = 2
+# 终止工作进程后等待它退出的最长秒数，退出后才能把它的指标并入归档
+_TERMINATE_WAIT = 1.0
+
+_JOB_SECONDS = metrics.Histogram(
+    'puzzle_job_duration_seconds', "Time from submitting a job to receiving its result.", ['job'])
+_JOB_REJECTIONS = metrics.Counter(
+    'puzzle_job_rejections_total', "Jobs that were not run to completion.", ['job', 'reason'])
+
+
+class JobRejected(Exception):
+    """任务无法执行：队列已满、超时或工作进程崩溃。retry_after 为建议的重试等待秒数。"""
+    def __init__(self, message, retry_after=RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobQueueFull(JobRejected):
+    pass
+
+
+class JobTimeout(JobRejected):
+    pass
+
+
+class JobExecutor:
+    """
+    有界的进程池：同时在执行和排队的任务数不超过 max_workers + queue_size，
+    超出时 run() 立即抛出 JobQueueFull，而不是让请求无限等待。
+    任务超时后会被取消；如果已经在执行，由于单个工作进程无法被单独中断，这个进程池不再接收新任务（之后的任务
+    使用新建的进程池），等它上面其他仍在执行的任务都结束后，再终止其中的工作进程，不影响其他请求的任务。
+    进程池在第一次使用时才创建，并按 PID 区分，保证 Gunicorn fork 出的每个 worker 使用自己的进程池。
+    """
+    def __init__(self, max_workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE, timeout=JOB_TIMEOUT):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(max_workers, 1) + queue_size)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        # 每个进程池上尚未结束的任务；已退役的进程池上超时仍在执行的任务
+        self._inflight = {}
+        self._stuck = {}
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=lazy_import.preload,
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    @staticmethod
+    def _terminate(pool):
+        # ProcessPoolExecutor 没有公开终止单个任务的接口，只能终止它的工作进程；
+        # 被终止的进程来不及在退出时处理自己的指标文件，等它退出后由这里并入归档
+        processes = list((pool._processes or {}).values())
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(_TERMINATE_WAIT)
+            if not process.is_alive():
+                metrics.remove_process(process.pid)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _recycle(self, pool):
+        """进程池已损坏：立即终止并在下次使用时重建。"""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        self._terminate(pool)
+
+    def _retire(self, pool, future):
+        """future 超时仍在执行：pool 不再接收新任务，其余任务都结束后终止它的工作进程。"""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+            stuck = self._stuck.setdefault(pool, set())
+            stuck.add(future)
+            ready = self._inflight.get(pool, set()) <= stuck
+            if ready:
+                self._inflight.pop(pool, None)
+                self._stuck.pop(pool)
+        if ready:
+            self._terminate(pool)
+
+    def _job_done(self, pool, future):
+        self._slots.release()
+        with self._lock:
+            pending = self._inflight.get(pool)
+            if pending is None:
+                return
+            pending.discard(future)
+            stuck = self._stuck.get(pool)
+            ready = stuck is not None and pending <= stuck
+            if ready or (not pending and self._pool is not pool):
+                self._inflight.pop(pool)
+                self._stuck.pop(pool, None)
+        if ready:
+            self._terminate(pool)
+
+    def run(self, fn, *args, timeout=None):
+        """在进程池中执行 fn(*args) 并等待结果。fn 与参数、返回值都必须可以被 pickle。"""
+        job = getattr(fn, '__name__', 'job')
+        if not self._slots.acquire(blocking=False):
+            _JOB_REJECTIONS.inc(job=job, reason='queue_full')
+            raise JobQueueFull("Server is busy, please retry later.")
+        with _JOB_SECONDS.time(job=job):
+            return self._run(job, fn, args, timeout)
+
+    def _run(self, job, fn, args, timeout):
+        if self.max_workers == 0:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        pool = self._get_pool()
+        try:
+            future = pool.submit(fn, *args)
+        except (BrokenProcessPool, RuntimeError):
+            self._slots.release()
+            self._recycle(pool)
+            _JOB_REJECTIONS.inc(job=job, reason='pool_restarted')
+            raise JobRejected("Worker pool restarted, please retry.")
+        with self._lock:
+            self._inflight.setdefault(pool, set()).add(future)
+        future.add_done_callback(lambda done: self._job_done(pool, done))
+
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            if not future.cancel():
+                self._retire(pool, future)
+            _JOB_REJECTIONS.inc(job=job, reason='timeout')
+            raise JobTimeout("Job timed out.")
+        except BrokenProcessPool:
+            self._recycle(pool)
+            _JOB_REJECTIONS.inc(job=job, reason='crashed')
+            raise JobRejected("Worker process crashed, please retry.")
+
+
+# --- 在工作进程中执行的任务 ---
+
+def recognize_and_solve(image_data):
+    """
+    识别图片中的谜题并求解。
+    返回 (识别出的 Tile 网格, 解的 Tile 网格)；无法识别时两者都为 None，无解时解为 None。
+    """
+    # vision 在第一次识别图片时才导入，只做生成和求解的任务进程不会加载 OpenCV
+    recognized_grid = lazy_import.vision().analyze_image(image_data)
+    if recognized_grid is None:
+        return None, None
+    shape = [['x' if tile else ' ' for tile in row] for row in recognized_grid]
+    tiles = [tile for row in recognized_grid for tile in row if isinstance(tile, Tile)]
+    solver_board = Board(shape)
+    if not solver.solve_puzzle(solver_board, tiles):
+        return recognized_grid, None
+    return recognized_grid, solver_board.grid
+
+
+def solve_grid(grid):
+    """求解以连接列表表示的棋盘（None 表示形状外的格子），返回解的连接列表网格，无解时返回 None。"""
+    solved = solver.solve_compact(CompactBoard.from_grid(grid))
+    return solved.to_lists() if solved is not None else None
+
+
+def complete_grid(current_grid, reference_grid):
+    """
+    提示用：当前棋盘中与 reference_grid（谜题的某个解）一致的格子保持不动，只重新求解其余格子，
+    尽量保留玩家按其他解放对的石板。返回补全后的连接列表网格；超过节点上限时退回 reference_grid；
+    两个棋盘的形状或石板组合不一致（不是同一道谜题）时返回 None。
+    """
+    current = CompactBoard.from_grid(current_grid)
+    reference = CompactBoard.from_grid(reference_grid)
+    if (current.width, current.height, current.cells) != (reference.width, reference.height, reference.cells):
+        return None
+    if sorted(current.tile_masks()) != sorted(reference.tile_masks()):
+        return None
+    if current.is_fully_solved():
+        return current.to_lists()
+    fixed = [(r, c) for r, c in current.positions()
+             if current.masks[r * current.width + c] == reference.masks[r * current.width + c]]
+    completed = solver.complete_board(current, fixed)
+    return completed.to_lists() if completed is not None else reference.to_lists()
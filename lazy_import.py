@@ -0,0 +1,47 @@
+# lazy_import.py
+# 按需导入较重的模块（vision 会连带导入 OpenCV 与 NumPy），并记录每个进程的导入耗时
+#
+# 只有 /api/upload_image 需要图像识别，Web worker 和任务进程因此不必在启动时就为 OpenCV 付出
+# 导入时间和几十 MB 内存；偏好预热 worker 的部署可以设置 PUZZLE_PRELOAD_VISION=1。
+
+import importlib
+import os
+import threading
+import time
+
+import metrics
+
+# 为 1 时 Web worker 与任务进程在启动时就导入 vision，而不是在第一次识别图片时
+PRELOAD_VISION = os.environ.get('PUZZLE_PRELOAD_VISION', '0').lower() in ('1', 'true', 'yes')
+
+IMPORT_SECONDS = metrics.Histogram(
+    'puzzle_import_duration_seconds', "Time spent importing application modules, per process.", ['module'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+_modules = {}
+_lock = threading.Lock()
+
+
+def load(name):
+    """返回模块 name，第一次调用时才导入并记录耗时；并发调用只会导入一次。"""
+    module = _modules.get(name)
+    if module is not None:
+        return module
+    with _lock:
+        module = _modules.get(name)
+        if module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(name)
+            IMPORT_SECONDS.observe(time.perf_counter() - start, module=name)
+            _modules[name] = module
+    return module
+
+
+def vision():
+    return load('vision')
+
+
+def preload():
+    """按 PUZZLE_PRELOAD_VISION 预先导入 vision，可作为进程池的 initializer。"""
+    if PRELOAD_VISION:
+        vision()
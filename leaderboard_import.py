@@ -0,0 +1,189 @@
+# leaderboard_import.py
+# 把旧版 leaderboard.json 导入 SQLite 排行榜，并可输出去重后的精简 JSON
+#
+# 用法：
+#   python leaderboard_import.py leaderboard.json
+#   python leaderboard_import.py leaderboard.json --db leaderboard.db --compact-json leaderboard.compact.json
+
+import argparse
+import json
+import sys
+import time
+
+import leaderboard_store
+
+# 每次从文件读取的字符数
+READ_CHUNK_SIZE = 64 * 1024
+# 旧版 JSON 中的榜单类型，与 scores 表的列一一对应
+_LEGACY_TYPES = {'single': 0, 'average': 1}
+_WHITESPACE = ' \t\r\n'
+
+
+class _StreamReader:
+    """
+    在文件上按块滑动的缓冲区。结构（对象、数组）由调用方逐个字符解析，
+    字符串和单条成绩记录用 json 的 raw_decode 解析，因此内存中只保留当前这一块。
+    """
+    def __init__(self, fp, chunk_size=READ_CHUNK_SIZE):
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+        chunk = self._fp.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # 丢弃已经解析过的部分
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白，返回下一个字符；文件结束时返回空字符串。"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} but found {found or 'end of file'!r}")
+        self._pos += 1
+
+    def value(self):
+        """解析下一个完整的 JSON 值。"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # 值恰好结束在缓冲区末尾时（例如数字）可能还没读完，补充后重新解析
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def items(self):
+        """逐个产出当前 JSON 对象的键，调用方负责在下一次迭代之前读取对应的值。"""
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self._pos += 1
+                continue
+            self.expect('}')
+            return
+
+    def elements(self):
+        """逐个产出当前 JSON 数组中的元素。"""
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self._pos += 1
+                continue
+            self.expect(']')
+            return
+
+
+def iter_legacy_scores(fp, chunk_size=READ_CHUNK_SIZE):
+    """
+    流式读取旧版排行榜 {difficulty: {"single": [...], "average": [...]}}，
+    逐条产出 (difficulty, score_type, username, time)。无法识别的榜单类型会被跳过。
+    """
+    reader = _StreamReader(fp, chunk_size)
+    for difficulty in reader.items():
+        for score_type in reader.items():
+            if score_type not in _LEGACY_TYPES:
+                reader.value()
+                continue
+            for entry in reader.elements():
+                username = entry.get('username') if isinstance(entry, dict) else None
+                score_time = entry.get('time') if isinstance(entry, dict) else None
+                if not username or not isinstance(score_time, (int, float)):
+                    continue
+                yield difficulty, score_type, username, score_time
+
+
+def best_scores(entries):
+    """按 (difficulty, username) 去重，每种类型只保留最好成绩，返回 {key: [single, average]}。"""
+    best = {}
+    for difficulty, score_type, username, score_time in entries:
+        times = best.setdefault((difficulty, username), [None, None])
+        index = _LEGACY_TYPES[score_type]
+        if times[index] is None or score_time < times[index]:
+            times[index] = score_time
+    return best
+
+
+def write_compact_json(scores, fp):
+    """以旧版格式写出去重后的排行榜，每个榜单按时间升序排列。"""
+    boards = {}
+    for (difficulty, username), times in scores.items():
+        for score_type, index in _LEGACY_TYPES.items():
+            if times[index] is not None:
+                board = boards.setdefault(difficulty, {}).setdefault(score_type, [])
+                board.append({"username": username, "time": times[index]})
+    for board in boards.values():
+        for entries in board.values():
+            entries.sort(key=lambda entry: entry["time"])
+    json.dump(boards, fp, ensure_ascii=False, indent=4)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="把旧版 leaderboard.json 导入 SQLite 排行榜。")
+    parser.add_argument('source', help="旧版 leaderboard.json 的路径")
+    parser.add_argument('--db', default=leaderboard_store.DATABASE_FILE, help="目标数据库（默认 %(default)s）")
+    parser.add_argument('--compact-json', metavar='PATH', help="同时把去重后的排行榜写到这个 JSON 文件")
+    parser.add_argument('--dry-run', action='store_true', help="只统计，不写入数据库")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    read = 0
+
+    def counted(entries):
+        nonlocal read
+        for entry in entries:
+            read += 1
+            yield entry
+
+    with open(args.source, encoding='utf-8') as fp:
+        scores = best_scores(counted(iter_legacy_scores(fp)))
+
+    if not args.dry_run:
+        store = leaderboard_store.LeaderboardStore(args.db, durability='sync')
+        store.init_schema()
+        store.import_scores(scores)
+    if args.compact_json:
+        with open(args.compact_json, 'w', encoding='utf-8') as fp:
+            write_compact_json(scores, fp)
+
+    elapsed = time.perf_counter() - start
+    action = "Would import" if args.dry_run else "Imported"
+    print(f"{action} {len(scores)} users from {read} entries in {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
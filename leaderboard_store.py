@@ -0,0 +1,502 @@
+# leaderboard_store.py
+# 排行榜的 SQLite 存储层：WAL 模式、按进程复用的连接池，以及原子的成绩提交
+
+import atexit
+import os
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import metrics
+
+DATABASE_FILE = 'leaderboard.db'
+# 每个进程最多保留的空闲连接数
+POOL_SIZE = 4
+# 写锁被占用时最多等待的毫秒数
+BUSY_TIMEOUT_MS = 5000
+# 排行榜展示的名次数，这部分榜单会缓存在进程内
+TOP_LIMIT = 100
+# 最多缓存多少个 (难度, 类型) 榜单
+TOP_CACHE_SIZE = 64
+# 成绩写入的持久性：
+#   'sync'  每次提交单独开一个事务，返回时已写入数据库
+#   'group' 后台线程合并一批提交后在一个事务中写入，请求等到这批写完再返回（组提交）
+#   'async' 请求入队后立即返回，进程崩溃时会丢失尚未写入的成绩
+SCORE_DURABILITY = os.environ.get('PUZZLE_SCORE_DURABILITY', 'group')
+SCORE_DURABILITY_MODES = ('sync', 'group', 'async')
+# 后台线程每批积攒提交的时间（毫秒）
+SCORE_BATCH_MS = float(os.environ.get('PUZZLE_SCORE_BATCH_MS', 5))
+# 'group' 模式下请求最多等待写入完成的秒数，超时后按“已提交 + 待写入”的成绩返回排名
+GROUP_COMMIT_TIMEOUT = 5.0
+# 批量写入失败后等待多久再重试（秒）
+WRITE_ERROR_BACKOFF = 0.5
+
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",        # 读不阻塞写，写不阻塞读
+    "PRAGMA synchronous=NORMAL",      # WAL 模式下只在检查点时 fsync
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",        # 约 8 MB 页缓存
+)
+
+_TIME_COLUMNS = {'single': 'best_single_time', 'average': 'best_average_time'}
+# 与 submit 的 (single_time, average_time) 参数顺序一致
+_SCORE_COLUMNS = ('best_single_time', 'best_average_time')
+
+# 按顺序执行的数据库迁移，已执行到第几步记录在 PRAGMA user_version 中
+_MIGRATIONS = (
+    ('''
+        CREATE TABLE IF NOT EXISTS scores (
+            difficulty TEXT NOT NULL,
+            username TEXT NOT NULL,
+            best_single_time REAL,
+            best_average_time REAL,
+            PRIMARY KEY (difficulty, username)
+        )
+    ''',),
+    # 覆盖索引：前 100 名与排名计数都只需扫描索引的一段范围
+    (
+        'CREATE INDEX IF NOT EXISTS idx_scores_single ON scores (difficulty, best_single_time, username)',
+        'CREATE INDEX IF NOT EXISTS idx_scores_average ON scores (difficulty, best_average_time, username)',
+    ),
+    # 每个榜单的前 TOP_LIMIT 名发生变化时递增的版本号，各进程据此判断自己的缓存是否过期
+    ('''
+        CREATE TABLE IF NOT EXISTS board_versions (
+            difficulty TEXT NOT NULL,
+            score_column TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (difficulty, score_column)
+        ) WITHOUT ROWID
+    ''',),
+    # 各进程共享的配置，例如挑战令牌的签名密钥
+    ('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL
+        ) WITHOUT ROWID
+    ''',),
+    # 已经成功提交过的挑战令牌（nonce）及提交它的用户名，令牌过期后删除
+    ('''
+        CREATE TABLE IF NOT EXISTS used_tokens (
+            nonce TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''',),
+)
+
+# 一条语句完成插入或更新：只在新成绩更好时覆盖
+_UPSERT_SCORE = '''
+    INSERT INTO scores (difficulty, username, best_single_time, best_average_time)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (difficulty, username) DO UPDATE SET
+        best_single_time = MIN(COALESCE(best_single_time, excluded.best_single_time), excluded.best_single_time),
+        best_average_time = MIN(COALESCE(best_average_time, excluded.best_average_time), excluded.best_average_time)
+'''
+
+
+_SELECT_VERSION = '''
+    SELECT version FROM board_versions WHERE difficulty = ? AND score_column = ?
+'''
+
+_BUMP_VERSION = '''
+    INSERT INTO board_versions (difficulty, score_column, version) VALUES (?, ?, 1)
+    ON CONFLICT (difficulty, score_column) DO UPDATE SET version = version + 1
+'''
+
+_INSERT_SETTING = 'INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)'
+_SELECT_SETTING = 'SELECT value FROM settings WHERE key = ?'
+
+_DELETE_EXPIRED_TOKENS = 'DELETE FROM used_tokens WHERE expires_at < ?'
+_INSERT_USED_TOKEN = 'INSERT OR IGNORE INTO used_tokens (nonce, username, expires_at) VALUES (?, ?, ?)'
+_SELECT_USED_TOKEN = 'SELECT 1 FROM used_tokens WHERE nonce = ?'
+
+
+_DB_SECONDS = metrics.Histogram(
+    'puzzle_db_duration_seconds', "Time a pooled SQLite connection is held, including the commit.", ['operation'])
+_TOP_CACHE_LOOKUPS = metrics.Counter(
+    'puzzle_leaderboard_cache_lookups_total', "Top-100 cache lookups by result.", ['result'])
+_SCORE_BATCH_SIZE = metrics.Histogram(
+    'puzzle_score_batch_size', "Distinct (difficulty, username) scores written per batch.",
+    buckets=metrics.COUNT_BUCKETS)
+_SCORE_WRITE_ERRORS = metrics.Counter(
+    'puzzle_score_write_errors_total', "Score batches that failed to write and were queued again.", ['error'])
+
+
+def time_column(score_type):
+    """排行榜类型对应的列名；'single' 以外的类型都按平均成绩处理。"""
+    return _TIME_COLUMNS.get(score_type, 'best_average_time')
+
+
+def _top_query(column):
+    return f'''
+        SELECT username, {column} AS time FROM scores
+        WHERE difficulty = ? AND {column} IS NOT NULL
+        ORDER BY {column} ASC
+        LIMIT ?
+    '''
+
+
+def _rank_query(column):
+    # 排名 = 严格更快的人数 + 1（与 RANK() 的并列规则一致），计数走 (difficulty, column) 索引
+    return f'''
+        SELECT (
+            SELECT COUNT(*) FROM scores AS other
+            WHERE other.difficulty = s.difficulty AND other.{column} < s.{column}
+        ) + 1 AS rank, s.{column} AS time
+        FROM scores AS s
+        WHERE s.difficulty = ? AND s.username = ? AND s.{column} IS NOT NULL
+    '''
+
+
+# 所有 SQL 都是固定文本，sqlite3 会按文本缓存预编译语句，每个连接只编译一次
+_TOP_QUERIES = {column: _top_query(column) for column in _TIME_COLUMNS.values()}
+_RANK_QUERIES = {column: _rank_query(column) for column in _TIME_COLUMNS.values()}
+_TIME_QUERIES = {
+    column: f'SELECT {column} FROM scores WHERE difficulty = ? AND username = ?'
+    for column in _TIME_COLUMNS.values()
+}
+_COUNT_FASTER_QUERIES = {
+    column: f'SELECT COUNT(*) FROM scores WHERE difficulty = ? AND {column} < ?'
+    for column in _TIME_COLUMNS.values()
+}
+
+
+def _min_time(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+class LeaderboardStore:
+    """
+    排行榜存储。连接在每个进程内复用（Gunicorn fork 后按 PID 重新建立连接池），
+    借出的连接一次只被一个线程使用。
+    durability 不是 'sync' 时，成绩先进入待写入表（同一用户只保留最好成绩），
+    由后台线程每 batch_ms 毫秒在一个事务中批量写入。
+    带挑战令牌的成绩与登记令牌在同一个事务中写入：令牌已被使用时成绩不写入，写入失败时令牌也不算使用过。
+    """
+    def __init__(self, path=DATABASE_FILE, pool_size=POOL_SIZE,
+                 durability=SCORE_DURABILITY, batch_ms=SCORE_BATCH_MS):
+        if durability not in SCORE_DURABILITY_MODES:
+            raise ValueError(f"Unknown score durability: {durability}")
+        self.path = path
+        self.pool_size = pool_size
+        self.durability = durability
+        self.batch_interval = batch_ms / 1000
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._pool_pid = os.getpid()
+        self._lock = threading.Lock()
+        # (difficulty, column) -> (version, 前 TOP_LIMIT 名)，按 LRU 淘汰
+        self._top_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # (difficulty, username) -> [single, average]；_inflight 是后台线程正在写入的一批
+        self._pending = {}
+        self._inflight = {}
+        # 带令牌的成绩不合并：nonce -> ((difficulty, username), (single, average), expires_at)，
+        # 写入时登记令牌失败（已被其他请求使用）的 nonce 记在 _rejected_tokens 中，由等待的请求取走
+        self._pending_tokens = {}
+        self._inflight_tokens = {}
+        self._rejected_tokens = set()
+        self._pending_cond = threading.Condition()
+        self._enqueued_seq = 0
+        self._committed_seq = 0
+        self._writer = None
+        self._writer_pid = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=64)
+        conn.row_factory = sqlite3.Row
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _check_pid(self):
+        # fork 出的子进程不能复用父进程的连接
+        if self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool_pid != os.getpid():
+                    self._pool = queue.LifoQueue(maxsize=self.pool_size)
+                    self._pool_pid = os.getpid()
+
+    @contextmanager
+    def connection(self, operation='query'):
+        """借出一个连接；with 块正常结束时提交事务，出错时回滚。借出的总时长按 operation 记录到指标中。"""
+        with _DB_SECONDS.time(operation=operation):
+            with self._borrow() as conn:
+                yield conn
+
+    @contextmanager
+    def _borrow(self):
+        self._check_pid()
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        except Exception:
+            conn.close()
+            raise
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def init_schema(self):
+        """创建表结构，并在已有的数据库上执行尚未执行的迁移（例如补建索引）。"""
+        with self.connection('migrate') as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for step, statements in enumerate(_MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version={step}")
+
+    def secret(self, name, nbytes=32):
+        """
+        返回名为 name 的随机密钥。第一次使用时生成并写入 settings 表，
+        之后所有进程（包括其他 Gunicorn worker）读到的都是同一个值。
+        """
+        with self.connection('secret') as conn:
+            conn.execute(_INSERT_SETTING, (name, secrets.token_bytes(nbytes)))
+            return bytes(conn.execute(_SELECT_SETTING, (name,)).fetchone()[0])
+
+    def top_scores_versioned(self, difficulty, score_type):
+        """
+        返回 (version, 前 TOP_LIMIT 名的元组)。
+        每次只按主键读一次版本号；版本号没变时直接返回缓存的榜单，不再扫描成绩索引。
+        """
+        column = time_column(score_type)
+        key = (difficulty, column)
+        with self.connection('top_scores') as conn:
+            row = conn.execute(_SELECT_VERSION, key).fetchone()
+            version = row[0] if row else 0
+            with self._cache_lock:
+                cached = self._top_cache.get(key)
+                if cached is not None and cached[0] == version:
+                    self._top_cache.move_to_end(key)
+                    _TOP_CACHE_LOOKUPS.inc(result='hit')
+                    return cached
+            _TOP_CACHE_LOOKUPS.inc(result='miss')
+            rows = conn.execute(_TOP_QUERIES[column], (difficulty, TOP_LIMIT)).fetchall()
+        entry = (version, tuple(dict(row) for row in rows))
+        with self._cache_lock:
+            self._top_cache[key] = entry
+            self._top_cache.move_to_end(key)
+            while len(self._top_cache) > TOP_CACHE_SIZE:
+                self._top_cache.popitem(last=False)
+        return entry
+
+    def top_scores(self, difficulty, score_type, limit=TOP_LIMIT):
+        if limit <= TOP_LIMIT:
+            return [dict(row) for row in self.top_scores_versioned(difficulty, score_type)[1][:limit]]
+        column = time_column(score_type)
+        with self.connection('top_scores') as conn:
+            rows = conn.execute(_TOP_QUERIES[column], (difficulty, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def user_rank(self, difficulty, score_type, username):
+        """返回 {"rank": ..., "time": ...}，用户没有该类型成绩时返回 None。"""
+        column = time_column(score_type)
+        with self.connection('user_rank') as conn:
+            row = conn.execute(_RANK_QUERIES[column], (difficulty, username)).fetchone()
+        return dict(row) if row else None
+
+    def _write_scores(self, conn, scores):
+        """
+        在当前事务中写入 {(difficulty, username): (single, average)}（只保留更好的时间）。
+        只有成绩刷新了个人最好且进入前 TOP_LIMIT 名时，才递增对应榜单的版本号使缓存失效。
+        """
+        conn.executemany(_UPSERT_SCORE, [
+            (difficulty, username, single_time, average_time)
+            for (difficulty, username), (single_time, average_time) in scores.items()
+        ])
+        bumped = set()
+        for (difficulty, username), times in scores.items():
+            for column, new_time in zip(_SCORE_COLUMNS, times):
+                if new_time is None or (difficulty, column) in bumped:
+                    continue
+                row = conn.execute(_RANK_QUERIES[column], (difficulty, username)).fetchone()
+                # 保存的时间等于提交的时间，说明这次提交更新了该用户的成绩
+                if row is not None and row['time'] == new_time and row['rank'] <= TOP_LIMIT:
+                    conn.execute(_BUMP_VERSION, (difficulty, column))
+                    bumped.add((difficulty, column))
+
+    def import_scores(self, scores):
+        """
+        在一个事务中批量导入 {(difficulty, username): (single, average)}，与已有成绩合并时保留更好的时间。
+        导入涉及的榜单缓存全部失效。
+        """
+        boards = set()
+        for (difficulty, _), times in scores.items():
+            for column, score_time in zip(_SCORE_COLUMNS, times):
+                if score_time is not None:
+                    boards.add((difficulty, column))
+        with self.connection('import') as conn:
+            conn.executemany(_UPSERT_SCORE, (
+                (difficulty, username, single_time, average_time)
+                for (difficulty, username), (single_time, average_time) in scores.items()
+            ))
+            conn.executemany(_BUMP_VERSION, sorted(boards))
+
+    def _write_token(self, conn, nonce, username, expires_at):
+        """在当前事务中登记令牌已由 username 使用，返回是否是第一次登记；顺带删除已过期的记录。"""
+        conn.execute(_DELETE_EXPIRED_TOKENS, (time.time(),))
+        return conn.execute(_INSERT_USED_TOKEN, (nonce, username, expires_at)).rowcount == 1
+
+    def submit(self, difficulty, username, single_time, average_time, token=None):
+        """
+        保存成绩（只保留更好的时间），返回用户在平均成绩榜上的排名，查不到时为 -1。
+        token 为挑战令牌的 (nonce, expires_at)：令牌已经使用过时不写入成绩并返回 None。
+        'async' 模式下只能拒绝已经写入数据库或正在排队的令牌，与其他进程同时提交的重复令牌在写入时丢弃。
+        """
+        if self.durability == 'sync':
+            with self.connection('submit') as conn:
+                if token is not None and not self._write_token(conn, token[0], username, token[1]):
+                    return None
+                self._write_scores(conn, {(difficulty, username): (single_time, average_time)})
+                row = conn.execute(_RANK_QUERIES['best_average_time'], (difficulty, username)).fetchone()
+            return row['rank'] if row else -1
+
+        key = (difficulty, username)
+        if token is not None:
+            with self.connection('check_token') as conn:
+                if conn.execute(_SELECT_USED_TOKEN, (token[0],)).fetchone() is not None:
+                    return None
+        with self._pending_cond:
+            self._ensure_writer()
+            if token is None:
+                best = self._pending.get(key)
+                if best is None:
+                    self._pending[key] = [single_time, average_time]
+                else:
+                    best[0] = _min_time(best[0], single_time)
+                    best[1] = _min_time(best[1], average_time)
+            else:
+                nonce, expires_at = token
+                if nonce in self._pending_tokens or nonce in self._inflight_tokens:
+                    return None
+                self._pending_tokens[nonce] = (key, (single_time, average_time), expires_at)
+            self._enqueued_seq += 1
+            seq = self._enqueued_seq
+            self._pending_cond.notify_all()
+            if self.durability == 'group':
+                self._pending_cond.wait_for(lambda: self._committed_seq >= seq, timeout=GROUP_COMMIT_TIMEOUT)
+                if token is not None and token[0] in self._rejected_tokens:
+                    self._rejected_tokens.discard(token[0])
+                    return None
+        return self._rank_with_pending(difficulty, username, 'best_average_time')
+
+    def _queued_scores(self):
+        """已入队但尚未提交的全部成绩 ((difficulty, username), (single, average))，调用方持有 _pending_cond。"""
+        for batch in (self._inflight, self._pending):
+            yield from batch.items()
+        for tokens in (self._inflight_tokens, self._pending_tokens):
+            for key, times, _ in tokens.values():
+                yield key, times
+
+    def _rank_with_pending(self, difficulty, username, column):
+        """按“已提交 + 待写入”的成绩计算排名，与 RANK() 的并列规则一致。"""
+        index = _SCORE_COLUMNS.index(column)
+        pending = {}
+        with self._pending_cond:
+            for (entry_difficulty, entry_user), times in self._queued_scores():
+                if entry_difficulty == difficulty and times[index] is not None:
+                    pending[entry_user] = _min_time(pending.get(entry_user), times[index])
+        with self.connection('pending_rank') as conn:
+            # 所有查询读同一个快照；后台线程同时提交的成绩要么算作已提交，要么算作待写入，不会重复计数
+            conn.execute("BEGIN")
+            row = conn.execute(_TIME_QUERIES[column], (difficulty, username)).fetchone()
+            mine = _min_time(row[0] if row else None, pending.get(username))
+            if mine is None:
+                return -1
+            rank = conn.execute(_COUNT_FASTER_QUERIES[column], (difficulty, mine)).fetchone()[0] + 1
+            for other, other_time in pending.items():
+                if other == username or other_time >= mine:
+                    continue
+                row = conn.execute(_TIME_QUERIES[column], (difficulty, other)).fetchone()
+                # 已提交的成绩已经比 mine 快的用户在上面的 COUNT 中计过了
+                if row is None or row[0] is None or row[0] >= mine:
+                    rank += 1
+        return rank
+
+    def _ensure_writer(self):
+        pid = os.getpid()
+        if self._writer is not None and self._writer.is_alive() and self._writer_pid == pid:
+            return
+        if self._writer_pid is None:
+            atexit.register(self.flush)
+        self._writer_pid = pid
+        self._writer = threading.Thread(target=self._writer_loop, name='score-writer', daemon=True)
+        self._writer.start()
+
+    def _write_batch(self, conn, scores, tokens):
+        """
+        在一个事务中写入一批成绩。带令牌的成绩只有在令牌第一次登记成功时才并入这批，
+        返回登记失败的 nonce。
+        """
+        merged = {key: list(times) for key, times in scores.items()}
+        rejected = set()
+        for nonce, (key, times, expires_at) in tokens.items():
+            if not self._write_token(conn, nonce, key[1], expires_at):
+                rejected.add(nonce)
+                continue
+            best = merged.setdefault(key, [None, None])
+            best[0] = _min_time(best[0], times[0])
+            best[1] = _min_time(best[1], times[1])
+        self._write_scores(conn, merged)
+        return rejected, len(merged)
+
+    def _writer_loop(self):
+        while True:
+            with self._pending_cond:
+                self._pending_cond.wait_for(lambda: self._pending or self._pending_tokens)
+            # 先等一小段时间，让这段时间内的提交合并进同一个事务
+            time.sleep(self.batch_interval)
+            with self._pending_cond:
+                batch, self._pending = self._pending, {}
+                tokens, self._pending_tokens = self._pending_tokens, {}
+                self._inflight = batch
+                self._inflight_tokens = tokens
+                seq = self._enqueued_seq
+            try:
+                with self.connection('write_batch') as conn:
+                    rejected, written = self._write_batch(conn, batch, tokens)
+            except Exception as error:
+                # 任何异常都不能让写入线程退出：把这批成绩放回待写入表，稍后重试；事务已回滚，令牌也没有登记
+                _SCORE_WRITE_ERRORS.inc(error=type(error).__name__)
+                with self._pending_cond:
+                    for key, times in batch.items():
+                        best = self._pending.setdefault(key, [None, None])
+                        best[0] = _min_time(best[0], times[0])
+                        best[1] = _min_time(best[1], times[1])
+                    self._pending_tokens.update(tokens)
+                    self._inflight = {}
+                    self._inflight_tokens = {}
+                time.sleep(WRITE_ERROR_BACKOFF)
+                continue
+            _SCORE_BATCH_SIZE.observe(written)
+            with self._pending_cond:
+                self._inflight = {}
+                self._inflight_tokens = {}
+                if self.durability == 'group':
+                    self._rejected_tokens |= rejected
+                self._committed_seq = seq
+                self._pending_cond.notify_all()
+
+    def flush(self, timeout=GROUP_COMMIT_TIMEOUT):
+        """等待目前已入队的成绩全部写入数据库，返回是否在 timeout 秒内完成。"""
+        with self._pending_cond:
+            seq = self._enqueued_seq
+            if self._committed_seq >= seq:
+                return True
+            if self._writer_pid != os.getpid():
+                return False
+            return self._pending_cond.wait_for(lambda: self._committed_seq >= seq, timeout=timeout)
@@ -0,0 +1,356 @@
+# metrics.py
+# 轻量的进程内指标（计数器与直方图），以 Prometheus 文本格式导出，并在多个进程之间汇总
+#
+# 每个进程把自己的指标定期写到 METRICS_DIR/<pid>.json；导出时读取目录中所有文件并相加，
+# 因此 Gunicorn 的各个 worker 以及任务进程池中的子进程都会被计入。文件中同时保存指标的类型与说明，
+# 只在其他进程中注册的指标（例如只在任务进程中延迟导入的 vision）也能导出。
+# 进程退出后由 remove_process 把它的数值并入 ARCHIVE_FILE 再删除它的文件（见 gunicorn.conf.py 的 child_exit
+# 和 job_executor；导出时发现的已不存在的进程同样处理），汇总的计数器因此不会因为进程退出而减小，
+# Prometheus 不会把 worker 重启误判为计数器重置。只有 Gunicorn 主进程启动时用 clear 清空整个目录。
+
+import atexit
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只在单进程下运行，不需要文件锁
+    fcntl = None
+
+# 各进程共享的指标目录。默认按进程组区分，Gunicorn 主进程、worker 与它们派生的子进程属于同一个进程组
+_DEFAULT_DIR = (os.path.join(tempfile.gettempdir(), f'web_puzzle_metrics_{os.getpgrp()}')
+                if hasattr(os, 'getpgrp') else None)
+METRICS_DIR = os.environ.get('PUZZLE_METRICS_DIR', _DEFAULT_DIR)
+# 有新数据时，后台线程每隔多少秒写一次文件
+FLUSH_INTERVAL = 1.0
+# 已退出进程的数值累加到这个文件；并入与读取之间用 LOCK_FILE 互斥，读取方不会看到重复或缺失的数值
+ARCHIVE_FILE = 'archive.json'
+LOCK_FILE = '.lock'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 500)
+NODE_BUCKETS = (10, 100, 1000, 10_000, 100_000, 1_000_000)
+
+_registry = {}
+_lock = threading.Lock()
+_state = {'pid': os.getpid(), 'dirty': False, 'flusher': None}
+
+
+def _check_pid():
+    # fork 出的子进程继承了父进程的数值，清零后只统计自己的部分，避免与父进程的文件重复计数
+    if _state['pid'] != os.getpid():
+        _state['pid'] = os.getpid()
+        _state['dirty'] = False
+        _state['flusher'] = None
+        for metric in _registry.values():
+            metric.values.clear()
+
+
+def _touch():
+    _state['dirty'] = True
+    if METRICS_DIR is None:
+        return
+    flusher = _state['flusher']
+    if flusher is None or not flusher.is_alive():
+        flusher = threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True)
+        _state['flusher'] = flusher
+        flusher.start()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=(), register=True):
+        if register and name in _registry:
+            raise ValueError(f"Metric already registered: {name}")
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        # 标签值元组 -> 数值（计数器）或 [各桶计数..., 总和, 总数]（直方图）
+        self.values = {}
+        if register:
+            _registry[name] = self
+
+    def _describe(self):
+        return {'kind': self.kind, 'help': self.help, 'labels': list(self.labelnames)}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            _check_pid()
+            self.values[key] = self.values.get(key, 0) + amount
+            _touch()
+
+    def _merge(self, values, samples):
+        for key, value in samples:
+            key = tuple(key)
+            values[key] = values.get(key, 0) + value
+
+    def _render(self, values):
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS, register=True):
+        super().__init__(name, help_text, labelnames, register)
+        self.buckets = tuple(buckets)
+
+    def _describe(self):
+        return dict(super()._describe(), buckets=list(self.buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            _check_pid()
+            slots = self.values.get(key)
+            if slots is None:
+                slots = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    slots[i] += 1
+            slots[-2] += value
+            slots[-1] += 1
+            _touch()
+
+    @contextmanager
+    def time(self, **labels):
+        """以秒为单位记录 with 块的耗时（出错时同样记录）。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _merge(self, values, samples):
+        for key, slots in samples:
+            key = tuple(key)
+            current = values.get(key)
+            if current is None or len(current) != len(slots):
+                values[key] = list(slots)
+            else:
+                values[key] = [a + b for a, b in zip(current, slots)]
+
+    def _render(self, values):
+        for key, slots in sorted(values.items()):
+            for bound, count in zip(self.buckets, slots):
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", _format_value(bound))])} {count}'
+            yield f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", "+Inf")])} {slots[-1]}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(slots[-2])}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {slots[-1]}'
+
+
+def _snapshot():
+    with _lock:
+        _check_pid()
+        return {name: dict(metric._describe(),
+                           samples=[[list(key), list(value) if isinstance(value, list) else value]
+                                    for key, value in metric.values.items()])
+                for name, metric in _registry.items()}
+
+
+def _from_description(name, description):
+    """按文件中保存的描述重建一个不注册的指标，仅用于导出本进程没有注册的指标。"""
+    kind = description.get('kind')
+    if kind == Counter.kind:
+        return Counter(name, description['help'], description['labels'], register=False)
+    if kind == Histogram.kind:
+        return Histogram(name, description['help'], description['labels'], description['buckets'], register=False)
+    return None
+
+
+def _path_for(pid):
+    return os.path.join(METRICS_DIR, f'{pid}.json')
+
+
+@contextmanager
+def _dir_lock(exclusive):
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, LOCK_FILE), 'a') as fp:
+        if fcntl is not None:
+            fcntl.flock(fp, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, encoding='utf-8') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fp:
+        json.dump(data, fp)
+    os.replace(tmp_path, path)
+
+
+def remove_process(pid):
+    """进程 pid 已退出：把它的指标并入归档文件后删除它的文件，汇总值保持不变。"""
+    if METRICS_DIR is None:
+        return
+    path = _path_for(pid)
+    if not os.path.exists(path):
+        return
+    with _dir_lock(exclusive=True):
+        process = _read_snapshot(path)
+        if process is not None:
+            archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+            snapshots = [process]
+            archive = _read_snapshot(archive_path)
+            if archive is not None:
+                snapshots.append(archive)
+            _write_snapshot(archive_path, _combine(snapshots))
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def clear():
+    """删除目录中所有指标文件（包括归档），只在 Gunicorn 主进程启动时调用。"""
+    if METRICS_DIR is None or not os.path.isdir(METRICS_DIR):
+        return
+    for filename in os.listdir(METRICS_DIR):
+        if filename.endswith(('.json', '.json.tmp')):
+            try:
+                os.remove(os.path.join(METRICS_DIR, filename))
+            except FileNotFoundError:
+                pass
+
+
+def flush():
+    """把当前进程的指标写入共享目录（先写临时文件再改名，读取方不会看到写了一半的文件）。"""
+    if METRICS_DIR is None:
+        return
+    _state['dirty'] = False
+    data = _snapshot()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_snapshot(_path_for(os.getpid()), data)
+
+
+def _flush_loop():
+    while _state['pid'] == os.getpid():
+        time.sleep(FLUSH_INTERVAL)
+        if _state['dirty']:
+            try:
+                flush()
+            except OSError:
+                pass
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass
+    return True
+
+
+def _load_all():
+    """读取归档与所有仍在运行的进程写出的指标；当前进程使用内存中的最新值。"""
+    snapshots = [_snapshot()]
+    if METRICS_DIR is None or not os.path.isdir(METRICS_DIR):
+        return snapshots
+    own = f'{os.getpid()}.json'
+    for filename in os.listdir(METRICS_DIR):
+        pid = filename[:-len('.json')]
+        if filename.endswith('.json') and pid.isdigit() and not _process_alive(int(pid)):
+            # 没有经过 remove_process 就退出的进程（例如随 worker 一起退出的任务进程）
+            remove_process(int(pid))
+    with _dir_lock(exclusive=False):
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.endswith('.json') or filename == own:
+                continue
+            snapshot = _read_snapshot(os.path.join(METRICS_DIR, filename))
+            if snapshot is not None:
+                snapshots.append(snapshot)
+    return snapshots
+
+
+def _merge_all(snapshots):
+    """把多份快照按指标相加，返回 (指标名 -> 指标对象, 指标名 -> 汇总后的数值)。"""
+    known = dict(_registry)
+    merged = {name: {} for name in known}
+    for snapshot in snapshots:
+        for name, description in snapshot.items():
+            if not isinstance(description, dict):
+                continue  # 旧版本写出的文件
+            metric = known.get(name)
+            if metric is None:
+                metric = _from_description(name, description)
+                if metric is None:
+                    continue
+                known[name] = metric
+                merged[name] = {}
+            metric._merge(merged[name], description['samples'])
+    return known, merged
+
+
+def _combine(snapshots):
+    """把多份快照相加为一份快照（写入归档文件的格式与进程文件相同）。"""
+    known, merged = _merge_all(snapshots)
+    return {name: dict(known[name]._describe(),
+                       samples=[[list(key), value] for key, value in values.items()])
+            for name, values in merged.items() if values}
+
+
+def render():
+    """返回所有已注册指标在所有进程上汇总后的 Prometheus 文本格式。"""
+    known, merged = _merge_all(_load_all())
+    lines = []
+    for name, metric in known.items():
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        lines.extend(metric._render(merged[name]))
+    return '\n'.join(lines) + '\n'
+
+
+def _flush_at_exit():
+    if _state['dirty'] and _state['pid'] == os.getpid():
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+atexit.register(_flush_at_exit)
@@ -1,5 +1,14 @@
+import base64
+import functools
 import random
-from game_logic import Tile, Board
+import secrets
+import struct
+
+import lazy_import
+import metrics
+import solver
+from collections import namedtuple
+from game_logic import DIRECTIONS, SIDE_BITS, Tile, Board, CompactBoard
 
 
 def generate_all_tile_types():
@@ -26,50 +35,229 @@ def generate_all_tile_types():
 
 TILE_TYPES = generate_all_tile_types()
 
-
-def _generate_random_shape(width, height, num_tiles):
+# 可选的解生成算法：
+#   'spanning_tree' 在形状的格子图上随机生成一棵生成树（再随机加入少量额外的边），一次即可得到连通的解；
+#   'rejection' 为原先的逐格随机填充 + 整体连通性校验，失败则重试。
+GENERATION_ALGORITHMS = ('spanning_tree', 'rejection')
+DEFAULT_ALGORITHM = 'spanning_tree'
+# 生成树之外的每条边被额外加入的概率，使石板类型分布接近 'rejection' 算法的结果
+EXTRA_EDGE_PROBABILITY = 0.1
+
+# 随机形状的生长方式，见 _generate_random_shape
+SHAPE_STYLES = ('blob', 'compact', 'snake')
+DEFAULT_SHAPE_STYLE = 'blob'
+
+# unique=True 时的预算：每个解最多修补的次数，以及修补失败后重新生成解的次数。
+# 石板可以放在任意位置，棋盘越大同类型石板越多，超过 5x5 的随机谜题几乎不可能修补为唯一解
+UNIQUE_REPAIRS = 20
+UNIQUE_ATTEMPTS = 3
+# 评分与唯一性检查中每次计数的节点上限
+RATING_NODE_LIMIT = solver.COUNT_NODE_LIMIT
+# 只为不超过该格子数的谜题评分：10x10 以内计数只需几十毫秒，更大的棋盘可能要数秒，评分为 None
+RATING_MAX_CELLS = 100
+
+# unique：是否只有一个解（None 表示在节点上限内无法确定）；difficulty：确定性搜索找到解并排除第二个解所展开的节点数
+PuzzleRating = namedtuple('PuzzleRating', ['unique', 'difficulty'])
+
+_SHAPE_ATTEMPTS = metrics.Histogram(
+    'puzzle_generator_shape_attempts', "Random shapes tried before one produced a solution.",
+    ['algorithm'], buckets=metrics.COUNT_BUCKETS)
+_SHAPE_FALLBACKS = metrics.Counter(
+    'puzzle_generator_full_board_fallbacks_total', "Random puzzles that fell back to a full rectangle.",
+    ['algorithm'])
+_REJECTION_ATTEMPTS = metrics.Histogram(
+    'puzzle_generator_rejection_attempts', "Fill attempts used by the rejection algorithm (at most 500).",
+    buckets=metrics.COUNT_BUCKETS)
+_UNIQUE_REPAIRS = metrics.Histogram(
+    'puzzle_generator_unique_repairs', "Edge changes needed to make a generated solution unique.",
+    ['result'], buckets=metrics.COUNT_BUCKETS)
+_DIFFICULTY = metrics.Histogram(
+    'puzzle_generator_difficulty', "Search nodes needed to solve a rated puzzle and rule out a second solution.",
+    buckets=metrics.NODE_BUCKETS)
+
+
+class _IndexedSet:
+    """支持 O(1) 添加、删除、成员判断和随机选取的集合：列表存元素，字典记录下标，删除时与末尾元素交换。"""
+    __slots__ = ('_items', '_index')
+
+    def __init__(self):
+        self._items = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._index
+
+    def add(self, item):
+        if item not in self._index:
+            self._index[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item):
+        i = self._index.pop(item, None)
+        if i is None:
+            return
+        last = self._items.pop()
+        if i < len(self._items):
+            self._items[i] = last
+            self._index[last] = i
+
+    def item_at(self, i):
+        return self._items[i]
+
+
+def _generate_random_shape(width, height, num_tiles, style=DEFAULT_SHAPE_STYLE, hole_density=0.0, rng=random):
     """
     生成一个随机的、连通的棋盘形状。
+    从一个随机格子出发逐格生长，边界格子按与形状相邻的格数分桶保存，每一步都是 O(1)：
+      'blob'    在所有边界格子中均匀选取；
+      'compact' 优先选取与形状相邻最多的格子，得到紧凑、少凹口的形状；
+      'snake'   优先选取紧挨上一次加入格子的边界格子，得到蛇形的细长形状。
+    hole_density > 0 时，会先随机挖去这一比例的格子作为空洞，形状围绕空洞生长，
+    因此最终的格子数可能少于 num_tiles。
     """
+    if style not in SHAPE_STYLES:
+        raise ValueError(f"Unknown shape style: {style}")
     if num_tiles > width * height:
         num_tiles = width * height
 
     shape = [[' ' for _ in range(width)] for _ in range(height)]
+    blocked = [[hole_density > 0 and rng.random() < hole_density for _ in range(width)]
+               for _ in range(height)]
+
+    open_cells = [(r, c) for r in range(height) for c in range(width) if not blocked[r][c]]
+    if not open_cells:
+        return shape
+    start_r, start_c = rng.choice(open_cells)
+
+    # buckets[k]：恰好与形状有 k 个相邻格子的边界格子
+    buckets = [_IndexedSet() for _ in range(5)]
+    touching = [[0] * width for _ in range(height)]
+    frontier_size = 0
+    occupied_count = 0
+
+    def occupy(r, c):
+        nonlocal frontier_size, occupied_count
+        shape[r][c] = 'x'
+        occupied_count += 1
+        if touching[r][c]:
+            buckets[touching[r][c]].discard((r, c))
+            frontier_size -= 1
+        for dr, dc in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
+            nr, nc = r + dr, c + dc
+            if 0 <= nr < height and 0 <= nc < width and shape[nr][nc] == ' ' and not blocked[nr][nc]:
+                k = touching[nr][nc]
+                if k:
+                    buckets[k].discard((nr, nc))
+                else:
+                    frontier_size += 1
+                touching[nr][nc] = k + 1
+                buckets[k + 1].add((nr, nc))
+
+    def pick_uniform():
+        i = rng.randrange(frontier_size)
+        for bucket in buckets:
+            if i < len(bucket):
+                return bucket.item_at(i)
+            i -= len(bucket)
+
+    last = (start_r, start_c)
+    occupy(start_r, start_c)
+    while occupied_count < num_tiles and frontier_size:
+        if style == 'compact':
+            bucket = next(b for b in reversed(buckets) if len(b))
+            cell = bucket.item_at(rng.randrange(len(bucket)))
+        elif style == 'snake':
+            r, c = last
+            adjacent = [(r + dr, c + dc) for dr, dc in [(0, 1), (0, -1), (1, 0), (-1, 0)]
+                        if 0 <= r + dr < height and 0 <= c + dc < width
+                        and shape[r + dr][c + dc] == ' ' and touching[r + dr][c + dc]]
+            cell = rng.choice(adjacent) if adjacent else pick_uniform()
+        else:
+            cell = pick_uniform()
+        occupy(*cell)
+        last = cell
 
-    start_r, start_c = random.randint(0, height - 1), random.randint(0, width - 1)
-    shape[start_r][start_c] = 'x'
-
-    occupied_cells = [(start_r, start_c)]
-    frontier = []
-
-    for dr, dc in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
-        nr, nc = start_r + dr, start_c + dc
-        if 0 <= nr < height and 0 <= nc < width:
-            frontier.append((nr, nc))
+    return shape
 
-    while len(occupied_cells) < num_tiles and frontier:
-        r, c = random.choice(frontier)
-        frontier.remove((r, c))
 
-        if shape[r][c] == ' ':
-            shape[r][c] = 'x'
-            occupied_cells.append((r, c))
+def _generate_solved_compact(width, height, shape, algorithm=DEFAULT_ALGORITHM, rng=random):
+    """
+    在给定的形状上，构建一个满足局部和全局连通性的解，以 CompactBoard 返回。
+    rng 为随机数来源（random.Random 实例或 random 模块本身）。
+    """
+    if algorithm == 'spanning_tree':
+        return _generate_solved_board_spanning_tree(width, height, shape, rng=rng)
+    if algorithm == 'rejection':
+        grid = _generate_solved_board_rejection(width, height, shape, rng)
+        return CompactBoard.from_grid(grid) if grid is not None else None
+    raise ValueError(f"Unknown generation algorithm: {algorithm}")
 
-            for dr, dc in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
-                nr, nc = r + dr, c + dc
-                if 0 <= nr < height and 0 <= nc < width and shape[nr][nc] == ' ':
-                    if (nr, nc) not in frontier:
-                        frontier.append((nr, nc))
 
-    return shape
+def _generate_solved_board(width, height, shape, algorithm=DEFAULT_ALGORITHM, rng=random):
+    """
+    在给定的形状上，构建一个满足局部和全局连通性的解。
+    """
+    solution = _generate_solved_compact(width, height, shape, algorithm, rng)
+    return solution.to_grid() if solution is not None else None
 
 
-def _generate_solved_board(width, height, shape):
+def _generate_solved_board_spanning_tree(width, height, shape, extra_edge_probability=EXTRA_EDGE_PROBABILITY,
+                                         rng=random):
     """
-    在给定的形状上，构建一个满足局部和全局连通性的解。
+    按构造生成解：打乱形状内所有相邻格子之间的边，用并查集挑出一棵随机生成树，
+    其余的边按 extra_edge_probability 随机保留；每个格子的连接由与它相连的边决定。
+    直接写入 CompactBoard 的掩码，不分配 Tile 对象。形状不连通或只有一个格子时返回 None。
+    """
+    board = CompactBoard.from_shape(shape)
+    cells = [i for i, cell in enumerate(board.cells) if cell]
+    if len(cells) < 2:
+        return None
+
+    # 边 (a, b, bit_a, bit_b)：a 在 b 的北侧或西侧
+    edges = []
+    for a in cells:
+        r, c = divmod(a, width)
+        if r + 1 < height and shape[r + 1][c] == 'x':
+            edges.append((a, a + width, 2, 8))
+        if c + 1 < width and shape[r][c + 1] == 'x':
+            edges.append((a, a + 1, 4, 1))
+    rng.shuffle(edges)
+
+    parent = list(range(width * height))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    masks = board.masks
+    tree_edges = 0
+    for a, b, bit_a, bit_b in edges:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[ra] = rb
+            tree_edges += 1
+        elif rng.random() >= extra_edge_probability:
+            continue
+        masks[a] |= bit_a
+        masks[b] |= bit_b
+
+    if tree_edges != len(cells) - 1:
+        return None
+    return board
+
+
+def _generate_solved_board_rejection(width, height, shape, rng=random):
+    """
+    逐格随机填充与北、西邻居匹配的石板，再整体校验连通性，最多重试 500 次。
     """
-    for _ in range(500):
-        grid = [[None for _ in range(width)] for _ in range(height)]
+    for attempt in range(1, 501):
+        board = Board(shape)
+        grid = board.grid
         possible = True
         for r in range(height):
             for c in range(width):
@@ -98,24 +286,120 @@ def _generate_solved_board(width, height, shape):
                     possible = False
                     break
 
-                chosen_connections = random.choice(valid_tiles)
-                grid[r][c] = Tile(chosen_connections)
+                chosen_connections = rng.choice(valid_tiles)
+                board.place_tile(Tile(chosen_connections), r, c)
 
             if not possible:
                 break
 
-        if possible:
-            temp_board = Board(shape)
-            temp_board.grid = grid
-            if temp_board.is_fully_solved():
-                return grid
+        if possible and board.is_fully_solved():
+            _REJECTION_ATTEMPTS.observe(attempt)
+            return grid
 
+    _REJECTION_ATTEMPTS.observe(500)
+    return None
+
+def _shuffle_compact(solution, rng=random):
+    """打乱解中形状内各格子的掩码，得到谜题的初始状态。"""
+    shuffled = solution.copy()
+    cells = [i for i, cell in enumerate(solution.cells) if cell]
+    masks = [solution.masks[i] for i in cells]
+    rng.shuffle(masks)
+    for i, mask in zip(cells, masks):
+        shuffled.masks[i] = mask
+    return shuffled
+
+
+def _shuffle_tiles(solution_grid, rng=random):
+    """把解中的 Tile 对象打乱放回形状内，得到谜题的初始状态。"""
+    height, width = len(solution_grid), len(solution_grid[0])
+    flat_tiles = [tile for row in solution_grid for tile in row if tile is not None]
+    rng.shuffle(flat_tiles)
+
+    shuffled_grid = [[None for _ in range(width)] for _ in range(height)]
+    i = 0
+    for r in range(height):
+        for c in range(width):
+            if solution_grid[r][c] is not None:
+                shuffled_grid[r][c] = flat_tiles[i]
+                i += 1
+    return shuffled_grid
+
+
+def rate_puzzle(board, node_limit=RATING_NODE_LIMIT):
+    """评估 CompactBoard 谜题（打乱的或已解的均可），返回 PuzzleRating。"""
+    result = solver.count_solutions(board, 2, node_limit)
+    if result.count > 1:
+        unique = False
+    else:
+        unique = result.count == 1 if result.complete else None
+    _DIFFICULTY.observe(result.nodes)
+    return PuzzleRating(unique, result.nodes)
+
+
+def _toggle_random_edge(board, positions, rng=random):
+    """在 positions 中随机选一个格子，增加或去掉它与形状内某个邻居之间的连接，保持整体连通。成功时返回 True。"""
+    width, height = board.width, board.height
+    for _ in range(4 * len(positions)):
+        r, c = rng.choice(positions)
+        d = rng.randrange(4)
+        nr, nc = r + DIRECTIONS[d][0], c + DIRECTIONS[d][1]
+        if not (0 <= nr < height and 0 <= nc < width and board.cells[nr * width + nc]):
+            continue
+        i, j = r * width + c, nr * width + nc
+        old = board.masks[i], board.masks[j]
+        board.masks[i] ^= SIDE_BITS[d]
+        board.masks[j] ^= SIDE_BITS[(d + 2) % 4]
+        if board.is_fully_solved():
+            return True
+        board.masks[i], board.masks[j] = old
+    return False
+
+
+def _make_unique(solution, rng=random):
+    """
+    尝试把有多个解的谜题修补为唯一解：采用搜索找到的第一个解（它同样是合法的布局），
+    在它与第二个解不一致的格子上随机增删一条连接，改变石板组合后重新计数。
+    返回唯一解的 CompactBoard，预算内做不到时返回 None。
+    """
+    board = solution.copy()
+    width = board.width
+    slots = board.positions()
+    for repairs in range(UNIQUE_REPAIRS + 1):
+        result = solver.count_solutions(board, 2, RATING_NODE_LIMIT)
+        if result.count == 1 and result.complete:
+            _UNIQUE_REPAIRS.observe(repairs, result='unique')
+            return board
+        if result.count < 2:
+            break
+        first, second = result.solutions
+        for (r, c), mask in zip(slots, first):
+            board.masks[r * width + c] = mask
+        differing = [pos for pos, a, b in zip(slots, first, second) if a != b]
+        if not _toggle_random_edge(board, differing, rng):
+            break
+    _UNIQUE_REPAIRS.observe(UNIQUE_REPAIRS, result='failed')
     return None
 
+
+def _generate_unique(generate, rng=random):
+    """反复调用 generate() 生成解并尝试修补为唯一解，见 UNIQUE_ATTEMPTS。"""
+    for _ in range(UNIQUE_ATTEMPTS):
+        solution = generate()
+        if solution is None:
+            return None
+        solution = _make_unique(solution, rng)
+        if solution is not None:
+            return solution
+    return None
+
+
 # ## 新增函数 ##
-def generate_puzzle_from_shape(shape):
+def generate_puzzle_from_shape_compact(shape, algorithm=DEFAULT_ALGORITHM, seed=None, unique=False):
     """
-    在给定的形状上生成一个谜题。
+    在给定的形状上生成一个谜题，以 (shuffled, solution) 两个 CompactBoard 返回。
+    seed 相同时生成的谜题相同；为 None 时使用随机种子。
+    unique 为 True 时只返回唯一解的谜题，预算内做不到时返回 (None, None)。
     """
     if not shape or not shape[0]:
         return None, None
@@ -123,61 +407,317 @@ def generate_puzzle_from_shape(shape):
     height = len(shape)
     width = len(shape[0])
 
-    solution_grid = _generate_solved_board(width, height, shape)
+    rng = random.Random(seed)
 
-    if solution_grid is None:
-        return None, None
+    def generate():
+        return _generate_solved_compact(width, height, shape, algorithm, rng)
+
+    solution = _generate_unique(generate, rng) if unique else generate()
 
-    flat_tiles = [tile for row in solution_grid for tile in row if tile is not None]
-    
     # 检查是否有石板可供洗牌
-    if not flat_tiles:
+    if solution is None or not any(solution.cells):
         return None, None
-        
-    random.shuffle(flat_tiles)
 
-    shuffled_grid = [[None for _ in range(width)] for _ in range(height)]
-    i = 0
-    for r in range(height):
-        for c in range(width):
-            if shape[r][c] == 'x':
-                shuffled_grid[r][c] = flat_tiles[i]
-                i += 1
+    return _shuffle_compact(solution, rng), solution
 
-    return shuffled_grid, solution_grid
 
-
-def generate_random_puzzle(width, height):
+def generate_puzzle_from_shape(shape, algorithm=DEFAULT_ALGORITHM, seed=None, unique=False):
     """
-    生成一个随机的、保证有单一连通解的谜题。
+    在给定的形状上生成一个谜题。
     """
+    if not shape or not shape[0]:
+        return None, None
+
+    rng = random.Random(seed)
+
+    def generate():
+        return _generate_solved_compact(len(shape[0]), len(shape), shape, algorithm, rng)
+
+    solution = _generate_unique(generate, rng) if unique else generate()
+    if solution is None or not any(solution.cells):
+        return None, None
+    solution_grid = solution.to_grid()
+    return _shuffle_tiles(solution_grid, rng), solution_grid
+
+
+def _generate_random_solution(width, height, algorithm, shape_style, hole_density, rng):
     max_tiles = width * height
     min_tiles = int(max_tiles * 0.7)
-    num_tiles = random.randint(min_tiles, max_tiles)
+    num_tiles = rng.randint(min_tiles, max_tiles)
 
-    solution_grid = None
+    solution = None
     attempt_count = 0
-    while solution_grid is None and attempt_count < 10:
-        shape = _generate_random_shape(width, height, num_tiles)
-        solution_grid = _generate_solved_board(width, height, shape)
+    while solution is None and attempt_count < 10:
+        shape = _generate_random_shape(width, height, num_tiles, shape_style, hole_density, rng)
+        solution = _generate_solved_compact(width, height, shape, algorithm, rng)
         attempt_count += 1
+    _SHAPE_ATTEMPTS.observe(attempt_count, algorithm=algorithm)
 
-    if solution_grid is None:
+    if solution is None:
+        _SHAPE_FALLBACKS.inc(algorithm=algorithm)
         shape = [['x' for _ in range(width)] for _ in range(height)]
-        solution_grid = _generate_solved_board(width, height, shape)
+        solution = _generate_solved_compact(width, height, shape, algorithm, rng)
 
-    if solution_grid is None:
+    return solution
+
+
+def generate_random_puzzle_compact(width, height, algorithm=DEFAULT_ALGORITHM,
+                                   shape_style=DEFAULT_SHAPE_STYLE, hole_density=0.0, seed=None, unique=False):
+    """
+    与 generate_random_puzzle 相同，但以 (shuffled, solution) 两个 CompactBoard 返回，不分配 Tile 对象。
+    """
+    rng = random.Random(seed)
+
+    def generate():
+        return _generate_random_solution(width, height, algorithm, shape_style, hole_density, rng)
+
+    solution = _generate_unique(generate, rng) if unique else generate()
+    if solution is None:
         return None, None
+    return _shuffle_compact(solution, rng), solution
 
-    flat_tiles = [tile for row in solution_grid for tile in row if tile is not None]
-    random.shuffle(flat_tiles)
 
-    shuffled_grid = [[None for _ in range(width)] for _ in range(height)]
-    i = 0
-    for r in range(height):
-        for c in range(width):
-            if shape[r][c] == 'x':
-                shuffled_grid[r][c] = flat_tiles[i]
-                i += 1
+def generate_random_puzzle(width, height, algorithm=DEFAULT_ALGORITHM,
+                           shape_style=DEFAULT_SHAPE_STYLE, hole_density=0.0, seed=None, unique=False):
+    """
+    生成一个随机的、保证有连通解的谜题。石板可以放在任意位置，解通常不止一个；
+    unique 为 True 时只返回唯一解的谜题（见 UNIQUE_REPAIRS），预算内做不到时返回 (None, None)。
+    shape_style 与 hole_density 控制随机形状的生长方式，见 _generate_random_shape。
+    所有随机数都来自以 seed 初始化的局部 random.Random，seed 相同时生成的谜题相同；为 None 时使用随机种子。
+    """
+    rng = random.Random(seed)
+
+    def generate():
+        return _generate_random_solution(width, height, algorithm, shape_style, hole_density, rng)
+
+    solution = _generate_unique(generate, rng) if unique else generate()
+    if solution is None:
+        return None, None
+    solution_grid = solution.to_grid()
+    return _shuffle_tiles(solution_grid, rng), solution_grid
+
+
+# --- 谜题 ID ---
+# 谜题 ID 编码了 (生成器版本, 宽, 高, 种子)，由 generate_puzzle_by_id 确定性地还原出同一道题。
+# 同一个种子生成的谜题一旦改变（修改了生成、洗牌方式或默认算法），必须递增 GENERATOR_VERSION，
+# 旧 ID 会因此失效，而不会悄悄指向另一道题。
+# 版本 2：不超过 UNIQUE_MAX_CELLS 个格子的谜题修补为唯一解。
+GENERATOR_VERSION = 2
+# 种子谜题在不超过该格子数（5x5）时保证唯一解；更大的棋盘几乎无法修补，只附上评分
+UNIQUE_MAX_CELLS = 25
+MAX_SEED = 2 ** 64 - 1
+MAX_ID_SIDE = 255
+_PUZZLE_ID_STRUCT = struct.Struct('>BBBQ')
+
+
+def new_seed():
+    return secrets.randbits(63)
+
+
+def make_puzzle_id(width, height, seed):
+    """返回 15 个字符的 URL 安全的谜题 ID。"""
+    if not (0 < width <= MAX_ID_SIDE and 0 < height <= MAX_ID_SIDE and 0 <= seed <= MAX_SEED):
+        raise ValueError("puzzle parameters out of range")
+    packed = _PUZZLE_ID_STRUCT.pack(GENERATOR_VERSION, width, height, seed)
+    return base64.urlsafe_b64encode(packed).decode('ascii').rstrip('=')
+
+
+def parse_puzzle_id(puzzle_id):
+    """解析谜题 ID，返回 (width, height, seed)；格式错误或版本不符时抛出 ValueError。"""
+    try:
+        packed = base64.urlsafe_b64decode(puzzle_id + '=' * (-len(puzzle_id) % 4))
+        version, width, height, seed = _PUZZLE_ID_STRUCT.unpack(packed)
+    except (ValueError, struct.error, TypeError):
+        raise ValueError("malformed puzzle id") from None
+    if version != GENERATOR_VERSION:
+        raise ValueError("puzzle id was created by another generator version")
+    if width == 0 or height == 0:
+        raise ValueError("malformed puzzle id")
+    return width, height, seed
+
+
+def generate_seeded_puzzle_compact(width, height, seed=None):
+    """生成一个可以由 ID 复现的谜题，返回 (puzzle_id, shuffled, solution)。seed 为 None 时随机选取。"""
+    if seed is None:
+        seed = new_seed()
+    puzzle_id = make_puzzle_id(width, height, seed)
+    shuffled, solution = _generate_for_seed(width, height, seed)
+    return puzzle_id, shuffled, solution
+
+
+def _generate_for_seed(width, height, seed):
+    if width * height <= UNIQUE_MAX_CELLS:
+        shuffled, solution = generate_random_puzzle_compact(width, height, seed=seed, unique=True)
+        if solution is not None:
+            return shuffled, solution
+    # 修补失败（极少见）时退回普通的生成，结果仍由种子确定
+    return generate_random_puzzle_compact(width, height, seed=seed)
 
-    return shuffled_grid, solution_grid
\ No newline at end of file
+
+def generate_puzzle_by_id(puzzle_id):
+    """按谜题 ID 重新生成同一道谜题，返回 (shuffled, solution)；ID 无效时抛出 ValueError。"""
+    width, height, seed = parse_puzzle_id(puzzle_id)
+    return _generate_for_seed(width, height, seed)
+
+
+def _rate_if_small(shuffled, solution):
+    if solution is None or len(shuffled.masks) > RATING_MAX_CELLS:
+        return None
+    return rate_puzzle(shuffled)
+
+
+def generate_rated_puzzle_compact(width, height, seed=None):
+    """
+    与 generate_seeded_puzzle_compact 相同，另外附上评分：返回 (puzzle_id, shuffled, solution, rating)。
+    生成失败或棋盘超过 RATING_MAX_CELLS 时 rating 为 None。
+    """
+    puzzle_id, shuffled, solution = generate_seeded_puzzle_compact(width, height, seed)
+    return puzzle_id, shuffled, solution, _rate_if_small(shuffled, solution)
+
+
+def generate_rated_puzzle_by_id(puzzle_id):
+    """与 generate_puzzle_by_id 相同，另外附上评分：返回 (shuffled, solution, rating)，rating 的规则同上。"""
+    shuffled, solution = generate_puzzle_by_id(puzzle_id)
+    return shuffled, solution, _rate_if_small(shuffled, solution)
+
+
+# --- 批量生成 ---
+# 练习模式一次取很多道同尺寸的谜题：整批棋盘的形状、生成树和洗牌都放在 NumPy 数组里一起计算，
+# 每一步都是对整批棋盘的一次向量运算，生成 100 道谜题的耗时与逐个生成几道相当。
+# 批量生成的谜题不能由谜题 ID 复现，也不保证唯一解。
+MAX_BATCH_SIZE = 100
+MAX_BATCH_SIDE = 20
+# 每道谜题的形状至少保留的格子比例，与 generate_random_puzzle 一致
+BATCH_MIN_FILL = 0.7
+# 形状的最大连通块小于 min_fill 的棋盘（约一成）重新生成的轮数，之后改用整块矩形
+BATCH_SHAPE_ATTEMPTS = 10
+
+_BATCH_FALLBACKS = metrics.Counter(
+    'puzzle_generator_batch_fallbacks_total', "Batch puzzles that fell back to a full rectangle.")
+
+
+@functools.lru_cache(maxsize=MAX_BATCH_SIDE)
+def _batch_edges(width, height):
+    """
+    width x height 网格上所有相邻格子之间的边：返回 (edge_a, edge_b, ends)，a 在 b 的北侧或西侧；
+    ends 是 (边的下标, 端点格子, 该端点增加的位) 的四组，同一组内每个格子至多出现一次，可以直接按下标写入掩码。
+    """
+    np = lazy_import.load('numpy')
+    vertical = [(i, i + width) for i in range(width * height - width)]
+    horizontal = [(i, i + 1) for i in range(width * height) if (i + 1) % width]
+    edges = np.array(vertical + horizontal, dtype=np.intp).reshape(-1, 2)
+    v = np.arange(len(vertical))
+    h = np.arange(len(vertical), len(edges))
+    ends = ((v, edges[v, 0], 2), (v, edges[v, 1], 8), (h, edges[h, 0], 4), (h, edges[h, 1], 1))
+    return edges[:, 0], edges[:, 1], ends
+
+
+def _batch_spanning_forest(np, rng, node_a, node_b, nodes):
+    """
+    随机权重的最小生成森林（Borůvka）：每一轮所有连通块同时选出权重最小的出边并合并，
+    连通块个数每轮至少减半，约 log2(格子数) 轮结束。边的权重（几乎必然）互不相同，结果与按随机顺序执行 Kruskal 同分布。
+    node_a / node_b 是整批棋盘展平后的边的两端；返回 (kept, labels)：各边是否在森林中，各节点所在连通块的编号。
+    """
+    weights = rng.random(len(node_a))
+    kept = np.zeros(len(node_a), dtype=bool)
+    roots = np.arange(nodes, dtype=np.int32)
+    labels = roots
+    edges = np.arange(len(node_a), dtype=np.int32)
+    # 只跟踪仍然连接两个不同连通块的边，以及它们两端所在连通块的编号
+    label_a, label_b = node_a.astype(np.int32), node_b.astype(np.int32)
+    while True:
+        crossing = label_a != label_b
+        if not crossing.any():
+            return kept, labels
+        edges, label_a, label_b = edges[crossing], label_a[crossing], label_b[crossing]
+        weight = weights[edges]
+        best = np.full(nodes, 2.0)
+        np.minimum.at(best, label_a, weight)
+        np.minimum.at(best, label_b, weight)
+        from_a, from_b = weight == best[label_a], weight == best[label_b]
+        kept[edges[from_a | from_b]] = True
+        # 每个连通块挂到最小出边另一端的连通块上；两块互相选中同一条边时，编号小的一块作为根
+        parent = roots.copy()
+        parent[label_a[from_a]] = label_b[from_a]
+        parent[label_b[from_b]] = label_a[from_b]
+        mutual = (parent[parent] == roots) & (roots < parent)
+        parent[mutual] = roots[mutual]
+        while True:
+            jumped = parent[parent]
+            if (jumped == parent).all():
+                break
+            parent = jumped
+        labels = parent[labels]
+        label_a, label_b = parent[label_a], parent[label_b]
+
+
+def _generate_batch_solutions(np, rng, width, height, count, extra_edge_probability, min_fill):
+    """
+    生成 count 个解，返回 (masks, cells) 两个 (count, 格子数) 数组。
+    每块棋盘随机挖去至多 1 - min_fill 的格子，挖洞后不连通的形状只保留最大的连通块，因此格子数可能少于 min_fill。
+    """
+    size = width * height
+    edge_a, edge_b, ends = _batch_edges(width, height)
+    rows = np.arange(count)
+
+    holes = rng.integers(0, size - int(size * min_fill) + 1, size=count)
+    cells = rng.random((count, size)).argsort(axis=1).argsort(axis=1) >= holes[:, None]
+
+    # 整批棋盘展平成一张图（节点为 棋盘 x 格子数 + 格子），只保留两端都在形状内的边，一起求生成森林
+    usable = cells[:, edge_a] & cells[:, edge_b]
+    extra = rng.random(usable.shape) < extra_edge_probability
+    board, edge = np.nonzero(usable)
+    in_forest, labels = _batch_spanning_forest(
+        np, rng, board * size + edge_a[edge], board * size + edge_b[edge], count * size)
+    kept = np.zeros_like(usable)
+    kept[board, edge] = in_forest
+    kept |= usable & extra
+    labels = labels.reshape(count, size) - rows[:, None] * size
+
+    # 最大连通块内的边都在生成树或额外的边里，由它们直接求出每个格子的掩码
+    block_sizes = np.bincount((rows[:, None] * size + labels)[cells], minlength=count * size).reshape(count, size)
+    cells &= labels == block_sizes.argmax(axis=1)[:, None]
+    kept &= cells[:, edge_a] & cells[:, edge_b]
+    masks = np.zeros((count, size), dtype=np.uint8)
+    for edge, cell, bit in ends:
+        masks[:, cell] |= kept[:, edge].astype(np.uint8) * np.uint8(bit)
+    return masks, cells
+
+
+def generate_puzzle_batch_compact(width, height, count, extra_edge_probability=EXTRA_EDGE_PROBABILITY,
+                                  min_fill=BATCH_MIN_FILL, seed=None):
+    """
+    一次生成 count 道 width x height 的随机谜题，返回 [(shuffled, solution), ...]（CompactBoard）。
+    解的构造与 'spanning_tree' 算法相同，形状内至少有 min_fill 的格子；seed 相同时生成的整批谜题相同。
+    """
+    np = lazy_import.load('numpy')
+    size = width * height
+    if count <= 0 or size < 2:
+        return []
+    rng = np.random.default_rng(seed)
+    min_tiles = max(2, int(size * min_fill))
+
+    masks = np.zeros((count, size), dtype=np.uint8)
+    cells = np.zeros((count, size), dtype=bool)
+    pending = np.arange(count)
+    for attempt in range(BATCH_SHAPE_ATTEMPTS + 1):
+        if not len(pending):
+            break
+        if attempt == BATCH_SHAPE_ATTEMPTS:
+            _BATCH_FALLBACKS.inc(int(len(pending)))
+            min_fill = 1.0
+        masks[pending], cells[pending] = _generate_batch_solutions(
+            np, rng, width, height, len(pending), extra_edge_probability, min_fill)
+        pending = pending[cells[pending].sum(axis=1) < min_tiles]
+
+    # 洗牌：形状内的格子按随机键排序后依次放回形状内按行优先排列的位置
+    rows = np.arange(count)[:, None]
+    sources = np.where(cells, rng.random((count, size)), 2.0).argsort(axis=1)
+    targets = (~cells).argsort(axis=1, kind='stable')
+    shuffled = np.zeros_like(masks)
+    shuffled[rows, targets] = masks[rows, sources]
+
+    shape_bytes = cells.astype(np.uint8)
+    return [(CompactBoard(width, height, shuffled[i].tobytes(), shape_bytes[i].tobytes()),
+             CompactBoard(width, height, masks[i].tobytes(), shape_bytes[i].tobytes()))
+            for i in range(count)]
@@ -0,0 +1,213 @@
+# puzzle_pool.py
+# 预生成谜题池：后台线程按 (width, height) 补充谜题，请求路径上 O(1) 取用；
+# 以及按谜题 ID 缓存序列化结果的 LRU 缓存
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+import puzzle_generator
+
+# 每种尺寸保留的谜题数量，以及低于多少时唤醒后台线程补充
+POOL_TARGET_DEPTH = 8
+POOL_LOW_WATER = 4
+# 应用启动后预热的尺寸（与前端的难度按钮一致）
+DEFAULT_POOL_SIZES = [(3, 3), (4, 4), (5, 5), (7, 7)]
+# 为防止任意尺寸请求把池子撑大，最多同时维护这么多种尺寸
+MAX_POOL_KEYS = 16
+MAX_POOL_SIDE = 20
+# 连续生成失败这么多次的尺寸不再由后台补充，直到请求路径上生成成功
+MAX_REFILL_FAILURES = 3
+# 生成函数抛出异常（例如进程池繁忙）时，后台线程等待多久再重试（秒）
+REFILL_ERROR_BACKOFF = 1.0
+# 按谜题 ID 缓存的谜题数量（序列化结果与解）
+PUZZLE_CACHE_SIZE = 1024
+
+
+class PuzzlePool:
+    """
+    按 (width, height) 分桶的谜题池。
+    get() 优先从池中取出一个谜题，池空时退回同步生成；后台线程负责把每个桶补到目标深度。
+    generate(width, height) 返回 (puzzle_id, shuffled, solution, rating) 元组，solution 为 None 表示生成失败。
+    后台线程在第一次使用时才启动，这样 Gunicorn 在 fork 之后每个 worker 都有自己的线程。
+    """
+    def __init__(self, sizes=None, target_depth=POOL_TARGET_DEPTH, low_water=POOL_LOW_WATER,
+                 generate=puzzle_generator.generate_rated_puzzle_compact):
+        self.target_depth = target_depth
+        self.low_water = low_water
+        self._generate = generate
+        self._pools = {}
+        self._hits = {}
+        self._misses = {}
+        self._failures = {}
+        self._cond = threading.Condition()
+        self._worker = None
+        self._worker_pid = None
+        for width, height in sizes if sizes is not None else DEFAULT_POOL_SIZES:
+            self._register(width, height)
+
+    def _register(self, width, height):
+        key = (width, height)
+        if key in self._pools:
+            return True
+        if not (isinstance(width, int) and isinstance(height, int)):
+            return False
+        if len(self._pools) >= MAX_POOL_KEYS:
+            return False
+        if not (0 < width <= MAX_POOL_SIDE and 0 < height <= MAX_POOL_SIDE):
+            return False
+        self._pools[key] = deque()
+        self._hits[key] = 0
+        self._misses[key] = 0
+        self._failures[key] = 0
+        return True
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == pid:
+            return
+        self._worker_pid = pid
+        self._worker = threading.Thread(target=self._refill_loop, name='puzzle-pool', daemon=True)
+        self._worker.start()
+
+    def _next_key_to_refill(self):
+        # 挑选当前最空的桶
+        best_key, best_depth = None, self.target_depth
+        for key, pool in self._pools.items():
+            if self._failures[key] >= MAX_REFILL_FAILURES:
+                continue
+            if len(pool) < best_depth:
+                best_key, best_depth = key, len(pool)
+        return best_key
+
+    def _refill_loop(self):
+        while True:
+            with self._cond:
+                key = self._next_key_to_refill()
+                while key is None:
+                    self._cond.wait()
+                    key = self._next_key_to_refill()
+            try:
+                puzzle = self._generate(*key)
+            except Exception:
+                time.sleep(REFILL_ERROR_BACKOFF)
+                continue
+            with self._cond:
+                if puzzle[2] is None:
+                    self._failures[key] += 1
+                else:
+                    self._failures[key] = 0
+                    self._pools[key].append(puzzle)
+
+    def get(self, width, height):
+        """取出一个谜题（generate 返回的元组），池为空时同步生成。"""
+        key = (width, height)
+        with self._cond:
+            self._ensure_worker()
+            registered = self._register(width, height)
+            pool = self._pools.get(key)
+            puzzle = pool.popleft() if pool else None
+            if registered:
+                if puzzle is not None:
+                    self._hits[key] += 1
+                else:
+                    self._misses[key] += 1
+                if len(self._pools[key]) < self.low_water:
+                    self._cond.notify()
+        if puzzle is None:
+            puzzle = self._generate(width, height)
+            if registered and puzzle[2] is not None:
+                with self._cond:
+                    self._failures[key] = 0
+        return puzzle
+
+    def stats(self):
+        """返回每个尺寸的池深度与命中率。"""
+        with self._cond:
+            result = {}
+            for key, pool in self._pools.items():
+                width, height = key
+                hits, misses = self._hits[key], self._misses[key]
+                total = hits + misses
+                result[f"{width}x{height}"] = {
+                    "depth": len(pool),
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": hits / total if total else None,
+                }
+            return result
+
+
+class PuzzleCache:
+    """
+    按键（谜题 ID）缓存谜题的 LRU 缓存，值由调用方决定（app 中为序列化结果与解）。
+    同一个键同时被多个请求未命中时只生成一次，其余请求等待同一个结果，
+    这样每日挑战这类热门谜题在发布时不会被重复生成。
+    """
+    def __init__(self, maxsize=PUZZLE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        """返回缓存的值，不存在时返回 None（不会触发生成）。"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get_or_create(self, key, create):
+        """返回缓存的值；未命中时调用 create() 生成并缓存。create 抛出的异常不会被缓存。"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return value
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self._misses += 1
+        if not owner:
+            return future.result()
+
+        try:
+            value = create()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            if value is not None:
+                self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else None,
+            }
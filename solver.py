@@ -1,39 +1,481 @@
 # solver.py
-# 包含回溯求解算法
+# 包含基于位掩码与多重集的约束求解算法
 
-from game_logic import Board
+import random
+import time
+from collections import namedtuple
 
+import metrics
+from game_logic import DIRECTIONS, SIDE_BITS, connections_to_mask
 
-def solve_puzzle(board, tiles):
+# 对侧方向的下标：北<->南，东<->西
+_OPPOSITE = (2, 3, 0, 1)
+
+# _CANDIDATES[care][value]：所有满足 (mask & care) == value 的掩码组成的 16 位集合（第 m 位表示掩码 m）。
+# care 表示已经确定的边，value 表示这些边上必须具有的连接。
+_CANDIDATES = [
+    [sum(1 << m for m in range(16) if m & care == value) for value in range(16)]
+    for care in range(16)
+]
+_POPCOUNT = [bin(m).count('1') for m in range(16)]
+# _HAS_FREE[care]：在 care 之外至少还有一个连接的掩码集合，即放下后仍通向某个空位
+_HAS_FREE = [sum(1 << m for m in range(16) if m & ~care) for care in range(16)]
+
+# 随机重启：第 k 次搜索的节点上限为 空位数 x 该系数 x Luby 序列的第 k 项（1, 1, 2, 1, 1, 2, 4, ...），
+# 重启 _MAX_RESTARTS 次后最后一次不设上限
+_RESTART_NODE_FACTOR = 4
+_MAX_RESTARTS = 512
+# 计数模式默认的节点上限，超过后停止并标记为未完成
+COUNT_NODE_LIMIT = 100_000
+# 提示补全棋盘时的节点上限，超过后由调用方退回已知的解
+COMPLETE_NODE_LIMIT = 20_000
+
+SolutionCount = namedtuple('SolutionCount', ['count', 'nodes', 'complete', 'solutions'])
+
+
+_SOLVE_NODES = metrics.Histogram(
+    'puzzle_solver_nodes', "Search nodes expanded per solve, summed over restarts.",
+    buckets=metrics.NODE_BUCKETS)
+_SOLVE_RESTARTS = metrics.Histogram(
+    'puzzle_solver_restarts', "Randomized restarts needed per solve.",
+    buckets=metrics.COUNT_BUCKETS)
+_SOLVE_SECONDS = metrics.Histogram(
+    'puzzle_solver_duration_seconds', "Wall time of the constraint search per solve.", ['result'])
+
+
+class _NodeLimitReached(Exception):
+    pass
+
+
+def _build_slots(slots):
+    """
+    为给定的空位 (r, c) 列表建立邻接表。
+    返回 (neighbors, care)，其中 neighbors[i][d] 为方向 d 上相邻空位的下标（-1 表示没有），
+    care[i] 为初始约束：朝向棋盘外或形状外的边必须为 0。
+    """
+    index = {pos: i for i, pos in enumerate(slots)}
+    neighbors = []
+    care = []
+    for r, c in slots:
+        row_neighbors = []
+        closed = 0
+        for d, (dr, dc) in enumerate(DIRECTIONS):
+            j = index.get((r + dr, c + dc), -1)
+            row_neighbors.append(j)
+            if j == -1:
+                closed |= SIDE_BITS[d]
+        neighbors.append(tuple(row_neighbors))
+        care.append(closed)
+    return neighbors, care
+
+
+def _search(neighbors, care, value, counts, node_limit=None, rng=None, tally=None,
+            solutions=None, max_solutions=2, fixed=None, prefer=None, abundant=False):
     """
-    使用回溯算法求解谜题。
-    它会尝试将给定的石板放置在棋盘的每个空位上，直到找到一个完整的解。
+    在给定的约束与石板计数上进行回溯搜索。
+    每一步选择候选数最少的空位（MRV），放置后对相邻空位做前向检查。
+    已放置的石板用可回滚的并查集维护连通块及其仍通向空位的连接数，
+    据此剪掉已经封闭却未覆盖全部空位的连通块；石板恰好填满棋盘时，
+    连接总数是固定的，形成的环超过富余的连接数时也会被剪掉。
+    选择空位时还按连通块检查：空位朝已放置石板的连接是确定的，因此它会合并哪些连通块与候选无关；
+    合并后再没有通向空位的连接时，只保留还有其他连接的候选；各空位注定形成的环超过富余的连接数时直接回溯。
+    node_limit 限制搜索节点数，超出时抛出 _NodeLimitReached；rng 用于打乱同等约束空位的选择顺序，
+    abundant 为 True 时按剩余数量从多到少尝试石板类型（同样多时保持随机顺序）。
+    tally 不为 None 时，结束时把展开的节点数累加到 tally[0]。
+    成功时返回每个空位的掩码列表，否则返回 None。
+    计数模式：solutions 为列表时不在第一个解处停止，而是把每个解的副本追加进去，
+    凑满 max_solutions 个后停止，返回 solutions。搜索按石板类型分支，同类型石板互换得到的
+    排列不会被重复枚举，因此数到的是不同的掩码布局。
+    fixed 为 {空位下标: 掩码}，这些空位在搜索开始前就放好，不再改变；
+    prefer[i] 为空位 i 优先尝试的掩码，使找到的解尽量与某个已有的布局一致。
     """
-    # 创建一个全新的列表副本，防止在递归过程中修改原始列表
-    tiles_copy = list(tiles)
+    n = len(neighbors)
+    nodes = 0
+    if rng is None:
+        priority = list(range(n))
+    else:
+        priority = [rng.random() for _ in range(n)]
+    assigned = [-1] * n
+    unfilled = set(range(n))
+    exact = sum(counts) == n
+
+    # 并查集：根节点上记录连通块大小和通向空位的连接数
+    parent = list(range(n))
+    size = [1] * n
+    open_edges = [0] * n
+    cycles = 0
+    if exact:
+        half_edges = sum(counts[m] * _POPCOUNT[m] for m in range(16))
+        if half_edges % 2:
+            return None
+        spare_edges = half_edges // 2 - (n - 1)
+        if spare_edges < 0:
+            return None
+    else:
+        spare_edges = None
+
+    def find(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    # 仍有剩余的石板类型集合，与 _CANDIDATES 的表示方式相同
+    available = sum(1 << m for m in range(16) if counts[m])
+
+    def domain(i):
+        return _CANDIDATES[care[i]][value[i]] & available
+
+    def place(i, mask):
+        """放置掩码并合并连通块，返回 (撤销记录, 合并后的根)。"""
+        nonlocal cycles
+        merges = []
+        root = i
+        open_edges[i] = 0
+        for d in range(4):
+            if not mask & SIDE_BITS[d]:
+                continue
+            j = neighbors[i][d]
+            if assigned[j] == -1:
+                open_edges[root] += 1
+                continue
+            # 邻居朝向 i 的连接被接住
+            rj = find(j)
+            if rj == root:
+                open_edges[root] -= 1
+                cycles += 1
+                merges.append(None)
+                continue
+            if size[root] < size[rj]:
+                root, rj = rj, root
+            merges.append((root, rj, open_edges[root]))
+            parent[rj] = root
+            size[root] += size[rj]
+            open_edges[root] += open_edges[rj] - 1
+        return merges, root
+
+    def unplace(merges):
+        nonlocal cycles
+        for merge in reversed(merges):
+            if merge is None:
+                cycles -= 1
+                continue
+            root, rj, old_open = merge
+            parent[rj] = rj
+            size[root] -= size[rj]
+            open_edges[root] = old_open
+
+    def select():
+        """选出候选最少的空位，返回 (空位, 候选掩码列表)；某个空位已没有候选时返回 None。"""
+        nonlocal nodes
+        nodes += 1
+        if node_limit is not None and nodes > node_limit:
+            raise _NodeLimitReached
+
+        best, best_domain, best_key = -1, 0, None
+        support = 0
+        forced_cycles = 0
+        for i in unfilled:
+            candidates = domain(i)
+            if value[i]:
+                # 与 i 必然相连的连通块：合并后的大小、仍通向空位的连接数，以及因此形成的环
+                roots = []
+                links = 0
+                merged_size = 1
+                merged_open = 0
+                for d in range(4):
+                    if value[i] & SIDE_BITS[d]:
+                        links += 1
+                        root = find(neighbors[i][d])
+                        if root not in roots:
+                            roots.append(root)
+                            merged_size += size[root]
+                            merged_open += open_edges[root]
+                forced_cycles += links - len(roots)
+                if merged_open == links and merged_size < n:
+                    candidates &= _HAS_FREE[care[i]]
+            if not candidates:
+                return None
+            support |= candidates
+            # 候选越少越优先，其次是已确定的边越多越优先
+            key = (candidates.bit_count(), -_POPCOUNT[care[i]], priority[i])
+            if best_key is None or key < best_key:
+                best, best_domain, best_key = i, candidates, key
+        # 剩余的某种石板已经放不进任何空位
+        if available & ~support:
+            return None
+        if spare_edges is not None and cycles + forced_cycles > spare_edges:
+            return None
+        best_domain = [m for m in range(16) if best_domain >> m & 1]
+        if rng is not None:
+            rng.shuffle(best_domain)
+        if abundant:
+            best_domain.sort(key=lambda m: -counts[m])
+        if prefer is not None and prefer[best] in best_domain:
+            best_domain.remove(prefer[best])
+            best_domain.insert(0, prefer[best])
+        return best, best_domain
+
+    def assign(i, mask):
+        """放置掩码并对相邻空位做前向检查，返回 (是否可行, 撤销记录)。"""
+        nonlocal available
+        counts[mask] -= 1
+        if not counts[mask]:
+            available ^= 1 << mask
+        assigned[i] = mask
+        merges, root = place(i, mask)
+        feasible = (open_edges[root] > 0 or size[root] == n) and (
+            spare_edges is None or cycles <= spare_edges)
+
+        saved = []
+        for d in range(4):
+            j = neighbors[i][d]
+            if j == -1 or assigned[j] != -1:
+                continue
+            saved.append((j, care[j], value[j]))
+            bit = SIDE_BITS[_OPPOSITE[d]]
+            care[j] |= bit
+            if mask & SIDE_BITS[d]:
+                value[j] |= bit
+            if feasible and not domain(j):
+                feasible = False
+        return feasible, (mask, merges, saved)
+
+    def unassign(i, undo):
+        nonlocal available
+        mask, merges, saved = undo
+        for j, old_care, old_value in saved:
+            care[j], value[j] = old_care, old_value
+        unplace(merges)
+        assigned[i] = -1
+        if not counts[mask]:
+            available ^= 1 << mask
+        counts[mask] += 1
+
+    def backtrack():
+        """
+        用显式栈代替递归（棋盘再大也不会超过递归深度）。栈中每层为 [空位, 候选列表, 下一个候选的位置, 撤销记录]。
+        找到解（计数模式下凑满 max_solutions 个）时返回 True，搜索完所有分支时返回 False。
+        """
+        stack = []
+        descend = True
+        while True:
+            if descend:
+                if not unfilled:
+                    if solutions is None:
+                        return True
+                    solutions.append(list(assigned))
+                    if len(solutions) >= max_solutions:
+                        return True
+                else:
+                    choice = select()
+                    if choice is not None:
+                        unfilled.discard(choice[0])
+                        stack.append([choice[0], choice[1], 0, None])
+            # 在栈顶撤销上一个候选，尝试下一个；候选用完时弹出这一层
+            descend = False
+            while stack:
+                frame = stack[-1]
+                i = frame[0]
+                if frame[3] is not None:
+                    unassign(i, frame[3])
+                    frame[3] = None
+                if frame[2] == len(frame[1]):
+                    unfilled.add(i)
+                    stack.pop()
+                    continue
+                mask = frame[1][frame[2]]
+                frame[2] += 1
+                feasible, frame[3] = assign(i, mask)
+                if feasible:
+                    descend = True
+                    break
+            if not descend:
+                return False
+
+    def place_fixed():
+        nonlocal available
+        roots = []
+        for i, mask in fixed.items():
+            if not counts[mask] or not domain(i) >> mask & 1:
+                return False
+            counts[mask] -= 1
+            if not counts[mask]:
+                available ^= 1 << mask
+            assigned[i] = mask
+            unfilled.discard(i)
+            roots.append(place(i, mask)[1])
+            for d in range(4):
+                j = neighbors[i][d]
+                if j != -1 and assigned[j] == -1:
+                    care[j] |= SIDE_BITS[_OPPOSITE[d]]
+                    if mask & SIDE_BITS[d]:
+                        value[j] |= SIDE_BITS[_OPPOSITE[d]]
+        # backtrack 只检查刚放下的石板所在的连通块，预先放好的连通块在这里检查一次
+        return all(open_edges[find(root)] > 0 or size[find(root)] == n for root in roots) and (
+            spare_edges is None or cycles <= spare_edges)
+
+    if fixed and not place_fixed():
+        return solutions
+    try:
+        solved = backtrack()
+        if solutions is not None:
+            return solutions
+        return assigned if solved else None
+    finally:
+        if tally is not None:
+            tally[0] += nodes
 
-    def backtrack(slot_index, available_tiles):
-        if slot_index == len(board.empty_slots):
-            # 所有空位都已填充，检查是否为有效解
-            return board.is_fully_solved()
 
-        r, c = board.empty_slots[slot_index]
-        # 遍历所有可用的石板
-        for i in range(len(available_tiles)):
-            tile = available_tiles[i]
+def _luby(k):
+    """Luby 序列的第 k 项（k 从 1 开始）：1, 1, 2, 1, 1, 2, 4, 1, 1, 2, ..."""
+    while True:
+        power = 1
+        while power * 2 - 1 < k:
+            power *= 2
+        if k == power * 2 - 1:
+            return power
+        k -= power - 1
 
-            if board.is_valid_placement(tile, r, c):
-                board.place_tile(tile, r, c)
 
-                # 创建一个移除了当前石板的新列表
-                remaining_tiles = available_tiles[:i] + available_tiles[i + 1:]
+def _search_with_restarts(neighbors, care, counts, seed=0):
+    """
+    回溯搜索的耗时呈重尾分布：多数情况下很快，偶尔会陷入没有解的巨大子树。
+    因此先以较小的节点上限和随机化的选择顺序多次重启，最后一次不设上限以保证完备。
+    节点上限按 Luby 序列增长，大部分重启都很短；两种石板顺序在不同棋盘上各有优劣，
+    重启时交替使用随机顺序和按剩余数量排序。
+    """
+    rng = None
+    tally = [0]
+    start = time.perf_counter()
+    result = None
+    restarts = 0
+    try:
+        for restarts in range(_MAX_RESTARTS):
+            node_limit = _RESTART_NODE_FACTOR * len(neighbors) * _luby(restarts + 1)
+            try:
+                result = _search(neighbors, list(care), [0] * len(neighbors), list(counts), node_limit, rng, tally,
+                                 abundant=restarts % 2 == 1)
+                return result
+            except _NodeLimitReached:
+                if rng is None:
+                    rng = random.Random(seed)
+        restarts = _MAX_RESTARTS
+        result = _search(neighbors, list(care), [0] * len(neighbors), list(counts), tally=tally)
+        return result
+    finally:
+        _SOLVE_NODES.observe(tally[0])
+        _SOLVE_RESTARTS.observe(restarts)
+        _SOLVE_SECONDS.observe(time.perf_counter() - start, result='solved' if result is not None else 'unsolvable')
+
+
+def solve_puzzle(board, tiles):
+    """
+    使用约束搜索求解谜题。
+    石板按 4 位连接掩码归类并以计数形式参与搜索，相同类型的石板不会被重复尝试；
+    找到解后将原始的 Tile 对象依次放回 board.grid。
+    """
+    slots = list(board.empty_slots)
+    if not slots:
+        return board.is_fully_solved()
+    neighbors, care = _build_slots(slots)
 
-                if backtrack(slot_index + 1, remaining_tiles):
-                    return True
+    counts = [0] * 16
+    buckets = [[] for _ in range(16)]
+    for tile in tiles:
+        mask = connections_to_mask(tile.connections)
+        counts[mask] += 1
+        buckets[mask].append(tile)
 
-                # 回溯：如果子问题无解，则移除当前放置的石板
-                board.remove_tile(r, c)
+    if sum(counts) < len(slots):
+        return False
 
+    assigned = _search_with_restarts(neighbors, care, counts)
+    if assigned is None:
         return False
 
-    return backtrack(0, tiles_copy)
+    for (r, c), mask in zip(slots, assigned):
+        board.place_tile(buckets[mask].pop(), r, c)
+    return True
+
+
+def solve_compact(board):
+    """
+    求解一个 CompactBoard 表示的谜题：形状内各格子上的掩码即为可用的石板。
+    返回解出的新 CompactBoard，无解时返回 None。
+    """
+    slots = board.positions()
+    if not slots:
+        return board.copy() if board.is_fully_solved() else None
+    neighbors, care = _build_slots(slots)
+
+    counts = [0] * 16
+    for mask in board.tile_masks():
+        counts[mask] += 1
+
+    assigned = _search_with_restarts(neighbors, care, counts)
+    if assigned is None:
+        return None
+
+    solved = board.copy()
+    for (r, c), mask in zip(slots, assigned):
+        solved.masks[r * board.width + c] = mask
+    return solved
+
+
+def count_solutions(board, limit=2, node_limit=COUNT_NODE_LIMIT):
+    """
+    统计 CompactBoard 谜题的解（不同的掩码布局）的个数，最多数到 limit 个。
+    返回 SolutionCount：count 为找到的解的个数，nodes 为展开的搜索节点数，complete 为 False 表示
+    超过 node_limit 而提前停止（此时 count 只是下界），solutions 为各个解按 board.positions() 顺序的掩码列表。
+    搜索不做随机化，同一个谜题的节点数总是相同，可以用作难度评分。
+    """
+    slots = board.positions()
+    if not slots:
+        solved = board.is_fully_solved()
+        return SolutionCount(int(solved), 0, True, [[]] if solved else [])
+    neighbors, care = _build_slots(slots)
+
+    counts = [0] * 16
+    for mask in board.tile_masks():
+        counts[mask] += 1
+
+    solutions = []
+    tally = [0]
+    try:
+        _search(neighbors, care, [0] * len(slots), counts, node_limit, tally=tally,
+                solutions=solutions, max_solutions=limit)
+        complete = True
+    except _NodeLimitReached:
+        complete = False
+    return SolutionCount(len(solutions), tally[0], complete, solutions)
+
+
+def complete_board(board, fixed, node_limit=COMPLETE_NODE_LIMIT):
+    """
+    保持 fixed（(r, c) 的集合）中的格子不动，重新排列 CompactBoard 其余格子上的石板，使整个棋盘成为一个解。
+    其余格子优先尝试它们当前的石板，尽量保留玩家按其他解放对的位置；只有这些格子参与搜索。
+    返回补全后的新 CompactBoard；无解或超过 node_limit 时返回 None。
+    """
+    slots = board.positions()
+    if not slots:
+        return board.copy() if board.is_fully_solved() else None
+    neighbors, care = _build_slots(slots)
+
+    masks = board.tile_masks()
+    counts = [0] * 16
+    for mask in masks:
+        counts[mask] += 1
+    index = {pos: i for i, pos in enumerate(slots)}
+    fixed_masks = {index[pos]: masks[index[pos]] for pos in fixed}
+
+    try:
+        assigned = _search(neighbors, care, [0] * len(slots), counts, node_limit, fixed=fixed_masks, prefer=masks)
+    except _NodeLimitReached:
+        return None
+    if assigned is None:
+        return None
+
+    completed = board.copy()
+    for (r, c), mask in zip(slots, assigned):
+        completed.masks[r * board.width + c] = mask
+    return completed
@@ -29,6 +29,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const retryBtnClassic = document.getElementById('retryBtnClassic');
     const retryBtnTimed = document.getElementById('retryBtnTimed');
     const solveBtn = document.getElementById('solveBtn');
+    const hintBtn = document.getElementById('hintBtn');
     const uploadBtn = document.getElementById('uploadBtn');
     const imageUploader = document.getElementById('imageUploader');
     const customBtn = document.getElementById('customBtn');
@@ -55,7 +56,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const leaderboardDisplay = document.getElementById('leaderboard-display');
 
     // --- 游戏状态变量 ---
-    let gameMode = null, boardState = null, solutionState = null, initialBoardState = null, countdownInterval = null;
+    let gameMode = null, boardState = null, puzzleId = null, initialBoardState = null, countdownInterval = null;
     let boardSize = { width: 0, height: 0 };
     let isAnimating = false, isDragging = false, isCustomizing = false, isCountingDown = false;
     let draggedTile = null, lastCustomShape = null, timerInterval = null;
@@ -63,6 +64,27 @@ document.addEventListener('DOMContentLoaded', () => {
     let customShape = [], challengeState = {};
     let activeAnimations = [], animationFrameId = null, puzzleJustSolved = false;
     let isConfettiRunning = false;
+    // 紧凑传输格式 "<宽>x<高>:<形状位图>:<每块石板一个十六进制掩码>"，与服务端 grid_codec.py 一致
+    function unpackGrid(s) {
+        const [size, shape, tiles] = s.split(':'), [w, h] = size.split('x').map(Number), grid = []; let k = 0;
+        for (let r = 0; r < h; r++) {
+            const row = []; for (let c = 0; c < w; c++) {
+                const i = r * w + c; if (shape && !((parseInt(shape[i >> 2], 16) >> (3 - (i & 3))) & 1)) { row.push(null); continue }
+                const m = parseInt(tiles[k++], 16); row.push([m >> 3 & 1, m >> 2 & 1, m >> 1 & 1, m & 1])
+            } grid.push(row)
+        } return grid
+    }
+    function packGrid(grid) {
+        let bits = '', tiles = '', shape = '';
+        grid.forEach(row => row.forEach(t => { bits += t ? '1' : '0'; if (t) tiles += (t[0] * 8 + t[1] * 4 + t[2] * 2 + t[3] * 1).toString(16) }));
+        if (bits.includes('0')) { bits = bits.padEnd(Math.ceil(bits.length / 4) * 4, '0'); for (let i = 0; i < bits.length; i += 4) shape += parseInt(bits.slice(i, i + 4), 2).toString(16) }
+        return `${grid[0].length}x${grid.length}:${shape}:${tiles}`
+    }
+    // 计时挑战的操作记录：每次交换记两个格子下标（各一个字节），255,255 表示重试，整体编码为 base64url
+    const MOVE_RESET = 255;
+    function recordMove(a, b) { if (gameMode === 'timed' && challengeState.moves) challengeState.moves[challengeState.currentPuzzleIndex].push(a, b) }
+    function encodeMoves(moves) { return btoa(String.fromCharCode(...moves)).replace(/\+/g, '-').replace(/\//g, '_').replace(/=+$/, '') }
+    function decodePuzzle(p) { if (p.format === 'packed') { p.shuffled_grid = unpackGrid(p.shuffled_grid); if (p.solution_grid) p.solution_grid = unpackGrid(p.solution_grid) } return p }
     function interpolateColor(c1, c2, f) {
         const r1 = parseInt(c1.slice(1, 3), 16), g1 = parseInt(c1.slice(3, 5), 16), b1 = parseInt(c1.slice(5, 7), 16);
         const r2 = parseInt(c2.slice(1, 3), 16), g2 = parseInt(c2.slice(3, 5), 16), b2 = parseInt(c2.slice(5, 7), 16);
@@ -219,7 +241,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function loadTimedPuzzle(i, sT = !0) {
-        resetPuzzleState(); const p = challengeState.puzzles[i]; boardState = p.shuffled_grid; solutionState = p.solution_grid;
+        resetPuzzleState(); const p = challengeState.puzzles[i]; boardState = p.shuffled_grid; puzzleId = p.puzzle_id;
         initialBoardState = JSON.parse(JSON.stringify(p.shuffled_grid)); boardSize = { width: boardState[0].length, height: boardState.length };
         canvas.width = boardSize.width * CELL_SIZE; canvas.height = boardSize.height * CELL_SIZE;
         puzzleCounterEl.textContent = `第 ${i + 1} / 3 关`; drawBoard(); if (sT) challengeState.puzzleStartTime = Date.now()
@@ -282,7 +304,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 [boardState[ro][co], boardState[rn][cn]] = [boardState[rn][cn], boardState[ro][co]]; s = !0
             }
         }
-        if (s) { drawBoardBase(); drawAllTiles({}); const iS = checkPuzzleCompletion(); if (!iS) triggerConnectionAnimations({ r: ro, c: co }, { r: rn, c: cn }) } else { drawBoard() }
+        if (s) { recordMove(ro * boardSize.width + co, rn * boardSize.width + cn); drawBoardBase(); drawAllTiles({}); const iS = checkPuzzleCompletion(); if (!iS) triggerConnectionAnimations({ r: ro, c: co }, { r: rn, c: cn }) } else { drawBoard() }
     }
 
     async function runSolveAnimation(swaps) {
@@ -362,9 +384,9 @@ document.addEventListener('DOMContentLoaded', () => {
         playAgainBtn.style.display = 'none'; resetPuzzleState(); try {
             const r = await fetch('/api/new_custom_puzzle', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ shape })
+                headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ shape, include_solution: false, format: 'packed' })
             }); if (!r.ok) { const eD = await r.json(); throw new Error(eD.error || `Server error: ${r.statusText}`) }
-            const d = await r.json(); boardState = d.shuffled_grid; solutionState = d.solution_grid; initialBoardState = JSON.parse(JSON.stringify(d.shuffled_grid));
+            const d = decodePuzzle(await r.json()); boardState = d.shuffled_grid; puzzleId = d.puzzle_id; initialBoardState = JSON.parse(JSON.stringify(d.shuffled_grid));
             boardSize = { width: boardState[0].length, height: boardState.length }; canvas.width = boardSize.width * CELL_SIZE; canvas.height = boardSize.height * CELL_SIZE;
             infoPanel.textContent = '自定义谜题生成成功！'; lastCustomShape = JSON.parse(JSON.stringify(shape)); playAgainBtn.style.display = 'inline-block';
             drawBoard()
@@ -399,8 +421,8 @@ document.addEventListener('DOMContentLoaded', () => {
     async function fetchNewPuzzle(w = 5, h = 5) {
         infoPanel.textContent = '正在生成新谜题...'; isAnimating = !0; hideCustomizationUI(); playAgainBtn.style.display = 'none';
         lastCustomShape = null; resetPuzzleState(); try {
-            const r = await fetch(`/api/new_puzzle?width=${w}&height=${h}`); if (!r.ok) throw new Error(`Server error: ${r.statusText}`);
-            const d = await r.json(); boardState = d.shuffled_grid; solutionState = d.solution_grid; initialBoardState = JSON.parse(JSON.stringify(d.shuffled_grid));
+            const r = await fetch(`/api/new_puzzle?width=${w}&height=${h}&include_solution=0&format=packed`); if (!r.ok) throw new Error(`Server error: ${r.statusText}`);
+            const d = decodePuzzle(await r.json()); boardState = d.shuffled_grid; puzzleId = d.puzzle_id; initialBoardState = JSON.parse(JSON.stringify(d.shuffled_grid));
             boardSize = { width: boardState[0].length, height: boardState.length }; canvas.width = boardSize.width * CELL_SIZE; canvas.height = boardSize.height * CELL_SIZE;
             infoPanel.textContent = '拖动石板，完成连线！'; drawBoard()
         } catch (e) { console.error("Failed to fetch puzzle:", e); infoPanel.textContent = `加载失败: ${e.message}` }
@@ -415,15 +437,17 @@ document.addEventListener('DOMContentLoaded', () => {
             const r = await fetch('/api/challenge/start', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ width: w, height: h })
+                body: JSON.stringify({ width: w, height: h, include_solution: false, format: 'packed' })
             });
             if (!r.ok) throw new Error(`服务器错误: ${r.statusText}`);
             const d = await r.json();
             if (!d.puzzles || d.puzzles.length < 3) throw new Error('未能从服务器获取到完整的谜题。');
             challengeState = {
-                puzzles: d.puzzles,
+                puzzles: d.puzzles.map(decodePuzzle),
                 currentPuzzleIndex: 0,
                 times: [],
+                moves: [[], [], []],
+                token: d.token,
                 totalPausedTime: 0,
                 difficulty: `${w}x${h}`
             };
@@ -487,18 +511,19 @@ document.addEventListener('DOMContentLoaded', () => {
         })
     }); const retryLogic = () => {
         if (initialBoardState && !isAnimating) {
-            resetPuzzleState();
+            resetPuzzleState(); recordMove(MOVE_RESET, MOVE_RESET);
             boardState = JSON.parse(JSON.stringify(initialBoardState)); infoPanel.textContent = '已重试，请继续！'; drawBoard()
         }
     };
     retryBtnClassic.addEventListener('click', retryLogic); retryBtnTimed.addEventListener('click', retryLogic);
     solveBtn.addEventListener('click', async () => {
-        if (!boardState || !solutionState || isAnimating) return; infoPanel.textContent = '正在向服务器请求解法...';
+        if (!boardState || !puzzleId || isAnimating) return; infoPanel.textContent = '正在向服务器请求解法...';
         try {
             const r = await fetch('/api/solve', {
                 method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({
-                    current_grid: boardState,
-                    solution_grid: solutionState
+                    current_grid: packGrid(boardState),
+                    puzzle_id: puzzleId,
+                    order: 'nearest'
                 })
             }); if (!r.ok) throw new Error("求解失败"); const d = await r.json(); if (d.swaps && d.swaps.length > 0) await runSolveAnimation(d.swaps);
             else {
@@ -508,12 +533,26 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         } catch (e) { infoPanel.textContent = e.message }
     });
+    hintBtn.addEventListener('click', async () => {
+        if (!boardState || !puzzleId || isAnimating) return; infoPanel.textContent = '正在计算提示...';
+        try {
+            const r = await fetch('/api/hint', {
+                method: 'POST', headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ current_grid: packGrid(boardState), puzzle_id: puzzleId })
+            }); if (!r.ok) throw new Error("获取提示失败"); const d = await r.json();
+            if (!d.swap) { infoPanel.textContent = '已经是正确答案了！'; return }
+            const [p1, p2] = d.swap;
+            [boardState[p1[0]][p1[1]], boardState[p2[0]][p2[1]]] = [boardState[p2[0]][p2[1]], boardState[p1[0]][p1[1]]];
+            triggerConnectionAnimations({ r: p1[0], c: p1[1] }, { r: p2[0], c: p2[1] }); drawBoard();
+            infoPanel.textContent = `提示：已交换一步，还有 ${d.remaining} 块石板不在位置上`; checkPuzzleCompletion()
+        } catch (e) { infoPanel.textContent = e.message }
+    });
     uploadBtn.addEventListener('click', () => { if (isAnimating) return; imageUploader.click() });
     imageUploader.addEventListener('change', async e => {
         const f = e.target.files[0]; if (!f || isAnimating) return; infoPanel.textContent = '正在上传和识别图片...';
-        isAnimating = !0; resetPuzzleState(); const fd = new FormData(); fd.append('puzzle_image', f); try {
+        isAnimating = !0; resetPuzzleState(); const fd = new FormData(); fd.append('puzzle_image', f); fd.append('include_solution', '0'); fd.append('format', 'packed'); try {
             const r = await fetch('/api/upload_image', { method: 'POST', body: fd });
-            if (!r.ok) { const eD = await r.json(); throw new Error(eD.error || '识别失败') } const d = await r.json(); boardState = d.shuffled_grid; solutionState = d.solution_grid;
+            if (!r.ok) { const eD = await r.json(); throw new Error(eD.error || '识别失败') } const d = decodePuzzle(await r.json()); boardState = d.shuffled_grid; puzzleId = d.puzzle_id;
             initialBoardState = JSON.parse(JSON.stringify(d.shuffled_grid)); boardSize = { width: boardState[0].length, height: boardState.length };
             canvas.width = boardSize.width * CELL_SIZE; canvas.height = boardSize.height * CELL_SIZE; lastCustomShape = null; playAgainBtn.style.display = 'none';
             infoPanel.textContent = '图片识别成功，开始游戏！'; drawBoard()
@@ -554,8 +593,8 @@ document.addEventListener('DOMContentLoaded', () => {
             const r = await fetch('/api/leaderboard/submit', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({
-                    difficulty: challengeState.difficulty, username: u, times: challengeState.times,
-                    avgTime: challengeState.avgTime
+                    username: u, token: challengeState.token, times: challengeState.times,
+                    moves: challengeState.moves.map(encodeMoves)
                 })
             }); if (!r.ok) throw new Error("提交失败"); const d = await r.json(); if (d.success) submitScoreBtn.textContent = `提交成功! 您的排名: 第 ${d.rank} 名`;
             else submitScoreBtn.textContent = '提交失败'
@@ -0,0 +1,175 @@
+# swap_planner.py
+# 计算把当前棋盘变换为目标棋盘所需的交换步骤
+
+from collections import defaultdict, deque
+
+SWAP_ORDERS = ('default', 'nearest')
+# 去掉 2-环后剩余的错位格子不超过该数时，精确搜索交换最少的环分解
+EXACT_CYCLE_EDGES = 12
+
+
+def _tile_key(tile):
+    # JSON 中的连接列表不可哈希，统一转为元组；None 表示形状外的格子
+    return tuple(tile) if tile is not None else None
+
+
+def _shortest_cycle(counts, start, types):
+    """在类型图中找一条经过 start 的最短环（BFS），返回类型列表 [start, ...]，不存在时返回 None。"""
+    parent = {start: None}
+    frontier = [start]
+    while frontier:
+        next_frontier = []
+        for a in frontier:
+            for b in range(types):
+                if not counts[a][b]:
+                    continue
+                if b == start:
+                    cycle = []
+                    while a is not None:
+                        cycle.append(a)
+                        a = parent[a]
+                    return cycle[::-1]
+                if b not in parent:
+                    parent[b] = a
+                    next_frontier.append(b)
+        frontier = next_frontier
+    return None
+
+
+def _max_cycles(counts, types, memo):
+    """
+    精确求环数最多的分解：任取一条边，它必然属于某个简单环，枚举所有经过它的简单环后递归。
+    返回 (环的个数, 环列表)。只用于边数不超过 EXACT_CYCLE_EDGES 的小规模情形。
+    """
+    key = tuple(tuple(row) for row in counts)
+    if key in memo:
+        return memo[key]
+    edge = next(((a, b) for a in range(types) for b in range(types) if counts[a][b]), None)
+    if edge is None:
+        return 0, []
+    a, b = edge
+    best = (0, [])
+    counts[a][b] -= 1
+
+    def extend(path, seen):
+        nonlocal best
+        last = path[-1]
+        if last == a:
+            # 路径上的边在延伸时已经扣除
+            found, cycles = _max_cycles(counts, types, memo)
+            if found + 1 > best[0]:
+                best = (found + 1, [path[:-1]] + cycles)
+            return
+        for nxt in range(types):
+            if counts[last][nxt] and nxt not in seen:
+                counts[last][nxt] -= 1
+                seen.add(nxt)
+                extend(path + [nxt], seen)
+                seen.discard(nxt)
+                counts[last][nxt] += 1
+
+    extend([a, b], {b})
+    counts[a][b] += 1
+    memo[key] = best
+    return best
+
+
+def _decompose(counts, types):
+    """
+    把类型图（counts[a][b] 为持有 a、需要 b 的格子数）分解为尽量多的环。
+    边数较少时精确搜索；否则反复取出当前最短的环。
+    """
+    edges = sum(map(sum, counts))
+    if edges <= EXACT_CYCLE_EDGES:
+        return _max_cycles(counts, types, {})[1]
+    cycles = []
+    while True:
+        found = [cycle for cycle in (_shortest_cycle(counts, start, types) for start in range(types)) if cycle]
+        if not found:
+            return cycles
+        cycle = min(found, key=len)
+        cycles.append(cycle)
+        for x, y in zip(cycle, cycle[1:] + cycle[:1]):
+            counts[x][y] -= 1
+
+
+def _cycle_units(initial_grid, final_grid):
+    """
+    按环分解得到交换组。每个错位的格子是类型图上的一条边“现有类型 -> 需要的类型”，
+    长度为 k 的环需要 k-1 次交换，因此环越多交换越少。
+    两个格子互相想要对方的石板（2-环）时直接交换：总存在一个最优分解包含尽可能多的 2-环；
+    剩余的边再求环分解。
+    """
+    rows, cols = len(initial_grid), len(initial_grid[0])
+    positions = defaultdict(deque)
+    type_index = {}
+    for r in range(rows):
+        for c in range(cols):
+            current = _tile_key(initial_grid[r][c])
+            target = _tile_key(final_grid[r][c])
+            if current != target:
+                a = type_index.setdefault(current, len(type_index))
+                b = type_index.setdefault(target, len(type_index))
+                positions[(a, b)].append((r, c))
+
+    units = []
+    for (a, b), queue in positions.items():
+        reverse = positions.get((b, a))
+        while queue and reverse:
+            units.append([[queue.popleft(), reverse.popleft()]])
+
+    types = len(type_index)
+    counts = [[0] * types for _ in range(types)]
+    for (a, b), queue in positions.items():
+        counts[a][b] = len(queue)
+    for cycle in _decompose(counts, types):
+        # p_i 持有 t_i、需要 t_{i+1}：依次交换相邻的两个位置，每一步放对一块
+        cycle_positions = [positions[(x, y)].popleft() for x, y in zip(cycle, cycle[1:] + cycle[:1])]
+        units.append([[p, q] for p, q in zip(cycle_positions, cycle_positions[1:])])
+    return units
+
+
+def _plan_units(initial_grid, final_grid):
+    """
+    返回若干组交换，每组内的交换必须按顺序执行，不同组之间互不影响。
+    石板类型数是常数，环分解的耗时与错位格子数成线性关系。
+    """
+    return _cycle_units(initial_grid, final_grid)
+
+
+def _swap_distance(swap):
+    (r1, c1), (r2, c2) = swap
+    return abs(r1 - r2) + abs(c1 - c2)
+
+
+def plan_swaps(initial_grid, final_grid, order='default'):
+    """
+    计算把 initial_grid 变为 final_grid 的交换序列，每一步为 [(r1, c1), (r2, c2)]。
+    相同类型的石板可以互换，因此只比较连接而不比较石板身份。
+    order='nearest' 时，互不依赖的交换组按第一步交换的距离从近到远排列，便于前端播放动画。
+    """
+    if order not in SWAP_ORDERS:
+        raise ValueError(f"Unknown swap order: {order}")
+    units = _plan_units(initial_grid, final_grid)
+    if order == 'nearest':
+        units.sort(key=lambda unit: (_swap_distance(unit[0]), unit[0][0]))
+    return [swap for unit in units for swap in unit]
+
+
+def next_swap(initial_grid, final_grid):
+    """
+    返回把 initial_grid 变为 final_grid 的最佳下一步交换 [(r1, c1), (r2, c2)]，已经一致时返回 None。
+    优先选择一次放对两块石板的交换（2-环），其次选择距离最近的。
+    """
+    units = _plan_units(initial_grid, final_grid)
+    if not units:
+        return None
+    best = min(units, key=lambda unit: (len(unit) > 1, _swap_distance(unit[0]), unit[0][0]))
+    return best[0]
+
+
+def count_misplaced(initial_grid, final_grid):
+    """initial_grid 中与 final_grid 不一致的格子数。"""
+    return sum(1 for initial_row, final_row in zip(initial_grid, final_grid)
+               for current, target in zip(initial_row, final_row)
+               if _tile_key(current) != _tile_key(target))
@@ -0,0 +1,79 @@
+# tests/test_challenge_verifier.py
+
+import pytest
+
+import challenge_verifier
+import puzzle_generator
+import swap_planner
+
+KEY = b'test-key'
+STARTED = 1_000_000_000_000
+
+
+def _solved_run(seed):
+    shuffled, solution = puzzle_generator.generate_random_puzzle_compact(4, 4, seed=seed)
+    swaps = swap_planner.plan_swaps(shuffled.to_lists(), solution.to_lists())
+    width = shuffled.width
+    moves = challenge_verifier.encode_moves([(r1 * width + c1, r2 * width + c2) for (r1, c1), (r2, c2) in swaps])
+    return shuffled, moves, len(swaps)
+
+
+@pytest.fixture
+def challenge():
+    runs = [_solved_run(seed) for seed in range(3)]
+    token = challenge_verifier.issue_token(KEY, ['a', 'b', 'c'], '4x4', started=STARTED)
+    content = challenge_verifier.read_token(KEY, token, now=STARTED)
+    boards = [board for board, _, _ in runs]
+    moves = [moves for _, moves, _ in runs]
+    times = [challenge_verifier.MIN_MOVE_MS * swaps + 500 for _, _, swaps in runs]
+    return content, boards, moves, times
+
+
+def test_accepts_plausible_submission(challenge):
+    content, boards, moves, times = challenge
+    challenge_verifier.verify_submission(content, boards, times, moves, now=STARTED + sum(times) + 10_000)
+
+
+def test_rejects_times_beyond_elapsed_server_time(challenge):
+    content, boards, moves, times = challenge
+    with pytest.raises(challenge_verifier.ScoreRejected) as error:
+        challenge_verifier.verify_submission(content, boards, times, moves, now=STARTED + 100)
+    assert error.value.reason == 'too_fast'
+
+
+def test_token_can_only_be_used_once(challenge):
+    content, boards, moves, times = challenge
+    used = set()
+
+    def consume(nonce):
+        if nonce in used:
+            return False
+        used.add(nonce)
+        return True
+
+    now = STARTED + sum(times) + 10_000
+    challenge_verifier.verify_submission(content, boards, times, moves, now=now, consume=consume)
+    with pytest.raises(challenge_verifier.ScoreRejected) as error:
+        challenge_verifier.verify_submission(content, boards, times, moves, now=now, consume=consume)
+    assert error.value.reason == 'replayed'
+
+
+def test_tokens_have_distinct_nonces():
+    first = challenge_verifier.read_token(KEY, challenge_verifier.issue_token(KEY, ['a'], '4x4', started=STARTED),
+                                          now=STARTED)
+    second = challenge_verifier.read_token(KEY, challenge_verifier.issue_token(KEY, ['a'], '4x4', started=STARTED),
+                                           now=STARTED)
+    assert first['nonce'] != second['nonce']
+
+
+def test_challenge_ids_hide_the_seeded_id():
+    puzzle_id = puzzle_generator.make_puzzle_id(5, 5, 12345)
+    first = challenge_verifier.challenge_puzzle_id(KEY, puzzle_id)
+    second = challenge_verifier.challenge_puzzle_id(KEY, puzzle_id)
+    assert first != second and puzzle_id not in first
+    assert challenge_verifier.is_challenge_id(first)
+    assert challenge_verifier.seeded_puzzle_id(KEY, first) == puzzle_id
+    with pytest.raises(ValueError):
+        puzzle_generator.parse_puzzle_id(challenge_verifier.seeded_puzzle_id(b'other-key', first))
+    with pytest.raises(ValueError):
+        challenge_verifier.seeded_puzzle_id(KEY, puzzle_id)
@@ -0,0 +1,51 @@
+# tests/test_game_logic.py
+
+import random
+
+import pytest
+
+import puzzle_generator
+from game_logic import MASK_CONNECTIONS, Board, Tile
+
+
+def _check(board):
+    assert board.is_fully_solved() == board.is_fully_solved(full_check=True)
+    return board.is_fully_solved()
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_incremental_state_matches_full_scan(seed):
+    rng = random.Random(seed)
+    width, height = rng.randint(1, 5), rng.randint(2, 5)
+    _, solution = puzzle_generator.generate_random_puzzle_compact(width, height, seed=seed)
+    board = Board.from_compact(solution)
+    answer = solution.to_grid()
+    assert _check(board)
+    cells = [(r, c) for r in range(height) for c in range(width)]
+    solved_states = 0
+    for _ in range(300):
+        r, c = rng.choice(cells)
+        action = rng.random()
+        if action < 0.35:
+            # 通常不是最近一次放置的格子，走 _rebuild_components 路径
+            board.remove_tile(r, c)
+        elif action < 0.7 and answer[r][c] is not None:
+            board.place_tile(answer[r][c], r, c)
+        elif action < 0.8:
+            # 放一块再立即拿走：最近一次放置的撤销路径
+            board.place_tile(Tile(MASK_CONNECTIONS[rng.randrange(16)]), r, c)
+            _check(board)
+            board.remove_tile(r, c)
+        else:
+            # 任意石板，包括放在形状外的格子上
+            board.place_tile(Tile(MASK_CONNECTIONS[rng.randrange(16)]), r, c)
+        solved_states += _check(board)
+        if rng.random() < 0.05:
+            # 偶尔恢复到解，保证序列中经常出现已解决的状态
+            for rr, cc in cells:
+                if answer[rr][cc] is None:
+                    board.remove_tile(rr, cc)
+                else:
+                    board.place_tile(answer[rr][cc], rr, cc)
+            assert _check(board)
+    assert solved_states > 0
@@ -0,0 +1,48 @@
+# tests/test_job_executor.py
+
+import threading
+import time
+
+import pytest
+
+import job_executor
+
+
+@pytest.fixture
+def executor():
+    executor = job_executor.JobExecutor(max_workers=2, queue_size=2, timeout=5)
+    # 先启动工作进程，避免 spawn 的启动时间计入任务的超时
+    executor.run(time.sleep, 0)
+    executor.run(time.sleep, 0)
+    yield executor
+    executor._get_pool().shutdown(wait=False, cancel_futures=True)
+
+
+def test_timeout_does_not_kill_unrelated_job(executor):
+    results = {}
+
+    def unrelated():
+        results['unrelated'] = executor.run(time.sleep, 1.5)
+        results['done'] = True
+
+    thread = threading.Thread(target=unrelated)
+    thread.start()
+    time.sleep(0.2)
+    with pytest.raises(job_executor.JobTimeout):
+        executor.run(time.sleep, 30, timeout=0.5)
+    thread.join()
+    assert results == {'unrelated': None, 'done': True}
+    # 超时的任务所在的进程池在其他任务结束后被终止，新的任务使用新的进程池
+    assert executor.run(sum, [1, 2, 3]) == 6
+
+
+def test_stuck_pool_is_terminated_after_others_finish(executor):
+    pool = executor._get_pool()
+    processes = list(pool._processes.values())
+    with pytest.raises(job_executor.JobTimeout):
+        executor.run(time.sleep, 30, timeout=0.5)
+    deadline = time.monotonic() + 5
+    while any(process.is_alive() for process in processes):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert executor._get_pool() is not pool
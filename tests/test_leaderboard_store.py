@@ -0,0 +1,193 @@
+# tests/test_leaderboard_store.py
+
+import random
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import leaderboard_store
+
+
+@pytest.fixture(params=leaderboard_store.SCORE_DURABILITY_MODES)
+def store(request, tmp_path):
+    store = leaderboard_store.LeaderboardStore(str(tmp_path / 'scores.db'), durability=request.param, batch_ms=1)
+    store.init_schema()
+    yield store
+    store.flush()
+
+
+def _token(nonce):
+    return nonce, time.time() + 3600
+
+
+def _expected_ranks(best_times):
+    """用 RANK() OVER 计算 {username: time} 的排名，作为对照。"""
+    with sqlite3.connect(':memory:') as conn:
+        conn.execute('CREATE TABLE t (username TEXT, time REAL)')
+        conn.executemany('INSERT INTO t VALUES (?, ?)', best_times.items())
+        return dict(conn.execute('SELECT username, RANK() OVER (ORDER BY time) FROM t'))
+
+
+def _merge_best(best_times, username, new_time):
+    old = best_times.get(username)
+    best_times[username] = new_time if old is None else min(old, new_time)
+
+
+def test_submit_returns_the_rank_over_all_scores(store):
+    rng = random.Random(0)
+    best_times = {}
+    for _ in range(200):
+        # 时间取整，经常出现并列
+        username, average_time = f'user{rng.randrange(40)}', float(rng.randrange(30))
+        rank = store.submit('5x5', username, average_time, average_time)
+        _merge_best(best_times, username, average_time)
+        assert rank == _expected_ranks(best_times)[username]
+    store.flush()
+    expected = _expected_ranks(best_times)
+    for username in best_times:
+        assert store.user_rank('5x5', 'average', username)['rank'] == expected[username]
+
+
+def test_concurrent_submits_are_all_written(store):
+    rng = random.Random(1)
+    submissions = [(f'user{rng.randrange(30)}', float(rng.randrange(50))) for _ in range(300)]
+
+    def worker(part):
+        for username, average_time in part:
+            assert store.submit('6x6', username, average_time, average_time) >= 1
+
+    threads = [threading.Thread(target=worker, args=(submissions[i::6],)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.flush()
+    best_times = {}
+    for username, average_time in submissions:
+        _merge_best(best_times, username, average_time)
+    expected = _expected_ranks(best_times)
+    for username in best_times:
+        assert store.user_rank('6x6', 'average', username) == {'rank': expected[username],
+                                                                'time': best_times[username]}
+
+
+def test_rank_combines_committed_and_queued_scores(tmp_path):
+    store = leaderboard_store.LeaderboardStore(str(tmp_path / 'scores.db'), durability='async')
+    store.init_schema()
+    rng = random.Random(2)
+    best_times = {}
+    committed = {}
+    for i in range(60):
+        average_time = float(rng.randrange(40))
+        committed[('7x7', f'user{i}')] = (None, average_time)
+        _merge_best(best_times, f'user{i}', average_time)
+    store.import_scores(committed)
+    # 不启动写入线程，直接构造“正在写入”和“待写入”的成绩，其中既有新用户也有已提交的用户
+    for batch in (store._inflight, store._pending):
+        for _ in range(30):
+            username, average_time = f'user{rng.randrange(90)}', float(rng.randrange(40))
+            times = batch.setdefault(('7x7', username), [None, None])
+            times[1] = leaderboard_store._min_time(times[1], average_time)
+            _merge_best(best_times, username, average_time)
+    store._pending_tokens['n1'] = (('7x7', 'token-user'), (None, 3.0), time.time() + 3600)
+    _merge_best(best_times, 'token-user', 3.0)
+    # 其他难度的成绩不影响排名
+    store._pending[('8x8', 'user0')] = [None, 0.0]
+    expected = _expected_ranks(best_times)
+    for username in best_times:
+        assert store._rank_with_pending('7x7', username, 'best_average_time') == expected[username]
+    assert store._rank_with_pending('7x7', 'nobody', 'best_average_time') == -1
+
+
+def test_top_version_changes_only_when_the_top_list_changes(tmp_path):
+    store = leaderboard_store.LeaderboardStore(str(tmp_path / 'scores.db'), durability='sync')
+    store.init_schema()
+    store.import_scores({('5x5', f'user{i}'): (float(i), float(i)) for i in range(1, leaderboard_store.TOP_LIMIT + 1)})
+    version, top = store.top_scores_versioned('5x5', 'average')
+    assert len(top) == leaderboard_store.TOP_LIMIT
+
+    # 排在前 TOP_LIMIT 名之外的新成绩、没有刷新个人最好的成绩都不改变版本号
+    store.submit('5x5', 'slow', 500.0, 500.0)
+    store.submit('5x5', 'user1', 50.0, 50.0)
+    assert store.top_scores_versioned('5x5', 'average') == (version, top)
+    # 另一个难度的成绩不影响这个榜单
+    store.submit('6x6', 'fast', 0.5, 0.5)
+    assert store.top_scores_versioned('5x5', 'average')[0] == version
+
+    store.submit('5x5', 'fast', 0.5, 0.5)
+    new_version, new_top = store.top_scores_versioned('5x5', 'average')
+    assert new_version != version
+    assert new_top[0] == {'username': 'fast', 'time': 0.5}
+    # 单次成绩榜同样失效
+    assert store.top_scores_versioned('5x5', 'single')[1][0]['username'] == 'fast'
+
+
+def test_writer_survives_unexpected_errors(tmp_path, monkeypatch):
+    store = leaderboard_store.LeaderboardStore(str(tmp_path / 'scores.db'), durability='group', batch_ms=1)
+    store.init_schema()
+    monkeypatch.setattr(leaderboard_store, 'WRITE_ERROR_BACKOFF', 0.01)
+    write_batch = store._write_batch
+    failures = []
+
+    def flaky(conn, scores, tokens):
+        if not failures:
+            failures.append(True)
+            raise RuntimeError("unexpected")
+        return write_batch(conn, scores, tokens)
+
+    monkeypatch.setattr(store, '_write_batch', flaky)
+    assert store.submit('5x5', 'alice', 10.0, 12.0, token=_token('n1')) == 1
+    assert store.flush()
+    assert failures and store._writer.is_alive()
+    assert store._inflight == {} and store._inflight_tokens == {}
+    assert store.user_rank('5x5', 'average', 'alice') == {'rank': 1, 'time': 12.0}
+    assert store.submit('5x5', 'mallory', 1.0, 1.0, token=_token('n1')) is None
+
+
+def test_token_is_used_only_once(store):
+    assert store.submit('4x4', 'alice', 10.0, 12.0, token=_token('n1')) == 1
+    store.flush()
+    assert store.submit('4x4', 'mallory', 1.0, 1.0, token=_token('n1')) is None
+    store.flush()
+    assert store.user_rank('4x4', 'average', 'mallory') is None
+
+
+def test_failed_write_does_not_use_the_token(tmp_path, monkeypatch):
+    store = leaderboard_store.LeaderboardStore(str(tmp_path / 'scores.db'), durability='sync')
+    store.init_schema()
+
+    def fail(conn, scores):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(store, '_write_scores', fail)
+        with pytest.raises(sqlite3.OperationalError):
+            store.submit('4x4', 'alice', 10.0, 12.0, token=_token('n1'))
+    assert store.submit('4x4', 'alice', 10.0, 12.0, token=_token('n1')) == 1
+
+
+def test_queued_token_is_not_accepted_twice(tmp_path):
+    store = leaderboard_store.LeaderboardStore(str(tmp_path / 'scores.db'), durability='async', batch_ms=50)
+    store.init_schema()
+    assert store.submit('4x4', 'bob', 5.0, 6.0, token=_token('n1')) == 1
+    assert store.submit('4x4', 'alice', 1.0, 1.0, token=_token('n1')) is None
+    store.flush()
+    assert store.user_rank('4x4', 'average', 'bob')['rank'] == 1
+    assert store.user_rank('4x4', 'average', 'alice') is None
+
+
+def test_batch_skips_scores_of_tokens_used_elsewhere(tmp_path):
+    # 另一个进程在这批写入之前登记了同一个令牌：这批中该令牌的成绩不写入，其余照常写入
+    other = leaderboard_store.LeaderboardStore(str(tmp_path / 'scores.db'), durability='sync')
+    other.init_schema()
+    other.submit('4x4', 'alice', 10.0, 12.0, token=_token('n1'))
+    store = leaderboard_store.LeaderboardStore(str(tmp_path / 'scores.db'), durability='group')
+    tokens = {'n1': (('4x4', 'bob'), (5.0, 6.0), time.time() + 3600),
+              'n2': (('4x4', 'carol'), (7.0, 8.0), time.time() + 3600)}
+    with store.connection() as conn:
+        rejected, written = store._write_batch(conn, {}, tokens)
+    assert rejected == {'n1'} and written == 1
+    assert store.user_rank('4x4', 'average', 'bob') is None
+    assert store.user_rank('4x4', 'average', 'carol')['rank'] == 1
@@ -0,0 +1,77 @@
+# tests/test_metrics.py
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    return tmp_path
+
+
+def _metrics_files(directory):
+    # 测试进程自己的后台线程也可能把指标写进这个目录
+    return sorted(path.name for path in directory.glob('*.json') if path.name != f'{os.getpid()}.json')
+
+
+def _write_process_file(directory, pid, value):
+    sample = {'kind': 'counter', 'help': "Test counter.", 'labels': [], 'samples': [[[], value]]}
+    (directory / f'{pid}.json').write_text(json.dumps({'test_stale_total': sample}), encoding='utf-8')
+
+
+def _dead_pid():
+    child = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    return int(child.stdout)
+
+
+def _write_histogram_file(directory, pid, value):
+    sample = {'kind': 'histogram', 'help': "Test histogram.", 'labels': [], 'buckets': [1, 10],
+              'samples': [[[], [int(value <= 1), int(value <= 10), value, 1]]]}
+    (directory / f'{pid}.json').write_text(json.dumps({'test_archived_seconds': sample}), encoding='utf-8')
+
+
+def test_remove_process_keeps_its_counters(metrics_dir):
+    _write_process_file(metrics_dir, os.getppid(), 3)
+    assert 'test_stale_total 3' in metrics.render()
+    metrics.remove_process(os.getppid())
+    assert not (metrics_dir / f'{os.getppid()}.json').exists()
+    assert 'test_stale_total 3' in metrics.render()
+
+
+def test_archive_accumulates_exited_processes(metrics_dir):
+    first, second = _dead_pid(), _dead_pid()
+    _write_process_file(metrics_dir, first, 2)
+    metrics.remove_process(first)
+    _write_process_file(metrics_dir, second, 5)
+    _write_histogram_file(metrics_dir, os.getppid(), 4)
+    metrics.remove_process(second)
+    metrics.remove_process(os.getppid())
+    text = metrics.render()
+    assert 'test_stale_total 7' in text
+    assert 'test_archived_seconds_bucket{le="10"} 1' in text
+    assert 'test_archived_seconds_sum 4' in text
+    assert _metrics_files(metrics_dir) == [metrics.ARCHIVE_FILE]
+
+
+def test_dead_process_files_are_archived(metrics_dir):
+    dead_pid = _dead_pid()
+    _write_process_file(metrics_dir, dead_pid, 5)
+    assert 'test_stale_total 5' in metrics.render()
+    assert not (metrics_dir / f'{dead_pid}.json').exists()
+    assert 'test_stale_total 5' in metrics.render()
+
+
+def test_clear_removes_all_files(metrics_dir):
+    _write_process_file(metrics_dir, os.getppid(), 1)
+    metrics.remove_process(os.getppid())
+    _write_process_file(metrics_dir, os.getppid(), 1)
+    metrics.clear()
+    assert _metrics_files(metrics_dir) == []
+    assert 'test_stale_total' not in metrics.render()
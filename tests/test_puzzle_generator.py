@@ -0,0 +1,47 @@
+# tests/test_puzzle_generator.py
+
+import time
+
+import puzzle_generator
+import puzzle_pool
+
+
+def test_small_puzzles_are_rated():
+    _, _, solution, rating = puzzle_generator.generate_rated_puzzle_compact(5, 5, seed=3)
+    assert solution is not None
+    assert rating is not None and rating.unique
+
+
+def test_large_puzzles_skip_rating():
+    start = time.perf_counter()
+    _, _, solution, rating = puzzle_generator.generate_rated_puzzle_compact(20, 20, seed=0)
+    assert solution is not None and rating is None
+    assert time.perf_counter() - start < 1
+
+
+def test_pool_refills_unrated_puzzles():
+    # 没有评分的谜题不是生成失败，后台线程应当照常补充
+    pool = puzzle_pool.PuzzlePool(sizes=[(15, 15)])
+    _, _, solution, rating = pool.get(15, 15)
+    assert solution is not None and rating is None
+    deadline = time.monotonic() + 10
+    while pool.stats()['15x15']['depth'] == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_batch_solutions_are_spanning_trees():
+    for width, height in ((1, 5), (7, 7), (20, 20)):
+        batch = puzzle_generator.generate_puzzle_batch_compact(width, height, 50, extra_edge_probability=0, seed=1)
+        assert len(batch) == 50
+        for shuffled, solution in batch:
+            tiles = sum(solution.cells)
+            assert solution.is_fully_solved()
+            assert sum(bin(mask).count('1') for mask in solution.masks) == 2 * (tiles - 1)
+            assert sorted(shuffled.masks) == sorted(solution.masks)
+
+
+def test_pool_default_returns_four_fields():
+    puzzle_id, shuffled, solution, rating = puzzle_pool.PuzzlePool(sizes=[]).get(4, 4)
+    assert puzzle_generator.parse_puzzle_id(puzzle_id)[:2] == (4, 4)
+    assert solution is not None and rating is not None
@@ -0,0 +1,39 @@
+# tests/test_solver.py
+# 求解器的回归测试：重尾的环形棋盘必须在时限内解出，大棋盘不能因递归深度失败
+
+import sys
+import time
+
+import pytest
+
+import puzzle_generator
+import solver
+from benchmarks.suites import _ring
+
+# 单次求解的时限（秒），远低于 job_executor.JOB_TIMEOUT
+RING_TIME_LIMIT = 5
+
+
+@pytest.mark.parametrize('size', [10, 15])
+@pytest.mark.parametrize('seed', range(5))
+def test_ring_solves_within_time_limit(size, seed):
+    shuffled, _ = puzzle_generator.generate_puzzle_from_shape_compact(_ring(size), seed=seed)
+    start = time.perf_counter()
+    solved = solver.solve_compact(shuffled)
+    elapsed = time.perf_counter() - start
+    assert solved is not None and solved.is_fully_solved()
+    assert sorted(solved.tile_masks()) == sorted(shuffled.tile_masks())
+    assert elapsed < RING_TIME_LIMIT
+
+
+def test_search_depth_beyond_recursion_limit():
+    height = sys.getrecursionlimit() + 200
+    shuffled, _ = puzzle_generator.generate_random_puzzle_compact(1, height, seed=0)
+    solved = solver.solve_compact(shuffled)
+    assert solved is not None and solved.is_fully_solved()
+
+
+def test_count_solutions_matches_unique_generator():
+    shuffled, _ = puzzle_generator.generate_random_puzzle_compact(4, 4, seed=1, unique=True)
+    result = solver.count_solutions(shuffled)
+    assert result.complete and result.count == 1
@@ -0,0 +1,90 @@
+# tests/test_swap_planner.py
+
+import random
+from collections import deque
+
+import pytest
+
+import puzzle_generator
+import swap_planner
+
+# 小棋盘上使用的几种石板（连接列表），类型少时更容易出现长环和多种环分解
+TILE_TYPES = ([1, 0, 1, 0], [0, 1, 0, 1], [1, 1, 0, 0], [0, 0, 1, 1])
+
+
+def _apply(grid, swaps):
+    grid = [list(row) for row in grid]
+    for (r1, c1), (r2, c2) in swaps:
+        grid[r1][c1], grid[r2][c2] = grid[r2][c2], grid[r1][c1]
+    return grid
+
+
+def _keys(grid):
+    return [[swap_planner._tile_key(tile) for tile in row] for row in grid]
+
+
+def _greedy_swaps(initial_grid, final_grid):
+    """原先的逐格贪心：按行优先找到第一个不一致的格子，从它之后找第一块需要的石板换过来。"""
+    current, target = _keys(initial_grid), _keys(final_grid)
+    rows, cols = len(current), len(current[0])
+    swaps = []
+    for r in range(rows):
+        for c in range(cols):
+            if current[r][c] == target[r][c]:
+                continue
+            found = next(((rs, cs) for rs in range(r, rows) for cs in range(c + 1 if rs == r else 0, cols)
+                          if current[rs][cs] == target[r][c]), None)
+            if found:
+                rs, cs = found
+                swaps.append([(r, c), (rs, cs)])
+                current[r][c], current[rs][cs] = current[rs][cs], current[r][c]
+    return swaps
+
+
+def _brute_force_swaps(initial, final):
+    """在所有排列上做 BFS，返回最少交换次数。"""
+    cols = len(initial[0])
+    start = tuple(key for row in _keys(initial) for key in row)
+    goal = tuple(key for row in _keys(final) for key in row)
+    distance = {start: 0}
+    queue = deque([start])
+    while queue:
+        state = queue.popleft()
+        if state == goal:
+            return distance[state]
+        for i in range(len(state)):
+            for j in range(i + 1, len(state)):
+                if state[i] == state[j]:
+                    continue
+                nxt = list(state)
+                nxt[i], nxt[j] = nxt[j], nxt[i]
+                nxt = tuple(nxt)
+                if nxt not in distance:
+                    distance[nxt] = distance[state] + 1
+                    queue.append(nxt)
+    raise AssertionError(f"unreachable goal for a {len(state) // cols}x{cols} board")
+
+
+@pytest.mark.parametrize('seed', range(60))
+def test_plan_is_optimal_on_small_boards(seed):
+    rng = random.Random(seed)
+    rows, cols = rng.choice([(2, 3), (2, 4), (3, 3)])
+    types = TILE_TYPES[:rng.choice([3, 4])]
+    tiles = [rng.choice(types) for _ in range(rows * cols)]
+    initial = [tiles[r * cols:(r + 1) * cols] for r in range(rows)]
+    rng.shuffle(tiles)
+    final = [tiles[r * cols:(r + 1) * cols] for r in range(rows)]
+    swaps = swap_planner.plan_swaps(initial, final)
+    assert _keys(_apply(initial, swaps)) == _keys(final)
+    assert len(swaps) == _brute_force_swaps(initial, final)
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_plan_never_longer_than_greedy(seed):
+    size = random.Random(seed).choice([3, 4, 5, 7, 10, 15, 20])
+    shuffled, solution = puzzle_generator.generate_random_puzzle_compact(size, size, seed=seed)
+    initial, final = shuffled.to_lists(), solution.to_lists()
+    for order in swap_planner.SWAP_ORDERS:
+        swaps = swap_planner.plan_swaps(initial, final, order)
+        assert _keys(_apply(initial, swaps)) == _keys(final)
+        assert len(swaps) <= len(_greedy_swaps(initial, final))
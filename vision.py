@@ -1,63 +1,105 @@
+import os
+
 import cv2
 import numpy as np
+
+import metrics
 from game_logic import Tile
 
+PATH_COLORS = [
+    (np.array([74, 88, 86]), 50),     # Gray path (BGR)
+    (np.array([238, 148, 46]), 50),   # Dark blue path (BGR)
+    (np.array([244, 244, 147]), 50),  # Light blue path (BGR)
+    (np.array([236, 221, 78]), 50)    # Cyan path (BGR)
+]
+BG_COLOR = (np.array([50, 85, 64]), 15)  # Background color (BGR)
+
+# 超过该边长的图片会先等比缩小再分析，None 表示不缩放
+MAX_ANALYSIS_DIMENSION = 1600
+# 每块石板被重采样成 TILE_SAMPLE_SIZE x TILE_SAMPLE_SIZE 后统一分类
+TILE_SAMPLE_SIZE = 40
+# 探测带：距离边缘 20% 附近、沿中线的一小块区域，路径像素占比超过阈值即认为该侧有连接
+PROBE_DEPTH = (0.15, 0.25)
+PROBE_WIDTH = (0.4, 0.6)
+PROBE_THRESHOLD = 0.5
+
+
+def _build_probe_bands(size):
+    """返回形状为 (4, size, size) 的 N、E、S、W 四个探测带掩码。"""
+    bands = np.zeros((4, size, size), dtype=np.float32)
+    d0, d1 = int(size * PROBE_DEPTH[0]), int(np.ceil(size * PROBE_DEPTH[1]))
+    w0, w1 = int(size * PROBE_WIDTH[0]), int(np.ceil(size * PROBE_WIDTH[1]))
+    bands[0, d0:d1, w0:w1] = 1                        # N
+    bands[1, w0:w1, size - d1:size - d0] = 1          # E
+    bands[2, size - d1:size - d0, w0:w1] = 1          # S
+    bands[3, w0:w1, d0:d1] = 1                        # W
+    return bands / bands.sum(axis=(1, 2), keepdims=True)
+
+
+_ANALYSIS_FAILURES = metrics.Counter(
+    'puzzle_vision_failures_total', "Images that could not be turned into a puzzle grid.", ['reason'])
+_RECOGNIZED_TILES = metrics.Histogram(
+    'puzzle_vision_tiles', "Tiles recognized per analyzed image.", buckets=(4, 9, 16, 25, 49, 100, 225))
+
+_PROBE_BANDS = _build_probe_bands(TILE_SAMPLE_SIZE)
+_PATH_COLOR_ARRAY = np.array([color for color, _ in PATH_COLORS], dtype=np.int16)
+_PATH_TOLERANCE_ARRAY = np.array([tolerance for _, tolerance in PATH_COLORS], dtype=np.int16)
+
+
+def _sample_tiles(img, boxes, size=TILE_SAMPLE_SIZE):
+    """
+    把所有石板区域按最近邻一次性重采样成 (N, size, size, 3) 的数组。
+    """
+    boxes = np.asarray(boxes, dtype=np.float32)
+    x, y, w, h = boxes[:, 0:1], boxes[:, 1:2], boxes[:, 2:3], boxes[:, 3:4]
+    steps = (np.arange(size, dtype=np.float32) + 0.5) / size
+    ys = np.minimum((y + h * steps).astype(np.intp), img.shape[0] - 1)
+    xs = np.minimum((x + w * steps).astype(np.intp), img.shape[1] - 1)
+    return img[ys[:, :, None], xs[:, None, :]]
+
 
-def _classify_tile_image(tile_mask_img):
+def _classify_tiles(tile_stack):
     """
-    根据给定的图像掩码，判断石板的连接。
+    对 (N, S, S, 3) 的石板数组批量分类，返回 (N, 4) 的 0/1 连接数组。
+    先判断每个像素是否落在任一路径颜色的容差内，再用探测带做一次加权求和。
     """
-    th, tw = tile_mask_img.shape
-    if th == 0 or tw == 0:
-        return (0, 0, 0, 0)
-    margin_h, margin_w = int(th * 0.20), int(tw * 0.20)
-    probe_points = {
-        "N": (margin_h, tw // 2),
-        "E": (th // 2, tw - margin_w),
-        "S": (th - margin_h, tw // 2),
-        "W": (th // 2, margin_w)
-    }
-    connections = [0, 0, 0, 0]
-    if tile_mask_img[probe_points["N"]] == 255:
-        connections[0] = 1
-    if tile_mask_img[probe_points["E"]] == 255:
-        connections[1] = 1
-    if tile_mask_img[probe_points["S"]] == 255:
-        connections[2] = 1
-    if tile_mask_img[probe_points["W"]] == 255:
-        connections[3] = 1
-    return tuple(connections)
-
-
-def analyze_image(image_path):
+    diff = np.abs(tile_stack[:, :, :, None, :].astype(np.int16) - _PATH_COLOR_ARRAY)
+    path_mask = (diff <= _PATH_TOLERANCE_ARRAY[:, None]).all(axis=-1).any(axis=-1)
+    coverage = np.einsum('nij,dij->nd', path_mask.astype(np.float32), _PROBE_BANDS)
+    return (coverage > PROBE_THRESHOLD).astype(np.uint8)
+
+
+def _load_image(source):
+    """从文件路径，或 bytes / bytearray / memoryview 等缓冲区加载 BGR 图像。"""
+    if isinstance(source, (str, os.PathLike)):
+        return cv2.imread(os.fspath(source))
+    # np.frombuffer 直接引用缓冲区的内存，不会复制上传的数据
+    return cv2.imdecode(np.frombuffer(memoryview(source), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def analyze_image(image, max_dimension=MAX_ANALYSIS_DIMENSION):
     """
     分析给定的图像，识别其中的谜题板并返回其表示。
+    image 可以是文件路径，也可以是编码后图像数据的缓冲区（bytes、memoryview 等）。
+    max_dimension 不为 None 时，较长边超过该值的图片会先缩小，保证高分辨率截图的处理时间有上限。
     """
     try:
-        img = cv2.imread(image_path)
+        img = _load_image(image)
         if img is None:
-            raise FileNotFoundError
-    except (FileNotFoundError, Exception) as e:
-        print(f"Error loading image '{image_path}': {e}")
+            raise ValueError("image could not be decoded")
+    except Exception as e:
+        source = image if isinstance(image, (str, os.PathLike)) else "<buffer>"
+        print(f"Error loading image '{source}': {e}")
+        _ANALYSIS_FAILURES.inc(reason='decode')
         return None
 
-    path_colors = [
-        (np.array([74, 88, 86]), 50),     # Gray path (BGR)
-        (np.array([238, 148, 46]), 50),   # Dark blue path (BGR)
-        (np.array([244, 244, 147]), 50),  # Light blue path (BGR)
-        (np.array([236, 221, 78]), 50)    # Cyan path (BGR)
-    ]
-    bg_color = (np.array([50, 85, 64]), 15)  # Background color (BGR)
-
-    all_paths_mask = np.zeros(img.shape[:2], dtype=np.uint8)
-    for color, tolerance in path_colors:
-        lower = np.maximum(0, color - tolerance).astype(np.uint8)
-        upper = np.minimum(255, color + tolerance).astype(np.uint8)
-        mask = cv2.inRange(img, lower, upper)
-        all_paths_mask = cv2.bitwise_or(all_paths_mask, mask)
-
-    lower_bg = np.maximum(0, bg_color[0] - bg_color[1]).astype(np.uint8)
-    upper_bg = np.minimum(255, bg_color[0] + bg_color[1]).astype(np.uint8)
+    if max_dimension is not None and max(img.shape[:2]) > max_dimension:
+        scale = max_dimension / max(img.shape[:2])
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    color, tolerance = BG_COLOR
+    lower_bg = np.maximum(0, color - tolerance).astype(np.uint8)
+    upper_bg = np.minimum(255, color + tolerance).astype(np.uint8)
     bg_mask = cv2.inRange(img, lower_bg, upper_bg)
     tiles_mask = cv2.bitwise_not(bg_mask)
     kernel = np.ones((5, 5), np.uint8)
@@ -74,6 +116,7 @@ def analyze_image(image_path):
                 tile_boxes.append((x, y, w, h))
 
     if not tile_boxes:
+        _ANALYSIS_FAILURES.inc(reason='no_tiles')
         return None
 
     avg_size = np.mean([b[2] for b in tile_boxes])
@@ -96,11 +139,15 @@ def analyze_image(image_path):
     max_r = max(pos[0] for pos in normalized_grid.keys())
     max_c = max(pos[1] for pos in normalized_grid.keys())
 
+    positions = list(normalized_grid.keys())
+    connections = _classify_tiles(_sample_tiles(img, [normalized_grid[pos] for pos in positions]))
+
     initial_board = [[None for _ in range(max_c + 1)] for _ in range(max_r + 1)]
-    for (r, c), (x, y, w, h) in normalized_grid.items():
-        tile_path_img = all_paths_mask[y:y + h, x:x + w]
-        connections = _classify_tile_image(tile_path_img)
-        if sum(connections) > 0:
-            initial_board[r][c] = Tile(connections)
+    recognized = 0
+    for (r, c), tile_connections in zip(positions, connections.tolist()):
+        if sum(tile_connections) > 0:
+            initial_board[r][c] = Tile(tile_connections)
+            recognized += 1
+    _RECOGNIZED_TILES.observe(recognized)
 
     return initial_board